@@ -0,0 +1,381 @@
+from typing import List, Optional
+import hashlib
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from bootstrap.ir.ir import Instr, FUSED_BRANCH_OPS, FUSED_BRANCH_IMM_OPS
+from bootstrap.ir.operands import Reg, Imm
+
+# c backend: lowers the allocated, linked code (what `lower` gets) to c, builds it with the system cc
+# and runs the executable. values are the tagged Value from forge_runtime.h, physical regs, frame slots
+# and spill slots are c locals of the function they belong to, blocks are goto labels.
+# only the numeric / string / call subset is compiled, anything else raises Unsupported and the caller
+# runs the program on the vm instead. at runtime the program exits with FORGE_BAIL whenever python
+# would have behaved differently, and is rerun on the vm too (it has no side effects besides stdout)
+
+RUNTIME_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNTIME_HEADER = os.path.join(RUNTIME_DIR, "forge_runtime.h")
+FORGE_BAIL = 86 # keep in sync with forge_runtime.h
+CC_FLAGS = ["-O2", "-w"]
+
+ARITH = {
+    "ADD": "op_add", "SUB": "op_sub", "MUL": "op_mul", "DIV": "op_div", "POW": "op_pow",
+    "ADD_NUM": "op_add", "SUB_NUM": "op_sub", "MUL_NUM": "op_mul", "DIV_NUM": "op_div", "POW_NUM": "op_pow",
+    "CONCAT_STR": "op_add",
+}
+
+IMM_ARITH = {"ADD_IMM": "op_add", "SUB_IMM": "op_sub", "MUL_IMM": "op_mul"}
+
+COMPARE = {
+    "EQ": "cmp_eq", "NE": "cmp_ne", "LT": "cmp_lt", "GT": "cmp_gt", "LE": "cmp_le", "GE": "cmp_ge",
+    "EQ_NUM": "cmp_eq", "NE_NUM": "cmp_ne", "LT_NUM": "cmp_lt", "GT_NUM": "cmp_gt", "LE_NUM": "cmp_le", "GE_NUM": "cmp_ge",
+}
+
+BRANCH_COMPARE = {f"JUMP_IF_NOT_{cmp}": f"cmp_{cmp.lower()}" for cmp in ("EQ", "NE", "LT", "GT", "LE", "GE")}
+
+C_BUILTINS = ("print", "println", "len", "str", "int", "float")
+
+class Unsupported(Exception):
+    pass
+
+def _reg(x):
+    return f"r{x.id}"
+
+def _c_string(data: bytes):
+    # octal escapes, a hex escape would swallow any hex digit after it
+    out = []
+    for byte in data:
+        ch = chr(byte)
+        if byte < 128 and (ch.isalnum() or ch in " _.,:;!?-+*/=()[]{}<>@#$%^&|~'"):
+            out.append(ch)
+        else:
+            out.append(f"\\{byte:03o}")
+    return '"' + "".join(out) + '"'
+
+class CCodegen:
+    def __init__(self, code: List[Instr]):
+        self.code = code
+        self.lines = []
+        self.strings = [] # static Str definitions
+
+        # functions are the LABEL .. next LABEL ranges of the flat code
+        starts = [i for i, instr in enumerate(code) if instr.op == "LABEL"]
+        self.functions = {} # label ip -> (c name, end ip)
+        for n, start in enumerate(starts):
+            end = starts[n + 1] if n + 1 < len(starts) else len(code)
+            self.functions[start] = (f"fn{n}", end)
+
+    def emit(self, line, depth=1):
+        self.lines.append("    " * depth + line)
+
+    def generate(self) -> str:
+        for start, (name, end) in self.functions.items():
+            label = self.code[start]
+            if getattr(label, "struct_names", None) is not None:
+                raise Unsupported("struct methods")
+
+        for start, (name, end) in self.functions.items():
+            self.gen_function(start, name, end)
+
+        main = next((name for start, (name, _) in self.functions.items() if self.code[start].a == "__main__"), None)
+        if main is None:
+            raise Unsupported("no __main__")
+
+        prototypes = [f"static Value {name}({self.params(start)});" for start, (name, _) in self.functions.items()]
+
+        return "\n".join([
+            '#include "forge_runtime.h"',
+            "",
+            *self.strings,
+            "",
+            *prototypes,
+            "",
+            *self.lines,
+            "int main(void) {",
+            "    static char buf[1 << 16];",
+            "    setvbuf(stdout, buf, _IOFBF, sizeof buf);",
+            f"    {main}();",
+            "    fflush(stdout);",
+            "    return 0;",
+            "}",
+            "",
+        ])
+
+    def params(self, start):
+        names = getattr(self.code[start], "param_names", ())
+        return ", ".join(f"Value l{i}" for i in range(len(names))) or "void"
+
+    def gen_function(self, start, name, end):
+        label = self.code[start]
+        self.start, self.end = start, end
+        self.is_main = label.a == "__main__"
+
+        body = range(start, end)
+        regs = set()
+        spills = set()
+        targets = set()
+        for ip in body:
+            instr = self.code[ip]
+            for x in (instr.a, instr.b, instr.c, *getattr(instr, "arg_regs", ())):
+                if isinstance(x, Reg):
+                    regs.add(x.id)
+            if instr.op == "CALL_BUILTIN" and isinstance(instr.b, list):
+                regs.update(r.id for r in instr.b)
+            if instr.op == "SPILL_STORE":
+                spills.add(instr.a)
+            elif instr.op == "SPILL_LOAD":
+                spills.add(instr.b)
+
+            target = self.jump_target(instr)
+            if target is not None and start <= target < end:
+                targets.add(target)
+            if instr.op == "TAIL_CALL" and instr.b == start:
+                targets.add(start) # self tail calls loop back to the top
+
+        self.lines.append(f"/* {label.a} */")
+        self.lines.append(f"static Value {name}({self.params(start)}) {{")
+
+        num_params = len(getattr(label, "param_names", ()))
+        for slot in range(num_params, len(getattr(label, "local_names", ()))):
+            self.emit(f"Value l{slot} = UNBOUND;")
+        for r in sorted(regs):
+            self.emit(f"Value r{r} = NONE;")
+        for s in sorted(spills):
+            self.emit(f"Value s{s} = NONE;")
+
+        for ip in body:
+            if ip in targets:
+                self.lines.append(f"L{ip}:;")
+            self.gen_instr(self.code[ip])
+
+        self.emit("return NONE;") # fell off the end of the program
+        self.lines.append("}")
+        self.lines.append("")
+
+    def jump_target(self, instr):
+        if instr.op == "JUMP":
+            return instr.a
+        if instr.op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE"):
+            return instr.b
+        if instr.op in FUSED_BRANCH_OPS or instr.op in FUSED_BRANCH_IMM_OPS:
+            return instr.c
+        return None
+
+    def goto(self, target):
+        if isinstance(target, int) and self.start <= target < self.end:
+            return f"goto L{target};"
+        return "return NONE;" # past the function, i.e. the end of the program
+
+    def const(self, x):
+        value = x.value if isinstance(x, Imm) else x
+
+        if type(value) is bool:
+            return f"mk_bool({int(value)})"
+        if type(value) is int:
+            if not -2**63 <= value < 2**63:
+                raise Unsupported("int constant wider than 64 bits")
+            return f"mk_int({value}LL)" if value != -2**63 else "mk_int(INT64_MIN)"
+        if type(value) is float:
+            if math.isnan(value):
+                return "mk_float(NAN)"
+            if math.isinf(value):
+                return "mk_float(INFINITY)" if value > 0 else "mk_float(-INFINITY)"
+            return f"mk_float({value.hex()})" # exact
+        if type(value) is str:
+            data = value.encode("utf-8")
+            self.strings.append(f"static const Str k{len(self.strings)} = {{ {len(data)}, {_c_string(data)} }};")
+            return f"mk_str(&k{len(self.strings) - 1})"
+        if value is None:
+            return "NONE"
+
+        raise Unsupported(f"constant of type {type(value).__name__}")
+
+    def gen_instr(self, instr):
+        op = instr.op
+        method = getattr(self, f"gen_{op}", None)
+        if method is not None:
+            return method(instr)
+
+        if op in ARITH:
+            self.emit(f"{_reg(instr.a)} = {ARITH[op]}({_reg(instr.b)}, {_reg(instr.c)});")
+        elif op in IMM_ARITH:
+            self.emit(f"{_reg(instr.a)} = {IMM_ARITH[op]}({_reg(instr.b)}, {self.const(instr.c)});")
+        elif op in COMPARE:
+            self.emit(f"{_reg(instr.a)} = mk_bool({COMPARE[op]}({_reg(instr.b)}, {_reg(instr.c)}));")
+        elif op in FUSED_BRANCH_OPS:
+            self.emit(f"if (!{BRANCH_COMPARE[op]}({_reg(instr.a)}, {_reg(instr.b)})) {self.goto(instr.c)}")
+        elif op in FUSED_BRANCH_IMM_OPS:
+            self.emit(f"if (!{BRANCH_COMPARE[op[:-len('_IMM')]]}({_reg(instr.a)}, {self.const(instr.b)})) {self.goto(instr.c)}")
+        else:
+            raise Unsupported(op) # modules, structs, lists, attributes
+
+    def gen_LABEL(self, instr):
+        pass
+
+    def gen_LOAD_CONST(self, instr):
+        self.emit(f"{_reg(instr.a)} = {self.const(instr.b)};")
+
+    def gen_LOAD_LOCAL(self, instr):
+        self.emit(f"{_reg(instr.a)} = check_bound(l{instr.b});")
+
+    def gen_STORE_LOCAL(self, instr):
+        self.emit(f"l{instr.a} = {_reg(instr.b)};")
+
+    def gen_INC_LOCAL(self, instr):
+        self.emit(f"l{instr.a} = op_add(check_bound(l{instr.a}), {self.const(instr.b)});")
+
+    def gen_MOVE(self, instr):
+        self.emit(f"{_reg(instr.a)} = {_reg(instr.b)};")
+
+    def gen_NEG(self, instr):
+        self.emit(f"{_reg(instr.a)} = op_neg({_reg(instr.b)});")
+
+    def gen_NOT(self, instr):
+        self.emit(f"{_reg(instr.a)} = mk_bool(!truthy({_reg(instr.b)}));")
+
+    def gen_AND(self, instr):
+        self.emit(f"{_reg(instr.a)} = truthy({_reg(instr.b)}) ? {_reg(instr.c)} : {_reg(instr.b)};")
+
+    def gen_JUMP(self, instr):
+        self.emit(self.goto(instr.a))
+
+    def gen_JUMP_IF_TRUE(self, instr):
+        self.emit(f"if (truthy({_reg(instr.a)})) {self.goto(instr.b)}")
+
+    def gen_JUMP_IF_FALSE(self, instr):
+        self.emit(f"if (!truthy({_reg(instr.a)})) {self.goto(instr.b)}")
+
+    def gen_SPILL_STORE(self, instr):
+        self.emit(f"s{instr.a} = {_reg(instr.b)};")
+
+    def gen_SPILL_LOAD(self, instr):
+        self.emit(f"{_reg(instr.a)} = s{instr.b};")
+
+    def gen_RETURN(self, instr):
+        if self.is_main:
+            self.emit("return NONE;") # a top level return halts the program
+        else:
+            self.emit(f"return {_reg(instr.a) if instr.a is not None else 'NONE'};")
+
+    def gen_CALL(self, instr):
+        target = instr.b
+        if target not in self.functions:
+            raise Unsupported(f"call to unresolved function '{instr.a}'")
+
+        name, _ = self.functions[target]
+        args = ", ".join(_reg(r) for r in getattr(instr, "arg_regs", ()))
+        if len(getattr(instr, "arg_regs", ())) != len(getattr(self.code[target], "param_names", ())):
+            raise Unsupported(f"call to '{instr.a}' with the wrong number of args")
+
+        if instr.c is None:
+            self.emit(f"{name}({args});")
+        else:
+            # like the vm's RETURN, a None result leaves the dest alone
+            self.emit(f"{{ Value t = {name}({args}); if (t.tag != T_NONE) {_reg(instr.c)} = t; }}")
+
+    def gen_TAIL_CALL(self, instr):
+        target = instr.b
+        if target not in self.functions:
+            raise Unsupported(f"call to unresolved function '{instr.a}'")
+
+        label = self.code[target]
+        arg_regs = getattr(instr, "arg_regs", ())
+        if len(arg_regs) != len(getattr(label, "param_names", ())):
+            raise Unsupported(f"call to '{instr.a}' with the wrong number of args")
+
+        name, _ = self.functions[target]
+        if target != self.start:
+            self.emit(f"return {name}({', '.join(_reg(r) for r in arg_regs)});") # cc -O2 turns it into a jump
+            return
+
+        # calling ourselves, rebind the params and start over with the other slots unbound, like a fresh frame
+        binds = "".join(f"l{i} = {_reg(r)}; " for i, r in enumerate(arg_regs))
+        resets = "".join(f"l{slot} = UNBOUND; " for slot in range(len(arg_regs), len(getattr(label, "local_names", ()))))
+        self.emit(f"{binds}{resets}goto L{target};")
+
+    def gen_CALL_BUILTIN(self, instr):
+        if instr.a not in C_BUILTINS:
+            raise Unsupported(f"builtin '{instr.a}'")
+
+        arg_regs = instr.b if isinstance(instr.b, list) else ([instr.b] if instr.b else [])
+        call = f"builtin_{instr.a}({len(arg_regs)}, argv)"
+        dest = f"{_reg(instr.c)} = " if instr.c is not None else ""
+
+        if arg_regs:
+            argv = ", ".join(_reg(r) for r in arg_regs)
+            self.emit(f"{{ Value argv[] = {{ {argv} }}; {dest}{call}; }}")
+        else:
+            self.emit(f"{dest}builtin_{instr.a}(0, NULL);")
+
+def generate_c(code: List[Instr]) -> str:
+    return CCodegen(code).generate()
+
+# executables are run straight out of the cache, so it has to be a directory only we can write to:
+# $XDG_CACHE_HOME/forge-cc (~/.cache/forge-cc), made 0700, and refused if someone else owns it
+def cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "forge-cc")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+
+    st = os.stat(path)
+    if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        raise Unsupported(f"{path} isn't private to this user")
+    return path
+
+def build(source: str) -> str:
+    # executables are cached by the hash of everything that goes into them
+    cc = shutil.which("cc")
+    if cc is None:
+        raise Unsupported("no cc on PATH")
+
+    with open(RUNTIME_HEADER, "rb") as f:
+        header = f.read()
+
+    key = hashlib.sha256(source.encode("utf-8") + header + " ".join(CC_FLAGS).encode()).hexdigest()[:24]
+    try:
+        directory = cache_dir()
+    except OSError as e:
+        raise Unsupported(f"no cache dir: {e}")
+    binary = os.path.join(directory, key)
+    if os.path.exists(binary):
+        return binary
+
+    # every build gets its own scratch dir, two builds of the same program never share a file
+    work = tempfile.mkdtemp(dir=directory)
+    try:
+        c_path = os.path.join(work, "program.c")
+        with open(c_path, "w", encoding="utf-8") as f:
+            f.write(source)
+
+        result = subprocess.run(
+            [cc, *CC_FLAGS, "-I", RUNTIME_DIR, "-o", os.path.join(work, "program"), c_path, "-lm"],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise Unsupported(f"cc failed: {result.stderr.strip()[:200]}")
+
+        os.replace(os.path.join(work, "program"), binary) # a half written binary is never picked up by the cache
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return binary
+
+def run_native(code: List[Instr]) -> Optional[str]:
+    # the program's output, or None when the vm has to run it
+    try:
+        binary = build(generate_c(code))
+
+    except Unsupported as e:
+        print(f"c backend: falling back to the vm ({e})", file=sys.stderr)
+        return None
+
+    result = subprocess.run([binary], capture_output=True)
+    if result.returncode != 0:
+        reason = "bailed out" if result.returncode == FORGE_BAIL else f"exit status {result.returncode}"
+        print(f"c backend: falling back to the vm ({reason})", file=sys.stderr)
+        return None
+
+    return result.stdout.decode("utf-8")
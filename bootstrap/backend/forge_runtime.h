@@ -0,0 +1,365 @@
+/* tagged values for the c backend (see cgen.py)
+ * every operation either gives exactly what the python vm would, or calls bail(), which exits with
+ * FORGE_BAIL so the driver throws the output away and reruns the program on the vm. that covers int
+ * overflow (python ints never overflow), division by zero, type errors and unbound slots, the vm then
+ * reports them the way it always has */
+#include <math.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define FORGE_BAIL 86
+
+enum { T_UNBOUND, T_NONE, T_BOOL, T_INT, T_FLOAT, T_STR };
+
+typedef struct {
+    int64_t len; /* bytes, utf-8 */
+    const char *data;
+} Str;
+
+typedef struct {
+    int tag;
+    union {
+        int64_t i; /* T_INT, T_BOOL */
+        double f;
+        const Str *s;
+    } u;
+} Value;
+
+static const Value UNBOUND = { T_UNBOUND, { 0 } };
+static const Value NONE = { T_NONE, { 0 } };
+
+static void bail(void) {
+    exit(FORGE_BAIL);
+}
+
+static inline Value mk_int(int64_t i) { Value v; v.tag = T_INT; v.u.i = i; return v; }
+static inline Value mk_float(double f) { Value v; v.tag = T_FLOAT; v.u.f = f; return v; }
+static inline Value mk_bool(int b) { Value v; v.tag = T_BOOL; v.u.i = b != 0; return v; }
+static inline Value mk_str(const Str *s) { Value v; v.tag = T_STR; v.u.s = s; return v; }
+
+static Value new_str(const char *data, int64_t len) {
+    Str *s = malloc(sizeof(Str) + len + 1);
+    if (!s) bail();
+    char *copy = (char *)(s + 1);
+    memcpy(copy, data, len);
+    copy[len] = 0;
+    s->len = len;
+    s->data = copy;
+    return mk_str(s);
+}
+
+/* bool is an int subclass in python, so it takes part in arithmetic as 0 / 1 */
+static inline int is_int(Value v) { return v.tag == T_INT || v.tag == T_BOOL; }
+static inline int is_num(Value v) { return v.tag == T_INT || v.tag == T_BOOL || v.tag == T_FLOAT; }
+
+/* int -> float is only exact up to 2^53, past that python and c could disagree on mixed compares */
+#define EXACT_LIMIT 9007199254740992LL
+
+static inline double as_float(Value v) {
+    if (v.tag == T_FLOAT) return v.u.f;
+    return (double)v.u.i;
+}
+
+static inline int truthy(Value v) {
+    switch (v.tag) {
+        case T_BOOL: case T_INT: return v.u.i != 0;
+        case T_FLOAT: return v.u.f != 0.0;
+        case T_STR: return v.u.s->len != 0;
+        case T_NONE: return 0;
+    }
+    bail();
+    return 0;
+}
+
+static inline Value check_bound(Value v) {
+    if (v.tag == T_UNBOUND) bail();
+    return v;
+}
+
+/* arithmetic */
+static inline Value op_add(Value a, Value b) {
+    if (is_int(a) && is_int(b)) {
+        int64_t r;
+        if (__builtin_add_overflow(a.u.i, b.u.i, &r)) bail();
+        return mk_int(r);
+    }
+    if (is_num(a) && is_num(b)) return mk_float(as_float(a) + as_float(b));
+    if (a.tag == T_STR && b.tag == T_STR) {
+        int64_t len = a.u.s->len + b.u.s->len;
+        char *buf = malloc(len + 1);
+        if (!buf) bail();
+        memcpy(buf, a.u.s->data, a.u.s->len);
+        memcpy(buf + a.u.s->len, b.u.s->data, b.u.s->len);
+        Value v = new_str(buf, len);
+        free(buf);
+        return v;
+    }
+    bail();
+    return NONE;
+}
+
+static inline Value op_sub(Value a, Value b) {
+    if (is_int(a) && is_int(b)) {
+        int64_t r;
+        if (__builtin_sub_overflow(a.u.i, b.u.i, &r)) bail();
+        return mk_int(r);
+    }
+    if (is_num(a) && is_num(b)) return mk_float(as_float(a) - as_float(b));
+    bail();
+    return NONE;
+}
+
+static inline Value op_mul(Value a, Value b) {
+    if (is_int(a) && is_int(b)) {
+        int64_t r;
+        if (__builtin_mul_overflow(a.u.i, b.u.i, &r)) bail();
+        return mk_int(r);
+    }
+    if (is_num(a) && is_num(b)) return mk_float(as_float(a) * as_float(b));
+    bail(); /* str * int repeats in python */
+    return NONE;
+}
+
+static inline Value op_div(Value a, Value b) {
+    if (!is_num(a) || !is_num(b)) bail();
+    if (is_int(a) && is_int(b)) {
+        /* python divides big ints exactly, small ones agree with a double divide */
+        if (a.u.i > EXACT_LIMIT || a.u.i < -EXACT_LIMIT || b.u.i > EXACT_LIMIT || b.u.i < -EXACT_LIMIT) bail();
+    }
+    double d = as_float(b);
+    if (d == 0.0) bail(); /* ZeroDivisionError */
+    return mk_float(as_float(a) / d);
+}
+
+static Value op_pow(Value a, Value b) {
+    if (!is_num(a) || !is_num(b)) bail();
+    if (is_int(a) && is_int(b)) {
+        if (b.u.i < 0) {
+            if (a.u.i == 0) bail();
+            return mk_float(pow((double)a.u.i, (double)b.u.i));
+        }
+        int64_t base = a.u.i, exp = b.u.i, r = 1;
+        while (exp) {
+            if (exp & 1 && __builtin_mul_overflow(r, base, &r)) bail();
+            exp >>= 1;
+            if (exp && __builtin_mul_overflow(base, base, &base)) bail();
+        }
+        return mk_int(r);
+    }
+    double x = as_float(a), y = as_float(b);
+    if (x == 0.0 && y < 0.0) bail();
+    if (x < 0.0 && y != floor(y)) bail(); /* complex result */
+    double r = pow(x, y);
+    if (isinf(r) && isfinite(x) && isfinite(y)) bail(); /* OverflowError */
+    return mk_float(r);
+}
+
+static inline Value op_neg(Value a) {
+    if (is_int(a)) {
+        if (a.u.i == INT64_MIN) bail();
+        return mk_int(-a.u.i);
+    }
+    if (a.tag == T_FLOAT) return mk_float(-a.u.f);
+    bail();
+    return NONE;
+}
+
+/* comparisons, mixed int / float only while the int converts exactly */
+static inline void check_mixed(Value a, Value b) {
+    if (a.tag == T_FLOAT && is_int(b) && (b.u.i > EXACT_LIMIT || b.u.i < -EXACT_LIMIT)) bail();
+    if (b.tag == T_FLOAT && is_int(a) && (a.u.i > EXACT_LIMIT || a.u.i < -EXACT_LIMIT)) bail();
+}
+
+static inline int str_cmp(const Str *a, const Str *b) {
+    /* byte order of utf-8 is code point order, which is what python compares */
+    int64_t n = a->len < b->len ? a->len : b->len;
+    int c = memcmp(a->data, b->data, n);
+    if (c) return c;
+    return (a->len > b->len) - (a->len < b->len);
+}
+
+static inline int cmp_eq(Value a, Value b) {
+    if (is_int(a) && is_int(b)) return a.u.i == b.u.i;
+    if (is_num(a) && is_num(b)) { check_mixed(a, b); return as_float(a) == as_float(b); }
+    if (a.tag == T_STR && b.tag == T_STR) return str_cmp(a.u.s, b.u.s) == 0;
+    if (a.tag == T_NONE && b.tag == T_NONE) return 1;
+    return 0;
+}
+
+#define ORDER_CMP(name, OP) \
+    static inline int name(Value a, Value b) { \
+        if (is_int(a) && is_int(b)) return a.u.i OP b.u.i; \
+        if (is_num(a) && is_num(b)) { check_mixed(a, b); return as_float(a) OP as_float(b); } \
+        if (a.tag == T_STR && b.tag == T_STR) return str_cmp(a.u.s, b.u.s) OP 0; \
+        bail(); \
+        return 0; \
+    }
+
+ORDER_CMP(cmp_lt, <)
+ORDER_CMP(cmp_gt, >)
+ORDER_CMP(cmp_le, <=)
+ORDER_CMP(cmp_ge, >=)
+
+static inline int cmp_ne(Value a, Value b) { return !cmp_eq(a, b); }
+
+/* python's str(): shortest repr for floats, True / False, None */
+static int format_float(double x, char *out) {
+    if (isnan(x)) return sprintf(out, "nan");
+    if (isinf(x)) return sprintf(out, x > 0 ? "inf" : "-inf");
+    if (x == 0.0) return sprintf(out, signbit(x) ? "-0.0" : "0.0");
+
+    char buf[40];
+    for (int prec = 1; prec <= 17; prec++) {
+        snprintf(buf, sizeof buf, "%.*e", prec - 1, x);
+        if (strtod(buf, NULL) == x) break;
+    }
+
+    /* buf is [-]d[.ddd]e[+-]xx, split it into digits and a decimal exponent */
+    char digits[20];
+    int n = 0, neg = 0;
+    const char *p = buf;
+    if (*p == '-') { neg = 1; p++; }
+    for (; *p != 'e'; p++) {
+        if (*p != '.') digits[n++] = *p;
+    }
+    int exp = atoi(p + 1);
+    while (n > 1 && digits[n - 1] == '0') n--;
+
+    char *o = out;
+    if (neg) *o++ = '-';
+
+    if (exp < -4 || exp >= 16) {
+        *o++ = digits[0];
+        if (n > 1) {
+            *o++ = '.';
+            memcpy(o, digits + 1, n - 1);
+            o += n - 1;
+        }
+        o += sprintf(o, "e%c%02d", exp < 0 ? '-' : '+', exp < 0 ? -exp : exp);
+    }
+    else if (exp < 0) {
+        *o++ = '0';
+        *o++ = '.';
+        for (int i = -1; i > exp; i--) *o++ = '0';
+        memcpy(o, digits, n);
+        o += n;
+    }
+    else {
+        for (int i = 0; i <= exp; i++) *o++ = i < n ? digits[i] : '0';
+        *o++ = '.';
+        if (n > exp + 1) {
+            memcpy(o, digits + exp + 1, n - exp - 1);
+            o += n - exp - 1;
+        }
+        else {
+            *o++ = '0';
+        }
+    }
+
+    *o = 0;
+    return (int)(o - out);
+}
+
+static Value to_str(Value v) {
+    char buf[64];
+    int n;
+    switch (v.tag) {
+        case T_STR: return v;
+        case T_INT: n = sprintf(buf, "%lld", (long long)v.u.i); break;
+        case T_BOOL: n = sprintf(buf, v.u.i ? "True" : "False"); break;
+        case T_FLOAT: n = format_float(v.u.f, buf); break;
+        case T_NONE: n = sprintf(buf, "None"); break;
+        default: bail(); return NONE;
+    }
+    return new_str(buf, n);
+}
+
+static void write_value(Value v) {
+    if (v.tag == T_STR) {
+        fwrite(v.u.s->data, 1, v.u.s->len, stdout);
+        return;
+    }
+    Value s = to_str(v);
+    fwrite(s.u.s->data, 1, s.u.s->len, stdout);
+    free((void *)s.u.s);
+}
+
+/* builtins, the ones that touch files or stdin never get here, those programs stay on the vm */
+static Value builtin_print(int argc, const Value *argv) {
+    for (int i = 0; i < argc; i++) {
+        if (i) fputc(' ', stdout);
+        write_value(argv[i]);
+    }
+    return NONE;
+}
+
+static Value builtin_println(int argc, const Value *argv) {
+    builtin_print(argc, argv);
+    fputc('\n', stdout);
+    return NONE;
+}
+
+static Value builtin_len(int argc, const Value *argv) {
+    if (argc != 1 || argv[0].tag != T_STR) bail();
+    /* code points, not bytes */
+    int64_t n = 0;
+    const Str *s = argv[0].u.s;
+    for (int64_t i = 0; i < s->len; i++) {
+        if ((s->data[i] & 0xC0) != 0x80) n++;
+    }
+    return mk_int(n);
+}
+
+static Value builtin_str(int argc, const Value *argv) {
+    if (argc != 1) bail();
+    return to_str(argv[0]);
+}
+
+static Value builtin_int(int argc, const Value *argv) {
+    if (argc != 1) bail();
+    Value v = argv[0];
+    if (is_int(v)) return mk_int(v.u.i);
+    if (v.tag == T_FLOAT) {
+        if (!isfinite(v.u.f) || v.u.f >= 9.2e18 || v.u.f <= -9.2e18) bail();
+        return mk_int((int64_t)v.u.f);
+    }
+    if (v.tag == T_STR) {
+        /* plain [ws][sign]digits[ws] only, anything fancier is left to python */
+        const char *p = v.u.s->data, *end = p + v.u.s->len;
+        while (p < end && (*p == ' ' || *p == '\t' || *p == '\n')) p++;
+        int neg = 0;
+        if (p < end && (*p == '+' || *p == '-')) neg = *p++ == '-';
+        if (p == end || *p < '0' || *p > '9') bail();
+        int64_t r = 0;
+        while (p < end && *p >= '0' && *p <= '9') {
+            if (__builtin_mul_overflow(r, 10, &r) || __builtin_add_overflow(r, *p - '0', &r)) bail();
+            p++;
+        }
+        while (p < end && (*p == ' ' || *p == '\t' || *p == '\n')) p++;
+        if (p != end) bail();
+        return mk_int(neg ? -r : r);
+    }
+    bail();
+    return NONE;
+}
+
+static Value builtin_float(int argc, const Value *argv) {
+    if (argc != 1) bail();
+    Value v = argv[0];
+    if (is_num(v)) return mk_float(as_float(v));
+    if (v.tag == T_STR) {
+        const char *p = v.u.s->data;
+        for (int64_t i = 0; i < v.u.s->len; i++) {
+            if (!strchr("0123456789.eE+- ", p[i])) bail();
+        }
+        char *end;
+        double f = strtod(p, &end);
+        while (*end == ' ') end++;
+        if (end == p || *end) bail();
+        return mk_float(f);
+    }
+    bail();
+    return NONE;
+}
@@ -0,0 +1,582 @@
+from types import FunctionType
+from typing import Dict
+import math
+import os
+import re
+import sys
+
+from bootstrap.exceptions import RuntimeError, LabelNotFoundError
+from bootstrap.ir.cfg import CFG
+from bootstrap.ir.cfg_builder import branch_target, BRANCH_OPS
+from bootstrap.ir.operands import Imm
+from bootstrap.runtime.builtins_registry import BUILTINS
+from bootstrap.runtime.methods import resolve_member
+from bootstrap.runtime.modules import MODULES, ModuleNamespace
+from bootstrap.runtime.regalloc import NUM_REGS
+from bootstrap.runtime.structs import StructRecord, record_type
+
+# python backend: every forge function in the cfg becomes one python function, so CPython's own
+# eval loop runs the program instead of the vm's dispatch loop.
+#   r<id>    - virtual registers (this runs before allocation, so every reg is its own local)
+#   l_<name> - frame slots, v_<name> - names only the runtime knows (import aliases)
+# blocks that are only ever fallen into are emitted inline after their predecessor, the rest become
+# arms of a `while True` / `if _bb == ...` chain, loop headers first since they are hit the most
+
+# forge recursion lives on the python stack here, past this many frames the program is rerun on the vm.
+# a forge method call goes through _call_method and takes two frames and ~365 bytes of C stack on
+# CPython 3.11 (a plain call none), overflowing that segfaults before RecursionError can fire, so the
+# limit is what the stack holds at PY_FRAME_BYTES a frame
+PY_RECURSION_LIMIT = 100_000
+PY_FRAME_BYTES = 400
+
+def recursion_limit():
+    try:
+        import resource
+        stack, _ = resource.getrlimit(resource.RLIMIT_STACK)
+    except (ImportError, ValueError, OSError):
+        return sys.getrecursionlimit() # no way to tell, so nothing past what python already allows
+    if stack == resource.RLIM_INFINITY:
+        return PY_RECURSION_LIMIT
+    return max(1000, min(PY_RECURSION_LIMIT, stack // PY_FRAME_BYTES))
+
+BINARY = {
+    "ADD": "+", "SUB": "-", "MUL": "*", "DIV": "/", "POW": "**",
+    "ADD_NUM": "+", "SUB_NUM": "-", "MUL_NUM": "*", "DIV_NUM": "/", "POW_NUM": "**", "CONCAT_STR": "+",
+    "EQ": "==", "NE": "!=", "LT": "<", "GT": ">", "LE": "<=", "GE": ">=",
+    "EQ_NUM": "==", "NE_NUM": "!=", "LT_NUM": "<", "GT_NUM": ">", "LE_NUM": "<=", "GE_NUM": ">=",
+    "AND": "and",
+}
+
+BRANCH_CMP = {
+    "JUMP_IF_NOT_EQ": "==", "JUMP_IF_NOT_NE": "!=", "JUMP_IF_NOT_LT": "<",
+    "JUMP_IF_NOT_GT": ">", "JUMP_IF_NOT_LE": "<=", "JUMP_IF_NOT_GE": ">=",
+}
+
+def _ident(name):
+    return re.sub(r"\W", "_", name)
+
+def _reg(x):
+    return f"r{x.id}"
+
+# what one compiled program or module needs besides its python source
+class PyUnit:
+    def __init__(self, source, functions, struct_defs, methods, constants):
+        self.source = source
+        self.functions = functions     # label -> python function name
+        self.struct_defs = struct_defs # (name, fields), hoisted like the vm does
+        self.methods = methods         # (struct, method, label)
+        self.constants = constants     # _k<i> globals
+        self.code = compile(source, "<forge>", "exec")
+
+    def load(self, runtime, merge_structs=False):
+        namespace = runtime.globals()
+        namespace.update((f"_k{i}", value) for i, value in enumerate(self.constants))
+        exec(self.code, namespace)
+
+        for name, fields in self.struct_defs:
+            cls = record_type(name, fields)
+            if merge_structs:
+                runtime.structs.setdefault(name, cls) # the importer's own struct wins, like the vm
+            else:
+                runtime.structs[name] = cls
+
+        for struct_name, method_name, label in self.methods:
+            runtime.struct_methods.setdefault(struct_name, {})[method_name] = namespace[self.functions[label]]
+
+        return namespace
+
+class PyCodegen:
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        self.lines = []
+        self.constants = [] # anything repr can't round trip, loaded as globals
+        self.functions = {}
+        self.struct_defs = []
+        self.methods = []
+        
+        # dead store elimination shrinks blocks in place, so a block falls into the next one in the
+        # list, not into start + len(instrs)
+        self.fallthrough = {}
+        for bb, next_bb in zip(cfg.blocks, cfg.blocks[1:] + [None]):
+            self.fallthrough[bb.start] = next_bb.start if next_bb is not None else None
+
+    def emit(self, depth, line):
+        self.lines.append("    " * depth + line)
+
+    def generate(self) -> PyUnit:
+        groups = []
+        for bb in self.cfg.blocks:
+            if bb.instrs and bb.instrs[0].op == "LABEL":
+                groups.append([])
+            if groups:
+                groups[-1].append(bb)
+
+        for i, blocks in enumerate(groups):
+            label = blocks[0].instrs[0]
+            self.functions[label.a] = f"fn{i}_{_ident(label.a)}"
+            if getattr(label, "struct_names", None) is not None:
+                self.methods.append((label.struct_names, label.a[len(label.struct_names) + 1:], label.a))
+
+        for blocks in groups:
+            self.gen_function(blocks)
+
+        return PyUnit("\n".join(self.lines) + "\n", self.functions, self.struct_defs, self.methods, self.constants)
+
+    def const(self, value):
+        if type(value) in (int, str, bool) or value is None or (type(value) is float and math.isfinite(value)):
+            return repr(value)
+
+        self.constants.append(value)
+        return f"_k{len(self.constants) - 1}"
+
+    def gen_function(self, blocks):
+        label = blocks[0].instrs[0]
+        self.current = {bb.start: bb for bb in blocks}
+        self.is_main = label.a == "__main__"
+
+        params = [f"l_{_ident(p)}" for p in getattr(label, "param_names", ())]
+        self.emit(0, f"def {self.functions[label.a]}({', '.join(params)}):")
+
+        # a self tail call becomes a jump back to the entry with the params rebound, only when the
+        # params are all the slots there are, python has no way to unbind the rest again
+        self.label = label.a
+        self.params = params
+        self.tail_loops = len(params) == len(getattr(label, "local_names", ()))
+
+        # a block gets an arm if anything jumps to it, everything else is only ever fallen into
+        targets = set()
+        back_edges = []
+        for bb in blocks:
+            last = bb.instrs[-1] if bb.instrs else None
+            if last is None:
+                continue
+            target = None
+            if last.op == "JUMP":
+                target = last.a
+            elif last.op in BRANCH_OPS:
+                target = branch_target(last)
+            elif last.op == "TAIL_CALL" and last.a == label.a and self.tail_loops:
+                target = blocks[0].start
+            if target in self.current:
+                targets.add(target)
+                if target <= bb.start:
+                    back_edges.append((target, bb.start))
+
+        # innermost loops first, every arm before the one that matches costs a compare
+        def loop_depth(start):
+            return sum(1 for header, tail in back_edges if header <= start <= tail)
+
+        entry = self.current_entry = blocks[0].start
+        arms = sorted({entry} | targets, key=lambda start: (-loop_depth(start), start))
+        self.arms = set(arms)
+
+        self.emit(1, "try:")
+        if len(arms) == 1 and entry not in targets:
+            self.gen_chain(entry, 2)
+
+        else:
+            self.emit(2, f"_bb = {entry}")
+            self.emit(2, "while True:")
+            for i, start in enumerate(arms):
+                self.emit(3, f"{'if' if i == 0 else 'elif'} _bb == {start}:")
+                self.gen_chain(start, 4)
+
+        # a slot read before anything was stored to it, a NameError when no store to it is left at all
+        self.emit(1, "except NameError as e:")
+        self.emit(2, "raise _undefined(e) from None")
+        self.emit(0, "")
+
+    def gen_goto(self, target, depth):
+        if target in self.arms:
+            self.emit(depth, f"_bb = {target}")
+            self.emit(depth, "continue")
+
+        elif target in self.current:
+            self.gen_chain(target, depth)
+
+        else:
+            self.gen_exit(depth)
+
+    def gen_exit(self, depth):
+        # falling off the end of the program, a module's exports are its top level names
+        if self.is_main:
+            self.emit(depth, "return _exports(locals())")
+        else:
+            self.emit(depth, "return None")
+
+    # one block, then whatever it falls into, until something leaves
+    def gen_chain(self, start, depth):
+        while True:
+            bb = self.current[start]
+            for instr in bb.instrs[:-1]:
+                self.gen_instr(instr, depth)
+
+            last = bb.instrs[-1] if bb.instrs else None # dead store elimination can empty a block
+            end = self.fallthrough[bb.start]
+
+            if last is None:
+                pass
+
+            elif last.op == "JUMP":
+                self.gen_goto(last.a, depth)
+                return
+
+            elif last.op in ("RETURN", "TAIL_CALL"):
+                self.gen_instr(last, depth)
+                return
+
+            elif last.op in BRANCH_OPS:
+                self.emit(depth, f"if {self.branch_test(last)}:")
+                self.gen_goto(branch_target(last), depth + 1)
+
+            else:
+                self.gen_instr(last, depth)
+
+            # fall through
+            if end in self.arms or end not in self.current:
+                self.gen_goto(end, depth)
+                return
+
+            start = end
+
+    def branch_test(self, instr):
+        # true when the branch is taken
+        if instr.op == "JUMP_IF_TRUE":
+            return _reg(instr.a)
+        if instr.op == "JUMP_IF_FALSE":
+            return f"not {_reg(instr.a)}"
+
+        # `not (x < y)` so nan behaves like the vm
+        return f"not ({_reg(instr.a)} {BRANCH_CMP[instr.op]} {_reg(instr.b)})"
+
+    def gen_instr(self, instr, depth):
+        method = getattr(self, f"gen_{instr.op}", None)
+        if method is not None:
+            return method(instr, depth)
+
+        if instr.op in BINARY:
+            self.emit(depth, f"{_reg(instr.a)} = {_reg(instr.b)} {BINARY[instr.op]} {_reg(instr.c)}")
+            return
+
+        raise NotImplementedError(f"python backend has no lowering for {instr.op}")
+
+    def gen_LABEL(self, instr, depth):
+        pass
+
+    def gen_LOAD_CONST(self, instr, depth):
+        value = instr.b.value if isinstance(instr.b, Imm) else instr.b
+        self.emit(depth, f"{_reg(instr.a)} = {self.const(value)}")
+
+    def gen_LOAD_VAR(self, instr, depth):
+        self.emit(depth, f"{_reg(instr.a)} = v_{_ident(instr.b)}")
+
+    def gen_STORE_VAR(self, instr, depth):
+        self.emit(depth, f"v_{_ident(instr.a)} = {_reg(instr.b)}")
+
+    def gen_LOAD_LOCAL(self, instr, depth):
+        self.emit(depth, f"{_reg(instr.a)} = l_{_ident(instr.c)}")
+
+    def gen_STORE_LOCAL(self, instr, depth):
+        self.emit(depth, f"l_{_ident(instr.c)} = {_reg(instr.b)}")
+
+    def gen_MOVE(self, instr, depth):
+        self.emit(depth, f"{_reg(instr.a)} = {_reg(instr.b)}")
+
+    def gen_NEG(self, instr, depth):
+        self.emit(depth, f"{_reg(instr.a)} = -{_reg(instr.b)}")
+
+    def gen_NOT(self, instr, depth):
+        self.emit(depth, f"{_reg(instr.a)} = not {_reg(instr.b)}")
+
+    def gen_GET_ATTR(self, instr, depth):
+        self.emit(depth, f"{_reg(instr.a)} = _get_attr({_reg(instr.b)}, {instr.c!r})")
+
+    def gen_GET_FIELD(self, instr, depth):
+        self.emit(depth, f"{_reg(instr.a)} = {_reg(instr.b)}[{instr.c}]")
+
+    def gen_CALL_METHOD(self, instr, depth):
+        args = ", ".join(_reg(r) for r in getattr(instr, "arg_regs", ()))
+        self.emit(depth, f"{_reg(instr.a)} = _call_method({_reg(instr.b)}, {instr.c!r}, [{args}])")
+
+    def gen_CALL(self, instr, depth):
+        args = ", ".join(_reg(r) for r in getattr(instr, "arg_regs", ()))
+        dest = f"{_reg(instr.c)} = " if instr.c is not None else ""
+
+        if instr.a in BUILTINS:
+            self.emit(depth, f"{dest}_builtins[{instr.a!r}].call(_rt, [{args}])")
+        elif instr.a in self.functions:
+            self.emit(depth, f"{dest}{self.functions[instr.a]}({args})")
+        else:
+            self.emit(depth, f"_label_not_found({instr.a!r})")
+
+    def gen_TAIL_CALL(self, instr, depth):
+        arg_regs = getattr(instr, "arg_regs", ())
+        if instr.a == self.label and self.tail_loops and len(arg_regs) == len(self.params):
+            for param, r in zip(self.params, arg_regs):
+                self.emit(depth, f"{param} = {_reg(r)}")
+            self.gen_goto(self.current_entry, depth)
+        elif instr.a in self.functions:
+            self.emit(depth, f"return {self.functions[instr.a]}({', '.join(_reg(r) for r in arg_regs)})")
+        else:
+            self.emit(depth, f"_label_not_found({instr.a!r})")
+
+    def gen_CALL_BUILTIN(self, instr, depth):
+        arg_regs = instr.b if isinstance(instr.b, list) else ([instr.b] if instr.b else [])
+        args = ", ".join(_reg(r) for r in arg_regs)
+        dest = f"{_reg(instr.c)} = " if instr.c is not None else ""
+        self.emit(depth, f"{dest}_builtins[{instr.a!r}].call(_rt, [{args}])")
+
+    def gen_IMPORT_MODULE(self, instr, depth):
+        self.emit(depth, f"v_{_ident(instr.a)} = _rt.import_module({instr.b!r})")
+
+    def gen_RETURN(self, instr, depth):
+        if self.is_main:
+            self.gen_exit(depth) # a top level return halts the program
+        elif instr.a is not None:
+            self.emit(depth, f"return {_reg(instr.a)}")
+        else:
+            self.emit(depth, "return None")
+
+    def gen_BUILD_LIST(self, instr, depth):
+        elements = ", ".join(_reg(r) for r in getattr(instr, "arg_regs", ()))
+        self.emit(depth, f"{_reg(instr.a)} = [{elements}]")
+
+    def gen_BUILD_STRUCT(self, instr, depth):
+        fields = "".join(f"{_reg(r)}, " for r in getattr(instr, "arg_regs", ()))
+        self.emit(depth, f"{_reg(instr.a)} = _build_struct({instr.b!r}, ({fields}))")
+
+    def gen_STRUCT_DEF(self, instr, depth):
+        # hoisted, see PyUnit.load
+        self.struct_defs.append((instr.a, tuple(getattr(instr, "fields", ()))))
+
+# builtins a rerun on the vm would do a second time, see PyRuntime.run
+IMPURE_BUILTINS = ("input", "write_file", "append_file")
+
+# stdout while the program could still be rerun on the vm, counts what it printed so the rerun can
+# skip that much of its own output
+class _Counted:
+    def __init__(self, stream):
+        self.stream = stream
+        self.written = 0
+
+    def write(self, text):
+        self.written += len(text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+# stdout for the vm rerun after a fallback, the python run already printed the first `skip` characters
+# and nothing impure ran before it gave up, so the rerun prints the same ones again
+class SkipOutput:
+    def __init__(self, skip):
+        self.skip = skip
+        self.stream = None
+
+    def __enter__(self):
+        if self.skip:
+            self.stream = sys.stdout
+            sys.stdout = self
+        return self
+
+    def __exit__(self, *exc):
+        if sys.stdout is self:
+            sys.stdout = self.stream
+
+    def write(self, text):
+        cut = min(self.skip, len(text))
+        self.skip -= cut
+        if not self.skip:
+            sys.stdout = self.stream # caught up, the rest goes straight through
+        return self.stream.write(text[cut:])
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class _Impure:
+    __slots__ = ("builtin",)
+
+    def __init__(self, builtin):
+        self.builtin = builtin
+
+    def call(self, rt, args):
+        rt.release()
+        return self.builtin.call(rt, args)
+
+# the per-run state every loaded unit shares, the python backend's answer to the VM object
+class PyRuntime:
+    def __init__(self, num_regs=NUM_REGS, source_dir="."):
+        self.num_regs = num_regs # only so imported modules go through MODULES the same way as the vm
+        self.source_dir = source_dir
+        self.structs = {}        # struct name -> record class
+        self.struct_methods = {} # struct name -> method name -> python function
+        self.namespaces = {}     # module path -> ModuleNamespace
+        self.builtins = {name: _Impure(b) if name in IMPURE_BUILTINS else b for name, b in BUILTINS.items()}
+        self.output = None       # counts stdout while the program could still be rerun on the vm
+        self.written = 0         # what it had printed when it fell back
+
+    def globals(self):
+        return {
+            "_rt": self,
+            "_builtins": self.builtins,
+            "_get_attr": self.get_attr,
+            "_call_method": self.call_method,
+            "_build_struct": self.build_struct,
+            "_exports": _exports,
+            "_undefined": _undefined,
+            "_label_not_found": _label_not_found,
+        }
+
+    # False when the program recursed deeper than the python stack allows, and has to be rerun on the
+    # vm (which keeps its frames in a list). output goes straight through, counted in `written` so the
+    # rerun skips it, unless the program already did something a rerun would repeat
+    def run(self, unit: PyUnit):
+        namespace = unit.load(self)
+
+        limit = sys.getrecursionlimit()
+        depth = recursion_limit()
+        sys.setrecursionlimit(depth)
+        self.output = _Counted(sys.stdout)
+        sys.stdout = self.output
+        try:
+            namespace[unit.functions["__main__"]]()
+
+        except RecursionError:
+            if self.output is None:
+                raise RuntimeError(message=(
+                    f"recursion deeper than the python backend allows ({depth} python frames), "
+                    f"run it on the vm instead"
+                ))
+            self.written = self.output.written
+            return False
+
+        finally:
+            sys.setrecursionlimit(limit)
+            self.release()
+
+        return True
+
+    # stop counting output, from here on the program can't be rerun
+    def release(self):
+        if self.output is None:
+            return
+        sys.stdout = self.output.stream
+        self.output = None
+
+    def import_module(self, module_name):
+        module = MODULES.load(module_name, self.source_dir)
+        if module is None:
+            path = os.path.join(self.source_dir, f"{module_name}.fg")
+            raise RuntimeError(message=f"Module '{module_name}' not found at '{path}'")
+
+        key = os.path.abspath(module.path)
+        namespace = self.namespaces.get(key)
+        if namespace is not None:
+            return namespace
+
+        unit = compile_module(module, self.num_regs, self.source_dir)
+        loaded = unit.load(self, merge_structs=True)
+
+        # a module's top level runs once per run, every later import shares its namespace
+        exports = loaded[unit.functions["__main__"]]()
+        methods = {label for _, _, label in unit.methods}
+        for label, name in unit.functions.items():
+            if label != "__main__" and label not in methods:
+                exports[label] = loaded[name]
+
+        namespace = ModuleNamespace(module_name, exports)
+        self.namespaces[key] = namespace
+        return namespace
+
+    def get_attr(self, obj, attr_name):
+        if type(obj) is ModuleNamespace:
+            if attr_name not in obj.exports:
+                raise RuntimeError(message=f"Module '{obj.name}' has no export '{attr_name}'")
+            return obj.exports[attr_name]
+
+        if isinstance(obj, StructRecord):
+            offset = obj.__offsets__.get(attr_name)
+            if offset is None:
+                raise RuntimeError(message=f"Struct has no field '{attr_name}'")
+            return obj[offset]
+
+        try:
+            return resolve_member(obj, attr_name)(obj, [])
+
+        except AttributeError as e:
+            raise RuntimeError(message=str(e))
+
+    def call_method(self, obj, method_name, args):
+        if type(obj) is ModuleNamespace:
+            func = obj.exports.get(method_name)
+            if type(func) is FunctionType:
+                return func(*args)
+
+            raise RuntimeError(message=f"Module '{obj.name}' has no function '{method_name}'")
+
+        if isinstance(obj, StructRecord):
+            method = self.struct_methods.get(obj.__type__, {}).get(method_name)
+            if method is not None:
+                return method(obj, *args) # self is always the first param
+
+        try:
+            member = resolve_member(obj, method_name)
+
+        except AttributeError as e:
+            raise RuntimeError(message=str(e))
+
+        try:
+            return member(obj, args)
+
+        except (AttributeError, TypeError, NotImplementedError) as e:
+            raise RuntimeError(message=str(e))
+
+    def build_struct(self, struct_name, values):
+        record = self.structs.get(struct_name)
+        if record is None:
+            raise RuntimeError(message=f"Unknown struct '{struct_name}'")
+        return record(values)
+
+def _exports(frame):
+    # vars first, slots win, same as the vm's module exports
+    exports = {name[2:]: value for name, value in frame.items() if name.startswith("v_")}
+    exports.update((name[2:], value) for name, value in frame.items() if name.startswith("l_"))
+    return exports
+
+def _undefined(e):
+    match = re.search(r"'[lv]_(\w+)'", str(e))
+    name = match.group(1) if match else "?"
+    return RuntimeError(message=f"Undefined variable '{name}'")
+
+def _label_not_found(name):
+    raise LabelNotFoundError(message=f"Label not found: {name}")
+
+def compile_cfg(cfg: CFG) -> PyUnit:
+    return PyCodegen(cfg).generate()
+
+# module path -> (source hash, PyUnit), the generated code only depends on the source
+_MODULE_UNITS: Dict[str, tuple] = {}
+
+def compile_module(module, num_regs, source_dir=".") -> PyUnit:
+    from bootstrap.ir.generator import IRGenerator
+    from bootstrap.ir.cfg_builder import build_cfg
+    from bootstrap.ir.liveness import remove_unreachable, compute_liveness
+
+    key = os.path.abspath(module.path)
+    cached = _MODULE_UNITS.get(key)
+    if cached is not None and cached[0] == module.source_hash:
+        return cached[1]
+
+    # the registry owns analysing and optimising the tree, exactly once
+    MODULES.compile(module, num_regs, source_dir=source_dir)
+
+    ir_gen = IRGenerator()
+    ir_gen.generate(module.tree)
+    cfg = build_cfg(ir_gen.ir.code)
+    remove_unreachable(cfg)
+    compute_liveness(cfg)
+    # no eliminate_dead_stores, a store nobody in the module reads is still an export
+
+    unit = compile_cfg(cfg)
+    _MODULE_UNITS[key] = (module.source_hash, unit)
+    return unit
@@ -0,0 +1,76 @@
+from bootstrap.frontend.lexer import Lexer
+from bootstrap.frontend.parser import Parser
+from bootstrap.semantic.analyser import Analyser
+from bootstrap.semantic.symbol_table import SymbolTable
+from bootstrap.optimiser.optimiser import Optimiser
+from bootstrap.ir.generator import IRGenerator
+from bootstrap.ir.inliner import INLINE_BUDGET
+from bootstrap.ir.cfg_builder import build_cfg
+from bootstrap.ir.ssa import build_ssa, destruct_ssa
+from bootstrap.ir.sccp import propagate_constants
+from bootstrap.ir.gvn import number_values
+from bootstrap.ir.liveness import compute_liveness, eliminate_dead_stores, remove_unreachable, annotate_call_saves
+from bootstrap.runtime.regalloc import linear_scan_allocate, NUM_REGS
+from bootstrap.runtime.colouring import colour_allocate
+from bootstrap.runtime.superinstructions import fuse_superinstructions
+from bootstrap.runtime.linker import link
+from bootstrap.runtime.bytecode import lower
+
+# source -> CFG -> allocated Instrs -> lowered Ops. main.run_source and the profilers under bootstrap/
+# compile through here, so nothing in the package has to import main
+
+ALLOCATORS = {
+    "linear": linear_scan_allocate,
+    "colour": colour_allocate,
+}
+
+# everything up to the CFG is shared by the vm and the python backend
+def compile_cfg(code, source_dir=".", inline_budget=INLINE_BUDGET):
+    lexer = Lexer(code)
+    tokens = lexer.get_tokens()
+    #print(tokens)
+
+    parser = Parser(tokens)
+    tree = parser.parse()
+    #parser.dump(tree)
+
+    symbol_table = SymbolTable()
+    semantic_analysis = Analyser(symbol_table, source_dir=source_dir)
+    semantic_analysis.analyse(tree)
+
+    optimiser = Optimiser()
+    tree = optimiser.optimise(tree)
+    #parser.dump(tree)
+
+    ir_generator = IRGenerator(source_dir=source_dir, inline_budget=inline_budget)
+    ir_generator.generate(tree)
+    #ir_generator.ir.dump()
+    
+    cfg = build_cfg(ir_generator.ir.code)
+    #cfg.dump()
+    remove_unreachable(cfg) # first
+    ssa = build_ssa(cfg) # second
+    propagate_constants(cfg, ssa)
+    number_values(cfg, ssa)
+    destruct_ssa(ssa)
+    compute_liveness(cfg) # third
+    eliminate_dead_stores(cfg) # fourth
+    #cfg.dump()
+    
+    return cfg
+
+# the allocated and linked Instrs, what the vm gets lowered from and the c backend compiles
+def compile_allocated(code, source_dir=".", num_regs=NUM_REGS, superinstructions=True, inline_budget=INLINE_BUDGET, allocator="linear"):
+    cfg = compile_cfg(code, source_dir=source_dir, inline_budget=inline_budget)
+    flat_code = cfg.flatten()
+    allocated = ALLOCATORS[allocator](flat_code, num_regs=num_regs)
+    if superinstructions:
+        allocated = fuse_superinstructions(allocated)
+    annotate_call_saves(allocated)
+    labels = link(allocated)
+
+    return allocated, labels
+
+def compile_source(code, source_dir=".", num_regs=NUM_REGS, superinstructions=True, inline_budget=INLINE_BUDGET, allocator="linear"):
+    allocated, labels = compile_allocated(code, source_dir=source_dir, num_regs=num_regs, superinstructions=superinstructions, inline_budget=inline_budget, allocator=allocator)
+    return lower(allocated), labels
@@ -176,7 +176,7 @@ class Import(AST):
 
 @dataclass
 class MapLiteral(AST):
-    pairs: List[Tuple[AST, AST]]
+    pairs: TypingList[Tuple[AST, AST]]
 
 @dataclass
 class IndexGet(AST):
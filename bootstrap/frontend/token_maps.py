@@ -63,6 +63,19 @@ BINOPS = {
     "^": "POW"
 }
 
+# type-specialised forms, the ir generator picks these when the analyser knows both operand types
+NUM_BINOPS = {
+    "+": "ADD_NUM",
+    "-": "SUB_NUM",
+    "*": "MUL_NUM",
+    "/": "DIV_NUM",
+    "^": "POW_NUM"
+}
+
+STR_BINOPS = {
+    "+": "CONCAT_STR"
+}
+
 CMP_OP_TO_IR = {
     "==": "EQ",
     "!=": "NE",
@@ -72,6 +85,25 @@ CMP_OP_TO_IR = {
     ">=": "GE"
 }
 
+NUM_CMP_OP_TO_IR = {
+    "==": "EQ_NUM",
+    "!=": "NE_NUM",
+    "<" : "LT_NUM",
+    ">" : "GT_NUM",
+    "<=": "LE_NUM",
+    ">=": "GE_NUM"
+}
+
+# single comparisons used as a branch condition, see IRGenerator._gen_branch_if_false
+CMP_OP_TO_BRANCH = {
+    "==": "JUMP_IF_NOT_EQ",
+    "!=": "JUMP_IF_NOT_NE",
+    "<" : "JUMP_IF_NOT_LT",
+    ">" : "JUMP_IF_NOT_GT",
+    "<=": "JUMP_IF_NOT_LE",
+    ">=": "JUMP_IF_NOT_GE"
+}
+
 CMP_TOK_TO_STR = {
     TokenType.EE: "==",
     TokenType.NE: "!=",
@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
 from typing import List, Optional
-from bootstrap.ir.ir import Instr
+from bootstrap.ir.ir import Instr, FUSED_BRANCH_OPS, FUSED_BRANCH_IMM_OPS
 
 @dataclass
 class BasicBlock:
@@ -8,6 +8,7 @@ class BasicBlock:
     instrs: List[Instr] = field(default_factory=list)
     succs: List["BasicBlock"] = field(default_factory=list)
     preds: List["BasicBlock"] = field(default_factory=list)
+    start: int = 0 # index of the leader in the code the block was sliced from
     
     def __repr__(self):
         return f"BB{self.id}({len(self.instrs)} instrs)"
@@ -23,8 +24,25 @@ class CFG:
     
     def flatten(self):
         code = []
+        new_start = {} # old leader index -> new index
         for bb in self.blocks:
+            new_start[bb.start] = len(code)
             code.extend(bb.instrs)
+        
+        # blocks may have been dropped or shrunk, so jump targets (old indices) need remapping
+        def remap(target):
+            if not isinstance(target, int):
+                return target
+            return new_start.get(target, len(code))
+        
+        for i, instr in enumerate(code):
+            if instr.op == "JUMP":
+                code[i] = Instr(instr.op, remap(instr.a), instr.b, instr.c)
+            elif instr.op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE"):
+                code[i] = Instr(instr.op, instr.a, remap(instr.b), instr.c)
+            elif instr.op in FUSED_BRANCH_OPS or instr.op in FUSED_BRANCH_IMM_OPS:
+                code[i] = Instr(instr.op, instr.a, instr.b, remap(instr.c))
+        
         return code
     
     # we are blessed with another dump function once again!!
@@ -1,9 +1,13 @@
 from bootstrap.ir.cfg import BasicBlock, CFG
-from bootstrap.ir.ir import Instr
+from bootstrap.ir.ir import Instr, FUSED_BRANCH_OPS, FUSED_BRANCH_IMM_OPS
 from typing import List
 
-TERMINATORS = {"JUMP", "JUMP_IF_TRUE", "JUMP_IF_FALSE", "RETURN"}
-BRANCH_OPS = {"JUMP_IF_TRUE", "JUMP_IF_FALSE"}
+TERMINATORS = {"JUMP", "JUMP_IF_TRUE", "JUMP_IF_FALSE", "RETURN", "TAIL_CALL", *FUSED_BRANCH_OPS, *FUSED_BRANCH_IMM_OPS}
+BRANCH_OPS = {"JUMP_IF_TRUE", "JUMP_IF_FALSE", *FUSED_BRANCH_OPS, *FUSED_BRANCH_IMM_OPS}
+
+def branch_target(instr):
+    # JUMP_IF_TRUE / FALSE keep the target in b, the fused compare-and-branch ops need b for the rhs
+    return instr.c if instr.op in FUSED_BRANCH_OPS or instr.op in FUSED_BRANCH_IMM_OPS else instr.b
 
 def build_cfg(code: List[Instr]) -> CFG:
     cfg = CFG()
@@ -17,13 +21,13 @@ def build_cfg(code: List[Instr]) -> CFG:
                 leaders.add(i + 1)
         
         if instr.op in ("JUMP", *BRANCH_OPS):
-            target = instr.b if instr.op in BRANCH_OPS else instr.a
+            target = branch_target(instr) if instr.op in BRANCH_OPS else instr.a
             
             if isinstance(target, int):
                 leaders.add(target)
-            
-            if instr.op == "LABEL":
-                leaders.add(i)
+        
+        if instr.op == "LABEL":
+            leaders.add(i)
     
     leaders = sorted(leaders)
     
@@ -34,7 +38,8 @@ def build_cfg(code: List[Instr]) -> CFG:
         end = leaders[idx + 1] if idx + 1 < len(leaders) else len(code)
         bb = BasicBlock(
             id=idx,
-            instrs=code[start:end]
+            instrs=code[start:end],
+            start=start
         )
         cfg.blocks.append(bb)
         block_at[start] = bb
@@ -60,11 +65,11 @@ def build_cfg(code: List[Instr]) -> CFG:
             if end < len(code) and end in block_at:
                 cfg.add_edge(bb, block_at[end])
             
-            target = last.b if last.op in BRANCH_OPS else last.a
+            target = branch_target(last)
             if isinstance(target, int) and target in block_at:
                 cfg.add_edge(bb, block_at[target])
         
-        elif last.op == "RETURN":
+        elif last.op in ("RETURN", "TAIL_CALL"):
             pass # no successors
         
         else:
@@ -1,14 +1,56 @@
 from bootstrap.frontend.ast_nodes import *
 from bootstrap.frontend.token_maps import *
-from bootstrap.ir.ir import IR, Instr
-from bootstrap.ir.operands import Imm
+from bootstrap.ir.ir import IR, Instr, FUSED_BRANCH_OPS
+from bootstrap.ir.inliner import Inliner, INLINE_BUDGET, walk
+from bootstrap.ir.operands import Reg, Imm
 from bootstrap.runtime.builtins_registry import BUILTINS
+from bootstrap.semantic.types import NUMBER, STRING
 
 class IRGenerator:
-    def __init__(self):
+    def __init__(self, source_dir=".", inline_budget=INLINE_BUDGET):
         self.ir = IR()
         self.loop_stack = [] # [continue_ip, [break_patch_indicies]]
         self.current_struct_fields = None
+        self.local_slots = {} # name -> slot in the current function's frame
+        self.module_aliases = set() # bound by IMPORT_MODULE at runtime, so looked up by name
+        self.in_function = False # only a function's frame can be reused by a tail call
+        
+        self.inliner = Inliner(budget=inline_budget, source_dir=source_dir)
+        self.module_names = {} # import alias -> module name, for inlining across modules
+        self.renames = {} # callee name -> caller slot name / arg reg, while a call is being inlined
+        self.inline_exit = None # (result reg, jumps to patch to the end) of the body being inlined
+    
+    def _slot(self, name):
+        name = self.renames.get(name, name)
+        if name not in self.local_slots:
+            self.local_slots[name] = len(self.local_slots)
+        return self.local_slots[name]
+    
+    def _load_name(self, reg, name):
+        name = self.renames.get(name, name)
+        if isinstance(name, Reg):
+            self.ir.emit("MOVE", reg, name) # an inlined callee's param
+        elif name in self.module_aliases:
+            self.ir.emit("LOAD_VAR", reg, name)
+        else:
+            self.ir.emit("LOAD_LOCAL", reg, self._slot(name), name)
+    
+    def _store_name(self, name, reg):
+        name = self.renames.get(name, name)
+        if name in self.module_aliases:
+            self.ir.emit("STORE_VAR", name, reg)
+        else:
+            self.ir.emit("STORE_LOCAL", self._slot(name), reg, name)
+    
+    def _enter_frame(self, node, params):
+        # the analyser left the function's scope on the node, params come first so they are slots 0..n-1
+        old_slots = self.local_slots
+        self.local_slots = {}
+        for name in params:
+            self._slot(name)
+        for name in getattr(node, "local_names", ()):
+            self._slot(name)
+        return old_slots
     
     def _gen_struct_method(self, struct_name, method_node):
         label = f"{struct_name}.{method_node.name}"
@@ -19,6 +61,8 @@ class IRGenerator:
         instr.param_names = args
         instr.struct_names = struct_name
         self.ir.code.append(instr)
+        old_slots = self._enter_frame(method_node, args)
+        old_in_function, self.in_function = self.in_function, True
         
         struct_fields = None
         for i in self.ir.code:
@@ -34,17 +78,25 @@ class IRGenerator:
             self.generate(stmt)
         
         self.current_struct_fields = old_fields
+        self.in_function = old_in_function
         
         default_reg = self.ir.new_reg()
         self.ir.emit("LOAD_CONST", default_reg, Imm(0))
         self.ir.emit("RETURN", default_reg)
+        
+        instr.local_names = list(self.local_slots)
+        self.local_slots = old_slots
     
     def generate(self, node):
         method = f"gen_{type(node).__name__}"
         return getattr(self, method)(node)
     
     def gen_Module(self, node):
-        self.ir.emit("LABEL", "__main__")
+        self.inliner.scan(node)
+        
+        main = Instr("LABEL", "__main__")
+        self.ir.code.append(main)
+        self.local_slots = {}
         
         # first generate top-level statements
         for stmt in node.body:
@@ -56,6 +108,8 @@ class IRGenerator:
             
             if not isinstance(stmt, FunctionDef):
                 self.generate(stmt)
+        
+        main.local_names = list(self.local_slots)
 
         # jump over function definitions so we don't fall into them
         jmp = len(self.ir.code)
@@ -84,19 +138,20 @@ class IRGenerator:
     def gen_Name(self, node):
         if self.current_struct_fields and node.id in self.current_struct_fields:
             self_reg = self.ir.new_reg()
-            self.ir.emit("LOAD_VAR", self_reg, "self")
-            dest = self.ir.new_reg()
-            instr = Instr("GET_ATTR", dest, self_reg, node.id)
-            self.ir.code.append(instr)
-            return dest
+            self._load_name(self_reg, "self")
+            return self._gen_self_field(self_reg, node.id)
+        
+        bound = self.renames.get(node.id)
+        if isinstance(bound, Reg):
+            return bound # nothing writes to an arg's reg, so reading it needs no copy
         
         r = self.ir.new_reg()
-        self.ir.emit("LOAD_VAR", r, node.id)
+        self._load_name(r, node.id)
         return r
     
     def gen_Assign(self, node):
         value_reg = self.generate(node.value)
-        self.ir.emit("STORE_VAR", node.target.id, value_reg)
+        self._store_name(node.target.id, value_reg)
     
     def gen_Call(self, node):
         func_name = node.func.id
@@ -107,6 +162,10 @@ class IRGenerator:
             self.ir.emit("CALL_BUILTIN", func_name, arg_regs, dest) # NEW OPCODE!!!!!!
             return dest
 
+        func = self.inliner.take(self.inliner.local.get(func_name), len(node.args))
+        if func is not None:
+            return self._gen_inline(func, func_name, node.args)
+        
         else:
             arg_regs = [self.generate(a) for a in node.args]
             dest = self.ir.new_reg()
@@ -117,14 +176,85 @@ class IRGenerator:
             
             return dest
     
+    # methods are only ever dispatched on their own struct, so self's field offsets are known here
+    def _gen_self_field(self, self_reg, field):
+        dest = self.ir.new_reg()
+        self.ir.emit("GET_FIELD", dest, self_reg, self.current_struct_fields.index(field))
+        return dest
+    
     def gen_Attribute(self, node):
         obj_reg = self.generate(node.obj)
+        if (self.current_struct_fields and isinstance(node.obj, Name) and node.obj.id == "self"
+            and node.attr in self.current_struct_fields):
+            return self._gen_self_field(obj_reg, node.attr)
+        
         dest = self.ir.new_reg()
         instr = Instr("GET_ATTR", dest, obj_reg, node.attr)
         self.ir.code.append(instr)
         return dest
     
+    # the callee's body goes straight into the caller. params it never assigns are just the args' regs,
+    # the rest get slots in the caller's frame named `<callee>.<param>`, and a return before the end
+    # moves its value into the result and jumps past the body
+    def _gen_inline(self, func, qualified_name, args):
+        arg_regs = [self.generate(a) for a in args]
+        stmts = func.body.statements if isinstance(func.body, Block) else func.body
+        # a `for` over a param stores to it just like an assignment does
+        assigned = {node.target.id for stmt in stmts for node in walk(stmt) if isinstance(node, (Assign, For))}
+        
+        # the args were evaluated with the caller's names, only now do the callee's come into scope
+        renames = {}
+        for param, reg in zip(func.args, arg_regs):
+            if param in assigned:
+                renames[param] = f"{qualified_name}.{param}"
+                self.ir.emit("STORE_LOCAL", self._slot(renames[param]), reg, renames[param])
+            else:
+                renames[param] = reg
+        
+        old = (self.renames, self.inline_exit, self.current_struct_fields, self.loop_stack)
+        self.renames = renames
+        self.inline_exit = (self.ir.new_reg(), [])
+        self.current_struct_fields = None # the callee isn't a method, its names are never fields
+        self.loop_stack = []
+        
+        for stmt in stmts[:-1]:
+            self.generate(stmt)
+        
+        last = stmts[-1] if stmts else None
+        if isinstance(last, Return):
+            result = self._gen_inline_value(last.value)
+        else:
+            if last is not None:
+                self.generate(last)
+            result = self._gen_inline_value(None) # falling off a function returns 0
+        
+        dest, patches = self.inline_exit
+        if patches:
+            self.ir.emit("MOVE", dest, result) # joins the early returns
+            result = dest
+            for patch in patches:
+                self.ir.code[patch].a = len(self.ir.code)
+        
+        self.renames, self.inline_exit, self.current_struct_fields, self.loop_stack = old
+        return result
+    
+    def _gen_inline_value(self, value):
+        if value is not None:
+            return self.generate(value)
+        
+        reg = self.ir.new_reg()
+        self.ir.emit("LOAD_CONST", reg, Imm(0))
+        return reg
+    
     def gen_MethodCall(self, node):
+        # `alias.f(...)` on an imported module, leaf functions get inlined from the module's own tree
+        if isinstance(node.obj, Name) and node.obj.id in self.module_names:
+            module_name = self.module_names[node.obj.id]
+            func = self.inliner.module_functions(module_name).get(node.method)
+            func = self.inliner.take(func, len(node.args))
+            if func is not None:
+                return self._gen_inline(func, f"{module_name}.{node.method}", node.args)
+        
         obj_reg = self.generate(node.obj)
         arg_regs = [self.generate(a) for a in node.args]
         dest = self.ir.new_reg()
@@ -141,12 +271,30 @@ class IRGenerator:
         self.ir.code.append(instr)
         return dest
     
+    # a lone `a < b` as a condition becomes one compare-and-branch instead of
+    # LOAD_CONST True / LT / AND / JUMP_IF_FALSE, chains like `a < b < c` still go through gen_Compare
+    def _gen_branch_if_false(self, test):
+        if isinstance(test, Compare) and len(test.ops) == 1:
+            left = self.generate(test.left)
+            right = self.generate(test.comparators[0])
+            self.ir.emit(CMP_OP_TO_BRANCH[test.ops[0]], left, right, None)
+        
+        else:
+            test_reg = self.generate(test)
+            self.ir.emit("JUMP_IF_FALSE", test_reg, None)
+        
+        return len(self.ir.code) - 1
+    
+    def _patch_branch(self, index, target):
+        instr = self.ir.code[index]
+        if instr.op in FUSED_BRANCH_OPS:
+            instr.c = target
+        else:
+            instr.b = target
+    
     # uses backpatching
     def gen_If(self, node):
-        test = self.generate(node.test)
-
-        jmp_false = len(self.ir.code)
-        self.ir.emit("JUMP_IF_FALSE", test, None)
+        jmp_false = self._gen_branch_if_false(node.test)
 
         for stmt in node.body:
             self.generate(stmt)
@@ -155,7 +303,7 @@ class IRGenerator:
             jmp_end = len(self.ir.code)
             self.ir.emit("JUMP", None)
 
-            self.ir.code[jmp_false].b = len(self.ir.code)
+            self._patch_branch(jmp_false, len(self.ir.code))
 
             orelse = node.orelse
             if isinstance(orelse, (If, Block)):
@@ -165,7 +313,19 @@ class IRGenerator:
 
             self.ir.code[jmp_end].a = len(self.ir.code)
         else:
-            self.ir.code[jmp_false].b = len(self.ir.code)
+            self._patch_branch(jmp_false, len(self.ir.code))
+    
+    # the analyser stamps operand_types on BinOp / Compare, unknown operands keep the generic op
+    def _specialise(self, node, op_str, generic, num_table, str_table=None):
+        types = getattr(node, "operand_types", None)
+        
+        if types == (NUMBER, NUMBER) and op_str in num_table:
+            return num_table[op_str]
+        
+        if types == (STRING, STRING) and str_table and op_str in str_table:
+            return str_table[op_str]
+        
+        return generic
     
     # here be dragons
     # honestly tho, i havent a clue whats going on, but all i know is that you can now do:
@@ -178,10 +338,12 @@ class IRGenerator:
 
         current_left = left_reg
 
-        for op_str, right_ast in zip(node.ops, node.comparators):
+        for i, (op_str, right_ast) in enumerate(zip(node.ops, node.comparators)):
             right_reg = self.generate(right_ast)
             cmp_reg = self.ir.new_reg()
             ir_op = CMP_OP_TO_IR[op_str]
+            if i == 0:
+                ir_op = self._specialise(node, op_str, ir_op, NUM_CMP_OP_TO_IR)
             self.ir.emit(ir_op, cmp_reg, current_left, right_reg)
             self.ir.emit("AND", result_reg, result_reg, cmp_reg)
             current_left = right_reg
@@ -199,7 +361,8 @@ class IRGenerator:
         right = self.generate(node.right)
 
         dest = self.ir.new_reg()
-        self.ir.emit(BINOPS[node.op], dest, left, right)
+        ir_op = self._specialise(node, node.op, BINOPS[node.op], NUM_BINOPS, STR_BINOPS)
+        self.ir.emit(ir_op, dest, left, right)
         return dest
     
     def gen_logic(self, node):
@@ -248,16 +411,44 @@ class IRGenerator:
         instr = Instr("LABEL", node.name)
         instr.param_names = node.args
         self.ir.code.append(instr)
+        old_slots = self._enter_frame(node, node.args)
+        old_in_function, self.in_function = self.in_function, True
         
         stmts = node.body.statements if isinstance(node.body, Block) else node.body
         for stmt in stmts:
             self.generate(stmt)
         
+        self.in_function = old_in_function
         default_reg = self.ir.new_reg()
         self.ir.emit("LOAD_CONST", default_reg, Imm(0))
         self.ir.emit("RETURN", default_reg)
+        
+        instr.local_names = list(self.local_slots)
+        self.local_slots = old_slots
     
     def gen_Return(self, node):
+        if self.inline_exit is not None:
+            self.ir.emit("MOVE", self.inline_exit[0], self._gen_inline_value(node.value))
+            self.ir.emit("JUMP", None)
+            self.inline_exit[1].append(len(self.ir.code) - 1)
+            return
+        
+        # `return f(...)` has nothing left to do in this frame, so the callee takes it over
+        # instead of pushing a new one, accumulator style recursion then runs in constant space.
+        # a call the inliner takes is copied in instead, one it turns down still gets the tail call
+        if self.in_function and isinstance(node.value, Call) and node.value.func.id not in BUILTINS:
+            call = node.value
+            func = self.inliner.take(self.inliner.local.get(call.func.id), len(call.args))
+            if func is not None:
+                self.ir.emit("RETURN", self._gen_inline(func, call.func.id, call.args))
+                return
+            
+            arg_regs = [self.generate(a) for a in call.args]
+            instr = Instr("TAIL_CALL", call.func.id)
+            instr.arg_regs = arg_regs
+            self.ir.code.append(instr)
+            return
+        
         if node.value:
             reg = self.generate(node.value)
         
@@ -269,10 +460,7 @@ class IRGenerator:
     
     def gen_While(self, node):
         start_label = len(self.ir.code)       # start of loop
-        test_reg = self.generate(node.test)
-
-        jmp_exit = len(self.ir.code)
-        self.ir.emit("JUMP_IF_FALSE", test_reg, None)  # exit if false
+        jmp_exit = self._gen_branch_if_false(node.test)  # exit if false
 
         self.loop_stack.append(([], []))
         for stmt in node.body:
@@ -281,7 +469,7 @@ class IRGenerator:
 
         self.ir.emit("JUMP", start_label)      # jump back to start
         exit_ip = len(self.ir.code)
-        self.ir.code[jmp_exit].b = exit_ip  # patch exit
+        self._patch_branch(jmp_exit, exit_ip)  # patch exit
         
         for patch in continue_patches:
             self.ir.code[patch].a = start_label
@@ -295,20 +483,17 @@ class IRGenerator:
         # Store start in loop variable
         var_reg = self.ir.new_reg()
         self.ir.emit("MOVE", var_reg, start_reg)
-        self.ir.emit("STORE_VAR", node.target.id, var_reg)
+        self._store_name(node.target.id, var_reg)
 
         loop_start = len(self.ir.code)  # start of loop
 
         # Load loop variable
         loop_var_reg = self.ir.new_reg()
-        self.ir.emit("LOAD_VAR", loop_var_reg, node.target.id)
-
-        # Compare with end
-        cmp_reg = self.ir.new_reg()
-        self.ir.emit("LT", cmp_reg, loop_var_reg, end_reg)  # loop while var < end
+        self._load_name(loop_var_reg, node.target.id)
 
+        # Compare with end, loop while var < end
         jmp_exit = len(self.ir.code)
-        self.ir.emit("JUMP_IF_FALSE", cmp_reg, None)
+        self.ir.emit("JUMP_IF_NOT_LT", loop_var_reg, end_reg, None)
         
         self.loop_stack.append(([], []))
         for stmt in node.body:
@@ -317,17 +502,17 @@ class IRGenerator:
 
         # Increment loop variable
         increment_ip = len(self.ir.code)
-        self.ir.emit("LOAD_VAR", var_reg, node.target.id)
+        self._load_name(var_reg, node.target.id)
         one_reg = self.ir.new_reg()
         self.ir.emit("LOAD_CONST", one_reg, Imm(1))
-        self.ir.emit("ADD", var_reg, var_reg, one_reg)
-        self.ir.emit("STORE_VAR", node.target.id, var_reg)
+        self.ir.emit("ADD_NUM", var_reg, var_reg, one_reg)
+        self._store_name(node.target.id, var_reg)
 
         # Jump back to start
         self.ir.emit("JUMP", loop_start)
         
         exit_ip = len(self.ir.code)
-        self.ir.code[jmp_exit].b = exit_ip
+        self.ir.code[jmp_exit].c = exit_ip
         
         for patch in continue_patches:
             self.ir.code[patch].a = increment_ip
@@ -358,6 +543,8 @@ class IRGenerator:
     def gen_Import(self, node):
         instr = Instr("IMPORT_MODULE", node.alias, node.module_name)
         self.ir.code.append(instr)
+        self.module_aliases.add(node.alias)
+        self.module_names[node.alias] = node.module_name
     
     def gen_Block(self, node):
         for stmt in node.statements:
@@ -0,0 +1,180 @@
+from bootstrap.ir.cfg import CFG
+from bootstrap.ir.operands import Reg, Imm
+from bootstrap.ir.ssa import SSAForm
+from bootstrap.runtime.regalloc import replace_use
+from bootstrap.runtime.superinstructions import PATTERNS
+
+# global value numbering on top of build_ssa, after sccp and before destruct_ssa. the dominator tree is
+# walked in preorder with a scoped table of (op, value numbers of the operands) -> the ssa name that
+# computed it first, so an instruction a dominating one already computed is redundant, and whatever
+# reads its result is pointed at the earlier register instead. registers aren't ssa, so a reader only
+# gets redirected while that register still holds the version it had, and the redundant instruction
+# is only deleted once every reader (phis too) was redirected, otherwise it stays where it is
+
+# the result only depends on the operands, reused anywhere a dominating block computed it.
+# structs have no field assignment, so a GET_FIELD of the same struct always reads the same value
+PURE = {
+    "LOAD_CONST", "LOAD_LOCAL", "GET_FIELD", "NEG", "NOT",
+    "ADD", "SUB", "MUL", "DIV", "POW",
+    "ADD_NUM", "SUB_NUM", "MUL_NUM", "DIV_NUM", "POW_NUM", "CONCAT_STR",
+    "EQ", "NE", "LT", "GT", "LE", "GE",
+    "EQ_NUM", "NE_NUM", "LT_NUM", "GT_NUM", "LE_NUM", "GE_NUM", "AND",
+}
+
+# read state the ops below can change, only reused inside one block with none of them in between
+MEMORY = {"LOAD_VAR", "GET_ATTR"}
+CLOBBERS = {"CALL", "CALL_METHOD", "CALL_BUILTIN", "TAIL_CALL", "STORE_VAR", "IMPORT_MODULE", "STRUCT_DEF"}
+
+COMMUTATIVE = {"ADD_NUM", "MUL_NUM", "EQ", "NE", "EQ_NUM", "NE_NUM"}
+
+# indices the superinstruction pass folds into one op when their regs die there, reusing or dropping
+# one of those would cost the fused op more than it saves
+def _fusable(instrs):
+    covered = set()
+    nothing_live = [()] * len(instrs)
+    for i in range(len(instrs)):
+        for match in PATTERNS:
+            result = match(instrs, i, nothing_live)
+            if result is not None:
+                covered.update(range(i, i + result[1]))
+                break
+    return covered
+
+def _const_key(instr):
+    value = instr.b.value if isinstance(instr.b, Imm) else instr.b
+    return (type(value), repr(value)) # 1, 1.0 and True are different constants
+
+class GVN:
+    def __init__(self, cfg: CFG, ssa: SSAForm):
+        self.cfg = cfg
+        self.ssa = ssa
+        self.removed = 0    # redundant instructions deleted
+        self.redirected = 0 # reads pointed at an earlier register
+
+    def run(self):
+        for fn in self.ssa.functions:
+            self.run_function(fn)
+        return self
+
+    def run_function(self, fn):
+        alive = {bb.id for bb in self.cfg.blocks}
+
+        children = {bb.id: [] for bb in fn.order if bb.id in alive}
+        for bb in fn.order[1:]:
+            if bb.id in alive:
+                children[fn.idom[bb.id]].append(bb)
+
+        vn = {}          # ssa name -> value number (the first name that held the value)
+        avail = {}       # key -> ssa name of the instruction that computed it, scoped by the walk
+        replaced = {}    # ssa name of a redundant def -> the name its readers should use instead
+        needed = set()   # redundant defs some reader couldn't be redirected away from
+        pending = {}     # redundant name -> its instruction
+        dropped = set()  # id(instr) to delete
+        stacks = {}
+
+        def current(var):
+            stack = stacks.get(var)
+            return stack[-1] if stack else (var, 0)
+
+        work = [("enter", fn.entry)]
+        while work:
+            kind, bb = work.pop()
+            if kind == "exit":
+                pushed, keys = bb
+                for var in pushed:
+                    stacks[var].pop()
+                for key, old in keys:
+                    if old is None:
+                        del avail[key]
+                    else:
+                        avail[key] = old
+                continue
+
+            pushed = []
+            keys = []
+            epoch = (bb.id, 0)
+
+            def push(var, name):
+                stacks.setdefault(var, []).append(name)
+                pushed.append(var)
+
+            for phi in fn.phis[bb.id]:
+                args = {vn.get(phi.args[p.id], phi.args[p.id]) for p in bb.preds if p.id in phi.args}
+                if len(args) == 1 and phi.dest not in args:
+                    vn[phi.dest] = args.pop()
+                push(phi.var, phi.dest)
+
+            fusable = _fusable(bb.instrs)
+            for i, instr in enumerate(bb.instrs):
+                defs = fn.defs[id(instr)]
+                uses = fn.uses[id(instr)]
+
+                # readers of a redundant def go to the register that computed it first
+                for name in uses:
+                    if name not in replaced:
+                        continue
+                    leader = replaced[name]
+                    if current(leader[0]) == leader:
+                        replace_use(instr, name[0], leader[0])
+                        self.redirected += 1
+                    else:
+                        needed.add(name)
+
+                key = None
+                if instr.op in CLOBBERS:
+                    epoch = (bb.id, i + 1)
+                elif len(defs) == 1 and isinstance(defs[0][0], Reg) and i not in fusable:
+                    operands = tuple(vn.get(name, name) for name in uses)
+                    if instr.op in COMMUTATIVE:
+                        operands = tuple(sorted(operands, key=repr))
+                    if instr.op == "LOAD_CONST":
+                        key = (instr.op, _const_key(instr))
+                    elif instr.op in PURE:
+                        key = (instr.op, operands, instr.c if instr.op == "GET_FIELD" else None)
+                    elif instr.op in MEMORY:
+                        key = (instr.op, operands, instr.b if instr.op == "LOAD_VAR" else instr.c, epoch)
+                    elif instr.op == "MOVE":
+                        vn[defs[0]] = operands[0]
+
+                if key is not None:
+                    dest = defs[0]
+                    leader = avail.get(key)
+                    if leader is not None and current(leader[0]) == leader:
+                        vn[dest] = vn.get(leader, leader)
+                        if dest[0] == leader[0]:
+                            # writes the value its register already holds, nothing to redirect
+                            dropped.add(id(instr))
+                            self.removed += 1
+                            push(dest[0], leader)
+                            continue
+                        replaced[dest] = leader
+                        pending[dest] = instr
+                    else:
+                        keys.append((key, leader))
+                        avail[key] = dest
+
+                for name in defs:
+                    push(name[0], name)
+
+            # a phi needs the value in the register it was defined in
+            for succ in bb.succs:
+                for phi in fn.phis.get(succ.id, ()):
+                    arg = phi.args.get(bb.id)
+                    if arg in replaced:
+                        needed.add(arg)
+
+            work.append(("exit", (pushed, keys)))
+            for child in reversed(children[bb.id]):
+                work.append(("enter", child))
+
+        for name, instr in pending.items():
+            if name not in needed:
+                dropped.add(id(instr))
+                self.removed += 1
+
+        for bb in fn.blocks:
+            if bb.id in alive and any(id(instr) in dropped for instr in bb.instrs):
+                bb.instrs = [instr for instr in bb.instrs if id(instr) not in dropped]
+
+def number_values(cfg: CFG, ssa: SSAForm) -> GVN:
+    return GVN(cfg, ssa).run()
@@ -0,0 +1,120 @@
+from bootstrap.frontend.ast_nodes import *
+from bootstrap.runtime.builtins_registry import BUILTINS
+
+# which calls the ir generator may replace with the callee's body. a candidate is a top level function
+#   - whose body is at most INLINE_MAX_SIZE ast nodes
+#   - that has no locals besides its params, so a fresh frame and an inlined copy behave the same
+#   - that can't reach itself through other calls (methods are never inlined, so they don't count)
+# and every inlined body is paid for out of INLINE_BUDGET nodes per compilation unit, so a helper
+# called from a thousand places stops getting copied once the budget is gone
+
+INLINE_MAX_SIZE = 24  # ast nodes in the callee's body
+INLINE_BUDGET = 400   # ast nodes inlined per program / module, 0 turns inlining off
+
+def _body(func):
+    return func.body.statements if isinstance(func.body, Block) else func.body
+
+def _children(node):
+    for value in vars(node).values():
+        if isinstance(value, list):
+            for v in value:
+                if isinstance(v, AST):
+                    yield v
+        elif isinstance(value, AST):
+            yield value
+
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(_children(node))
+
+def ast_size(func):
+    return sum(1 for stmt in _body(func) for _ in walk(stmt))
+
+def user_calls(func):
+    return {
+        node.func.id for stmt in _body(func) for node in walk(stmt)
+        if isinstance(node, Call) and node.func.id not in BUILTINS
+    }
+
+def _self_contained(func, leaf):
+    params = set(func.args)
+    if set(getattr(func, "local_names", func.args)) != params:
+        return False
+
+    nodes = [node for stmt in _body(func) for node in walk(stmt)]
+    callees = {id(node.func) for node in nodes if isinstance(node, Call)}
+    for node in nodes:
+        if id(node) in callees:
+            continue
+        if isinstance(node, (FunctionDef, StructDef, Import)):
+            return False
+        if isinstance(node, Name) and node.id not in params:
+            return False # self, a module alias, something only the callee's frame knows
+        if leaf and (isinstance(node, (MethodCall, StructLiteral))
+                     or (isinstance(node, Call) and node.func.id not in BUILTINS)):
+            return False
+    return True
+
+# name -> FunctionDef for every function in `functions` that may be inlined
+# leaf: the callee comes from another module, so it can't call anything the importer can't see
+def find_inlinable(functions, max_size=INLINE_MAX_SIZE, leaf=False):
+    calls = {name: user_calls(func) & functions.keys() for name, func in functions.items()}
+
+    def reaches_itself(name):
+        seen = set()
+        stack = list(calls[name])
+        while stack:
+            callee = stack.pop()
+            if callee == name:
+                return True
+            if callee not in seen:
+                seen.add(callee)
+                stack.extend(calls[callee])
+        return False
+
+    return {
+        name: func for name, func in functions.items()
+        if ast_size(func) <= max_size and _self_contained(func, leaf) and not reaches_itself(name)
+    }
+
+class Inliner:
+    def __init__(self, budget=INLINE_BUDGET, max_size=INLINE_MAX_SIZE, source_dir="."):
+        self.budget = budget
+        self.max_size = max_size
+        self.source_dir = source_dir
+        self.local = {}   # name -> FunctionDef
+        self.modules = {} # module name -> its inlinable functions
+        self.inlined = 0  # call sites replaced
+
+    def scan(self, tree):
+        functions = {stmt.name: stmt for stmt in tree.body if isinstance(stmt, FunctionDef)}
+        self.local = find_inlinable(functions, self.max_size)
+
+    def module_functions(self, module_name):
+        if module_name not in self.modules:
+            from bootstrap.runtime.modules import MODULES # the module registry imports the generator
+
+            module = MODULES.load(module_name, self.source_dir)
+            functions = {}
+            if module is not None:
+                tree = MODULES.analyse(module, self.source_dir).tree
+                functions = {stmt.name: stmt for stmt in tree.body if isinstance(stmt, FunctionDef)}
+            self.modules[module_name] = find_inlinable(functions, self.max_size, leaf=True)
+
+        return self.modules[module_name]
+
+    # the FunctionDef to inline for this call, or None for a real CALL
+    def take(self, func, num_args):
+        if func is None or len(func.args) != num_args:
+            return None
+
+        size = ast_size(func)
+        if size > self.budget:
+            return None
+
+        self.budget -= size
+        self.inlined += 1
+        return func
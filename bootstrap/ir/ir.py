@@ -2,6 +2,15 @@ from bootstrap.ir.operands import Reg, Imm
 from dataclasses import dataclass
 from typing import Any, List
 
+# compare-and-branch, `JUMP_IF_NOT_LT l r target` jumps to target unless l < r
+FUSED_BRANCH_OPS = (
+    "JUMP_IF_NOT_EQ", "JUMP_IF_NOT_NE", "JUMP_IF_NOT_LT",
+    "JUMP_IF_NOT_GT", "JUMP_IF_NOT_LE", "JUMP_IF_NOT_GE",
+)
+
+# superinstruction forms with the rhs constant folded in, `JUMP_IF_NOT_LT_IMM l 10 target`
+FUSED_BRANCH_IMM_OPS = tuple(f"{op}_IMM" for op in FUSED_BRANCH_OPS)
+
 @dataclass
 class Instr:
     op: str
@@ -1,4 +1,6 @@
 from bootstrap.ir.cfg import BasicBlock, CFG
+from bootstrap.ir.cfg_builder import build_cfg
+from bootstrap.ir.ir import FUSED_BRANCH_OPS, FUSED_BRANCH_IMM_OPS
 from bootstrap.ir.operands import Reg
 from bootstrap.runtime.regalloc import get_defs_uses
 
@@ -46,6 +48,8 @@ def eliminate_dead_stores(cfg: CFG):
         for instr in bb.instrs:
             if instr.op == "LOAD_VAR":
                 read_vars.add(instr.b)
+            elif instr.op == "LOAD_LOCAL":
+                read_vars.add(instr.c) # c = the local's name, slot numbers repeat across functions
     
     for bb in cfg.blocks:
         needed = set(bb.live_out)
@@ -56,25 +60,32 @@ def eliminate_dead_stores(cfg: CFG):
             defined_regs = [d for d in defs if isinstance(d, Reg)]
             
             is_side_affect = instr.op in (
-                "CALL", "CALL_BUILTIN", "CALL_METHOD", "RETURN",
+                "CALL", "CALL_BUILTIN", "CALL_METHOD", "RETURN", "TAIL_CALL",
                 "JUMP", "JUMP_IF_TRUE", "JUMP_IF_FALSE", "LABEL",
-                "STRUCT_DEF", "IMPORT_MODULE"
-            ) or (instr.op == "STORE_VAR" and instr.a in read_vars)
-            if is_side_affect or (defined_regs and any(d in needed for d in defined_regs)):
+                "STRUCT_DEF", "IMPORT_MODULE", "INC_LOCAL",
+                *FUSED_BRANCH_OPS, *FUSED_BRANCH_IMM_OPS
+            ) or (instr.op == "STORE_VAR" and instr.a in read_vars) or (
+                instr.op == "STORE_LOCAL" and instr.c in read_vars
+            )
+            keep = is_side_affect or (defined_regs and any(d in needed for d in defined_regs))
+            
+            # defs die before uses come alive, otherwise `AND r1 r1 r2` kills the LOAD_CONST feeding r1
+            for d in defined_regs:
+                needed.discard(d)
+            
+            if keep:
                 new_instrs.append(instr)
                 
                 for u in uses:
                     if isinstance(u, Reg):
                         needed.add(u)
-
-            for d in defined_regs:
-                needed.discard(d)
         
         bb.instrs = list(reversed(new_instrs))
 
 def remove_unreachable(cfg: CFG):
     visited = set()
-    q = deque([cfg.entry])
+    # function / method bodies are only reached through CALLs, so every LABEL block is a root too
+    q = deque([cfg.entry] + [bb for bb in cfg.blocks if bb.instrs and bb.instrs[0].op == "LABEL"])
     
     while q:
         bb = q.popleft()
@@ -94,4 +105,28 @@ def remove_unreachable(cfg: CFG):
     surviving_ids = {bb.id for bb in cfg.blocks}
     for bb in cfg.blocks:
         bb.succs = [s for s in bb.succs if s.id in surviving_ids]
-        bb.preds = [p for p in bb.preds if p.id in surviving_ids]
\ No newline at end of file
+        bb.preds = [p for p in bb.preds if p.id in surviving_ids]
+
+CALL_OPS = ("CALL", "CALL_METHOD")
+
+# caller-save convention: runs on the allocated (physical register) code and stamps every
+# call with the registers still live once it returns, so the vm saves only those
+def annotate_call_saves(code):
+    cfg = build_cfg(code)
+    compute_liveness(cfg)
+    
+    for bb in cfg.blocks:
+        live = set(bb.live_out)
+        
+        for instr in reversed(bb.instrs):
+            defs, uses = get_defs_uses(instr)
+            defined_regs = {d for d in defs if isinstance(d, Reg)}
+            
+            if instr.op in CALL_OPS:
+                # the dest is overwritten by the return value, no point saving it
+                instr.live_regs = sorted(r.id for r in live - defined_regs)
+            
+            live -= defined_regs
+            live |= {u for u in uses if isinstance(u, Reg)}
+    
+    return code
\ No newline at end of file
@@ -0,0 +1,298 @@
+import operator
+
+from bootstrap.ir.cfg import CFG
+from bootstrap.ir.cfg_builder import branch_target, BRANCH_OPS
+from bootstrap.ir.ir import FUSED_BRANCH_OPS
+from bootstrap.ir.operands import Reg, Imm
+from bootstrap.ir.ssa import SSAForm
+
+# sparse conditional constant propagation (wegman & zadeck) on top of build_ssa. every ssa name starts
+# at TOP (no value seen yet) and can only go down to one constant and then to BOTTOM (could be anything).
+# only edges proven executable feed phis, so a branch on a constant never lets the other side's values in.
+# afterwards, defs that are constant become LOAD_CONST, branches that always go one way become a JUMP
+# or nothing, and blocks no executable edge reaches are dropped
+
+class _Top:
+    def __repr__(self):
+        return "TOP"
+
+class _Bottom:
+    def __repr__(self):
+        return "BOTTOM"
+
+TOP = _Top()
+BOTTOM = _Bottom()
+
+# what a slot that was never stored to holds, reading it is a runtime error so it is never folded
+class _Unbound:
+    def __repr__(self):
+        return "<unbound>"
+
+UNBOUND = _Unbound()
+
+class Const:
+    __slots__ = ("value", "key")
+
+    def __init__(self, value):
+        self.value = value
+        self.key = (type(value), repr(value)) # 1, 1.0, True and -0.0 / 0.0 must not meet as equal
+
+    def __repr__(self):
+        return f"Const({self.value!r})"
+
+def meet(a, b):
+    if a is TOP:
+        return b
+    if b is TOP or a is b:
+        return a
+    if a is BOTTOM or b is BOTTOM:
+        return BOTTOM
+    return a if a.key == b.key else BOTTOM
+
+# same python operators the vm's handlers use, so a folded result is exactly what the vm would compute
+BINARY = {
+    "ADD": operator.add, "SUB": operator.sub, "MUL": operator.mul, "DIV": operator.truediv, "POW": operator.pow,
+    "ADD_NUM": operator.add, "SUB_NUM": operator.sub, "MUL_NUM": operator.mul, "DIV_NUM": operator.truediv,
+    "POW_NUM": operator.pow, "CONCAT_STR": operator.add,
+    "EQ": operator.eq, "NE": operator.ne, "LT": operator.lt, "GT": operator.gt, "LE": operator.le, "GE": operator.ge,
+    "EQ_NUM": operator.eq, "NE_NUM": operator.ne, "LT_NUM": operator.lt, "GT_NUM": operator.gt,
+    "LE_NUM": operator.le, "GE_NUM": operator.ge,
+    "AND": lambda x, y: x and y,
+}
+
+UNARY = {"NEG": operator.neg, "NOT": operator.not_, "MOVE": lambda x: x}
+
+BRANCH_CMP = {
+    "JUMP_IF_NOT_EQ": operator.eq, "JUMP_IF_NOT_NE": operator.ne, "JUMP_IF_NOT_LT": operator.lt,
+    "JUMP_IF_NOT_GT": operator.gt, "JUMP_IF_NOT_LE": operator.le, "JUMP_IF_NOT_GE": operator.ge,
+}
+
+FOLDABLE = {"LOAD_LOCAL", *BINARY, *UNARY}
+CONST_TYPES = (int, float, str, bool, type(None))
+
+def _fold(func, *values):
+    # the result is capped below, but these would never finish (or fit in memory) to get there
+    if func is operator.pow and all(type(v) is int for v in values) and abs(values[1]) > 256:
+        return BOTTOM
+    if func is operator.mul and any(type(v) is str for v in values) and any(type(v) is int and v > 1024 for v in values):
+        return BOTTOM
+
+    try:
+        result = func(*values)
+    except Exception:
+        return BOTTOM # division by zero, `1 < "a"`... left for the vm to raise
+
+    # keep the constant pool sane, `2 ^ 100000` stays a POW
+    if type(result) not in CONST_TYPES:
+        return BOTTOM
+    if type(result) is int and result.bit_length() > 256:
+        return BOTTOM
+    if type(result) is str and len(result) > 1024:
+        return BOTTOM
+    return Const(result)
+
+class SCCP:
+    def __init__(self, cfg: CFG, ssa: SSAForm):
+        self.cfg = cfg
+        self.ssa = ssa
+        self.values = {} # ssa name -> TOP / Const / BOTTOM
+        self.folded = 0
+        self.branches = 0
+        self.removed_blocks = 0
+
+    def value(self, fn, name):
+        if name in self.values:
+            return self.values[name]
+
+        var, version = name
+        if version == 0:
+            # params and registers come from outside, every other slot starts out unbound
+            if isinstance(var, Reg) or var[1] < len(getattr(fn.label, "param_names", ())):
+                return BOTTOM
+            return Const(UNBOUND)
+        return TOP
+
+    def evaluate(self, fn, instr):
+        # value of the instruction's defs, in instr_vars order
+        op = instr.op
+        uses = [self.value(fn, name) for name in fn.uses[id(instr)]]
+
+        if op == "LOAD_CONST":
+            value = instr.b.value if isinstance(instr.b, Imm) else instr.b
+            return [Const(value)]
+
+        if op == "LOAD_LOCAL":
+            slot = uses[0]
+            if isinstance(slot, Const) and slot.value is UNBOUND:
+                return [BOTTOM]
+            return [slot]
+
+        if op == "STORE_LOCAL":
+            return [uses[0]]
+
+        if op in UNARY or op in BINARY:
+            if any(u is BOTTOM for u in uses):
+                return [BOTTOM]
+            if any(u is TOP for u in uses):
+                return [TOP]
+            if op in UNARY:
+                return [_fold(UNARY[op], uses[0].value)]
+
+            # `AND r1 r1 r2` reads r1 twice through get_defs_uses' b / c order
+            return [_fold(BINARY[op], uses[0].value, uses[-1].value)]
+
+        return [BOTTOM] * len(fn.defs[id(instr)])
+
+    # which successors a block's last instruction can go to, None while its condition is still TOP
+    def successors(self, fn, bb):
+        last = bb.instrs[-1] if bb.instrs else None
+        if last is None or (last.op not in BRANCH_OPS and last.op != "JUMP"):
+            return list(bb.succs)
+
+        if last.op == "JUMP":
+            return list(bb.succs)
+
+        uses = [self.value(fn, name) for name in fn.uses[id(last)]]
+        if any(u is TOP for u in uses):
+            return []
+        if any(u is BOTTOM for u in uses):
+            return list(bb.succs)
+
+        taken = self.taken(last, [u.value for u in uses])
+        if taken is None:
+            return list(bb.succs)
+
+        target = branch_target(last)
+        return [s for s in bb.succs if (s.start == target) == taken]
+
+    def taken(self, instr, values):
+        if instr.op == "JUMP_IF_TRUE":
+            return bool(values[0])
+        if instr.op == "JUMP_IF_FALSE":
+            return not values[0]
+
+        if instr.op in FUSED_BRANCH_OPS:
+            left, right = values[0], values[-1]
+            result = _fold(BRANCH_CMP[instr.op], left, right)
+            return None if result is BOTTOM else not result.value
+
+        return None
+
+    def run(self):
+        for fn in self.ssa.functions:
+            self.run_function(fn)
+        return self
+
+    def run_function(self, fn):
+        users = {} # ssa name -> [(block, phi or instr)]
+        for bb in fn.order:
+            for phi in fn.phis[bb.id]:
+                for name in phi.args.values():
+                    users.setdefault(name, []).append((bb, phi))
+            for instr in bb.instrs:
+                for name in fn.uses[id(instr)]:
+                    users.setdefault(name, []).append((bb, instr))
+
+        executable_edges = set()
+        visited = set()
+        flow_work = [(None, fn.entry)]
+        ssa_work = []
+
+        def update(name, value):
+            old = self.values.get(name, TOP)
+            new = meet(old, value)
+            if new is old or (isinstance(new, Const) and isinstance(old, Const)):
+                return # values only ever go down, so a constant that met a constant is the same one
+            self.values[name] = new
+            ssa_work.extend(users.get(name, ()))
+
+        def visit_phi(bb, phi):
+            value = TOP
+            for pred in bb.preds:
+                if (pred.id, bb.id) in executable_edges and pred.id in phi.args:
+                    value = meet(value, self.value(fn, phi.args[pred.id]))
+            update(phi.dest, value)
+
+        def visit_instr(bb, instr):
+            for name, value in zip(fn.defs[id(instr)], self.evaluate(fn, instr)):
+                update(name, value)
+            if instr is bb.instrs[-1]:
+                for succ in self.successors(fn, bb):
+                    flow_work.append((bb, succ))
+
+        while flow_work or ssa_work:
+            while flow_work:
+                pred, bb = flow_work.pop()
+                edge = (pred.id if pred else None, bb.id)
+                if edge in executable_edges:
+                    continue
+                executable_edges.add(edge)
+
+                for phi in fn.phis[bb.id]:
+                    visit_phi(bb, phi)
+
+                if bb.id in visited:
+                    continue
+                visited.add(bb.id)
+
+                for instr in bb.instrs:
+                    visit_instr(bb, instr)
+                if not bb.instrs:
+                    flow_work.extend((bb, succ) for succ in bb.succs)
+
+            while ssa_work:
+                bb, item = ssa_work.pop()
+                if bb.id not in visited:
+                    continue
+                if item in fn.phis[bb.id]:
+                    visit_phi(bb, item)
+                else:
+                    visit_instr(bb, item)
+
+        self.rewrite(fn, visited, executable_edges)
+
+    def rewrite(self, fn, visited, executable_edges):
+        for bb in fn.blocks:
+            if bb.id not in visited:
+                continue
+
+            # instructions are rewritten in place, the ssa names stay attached for the passes after this one
+            new_instrs = []
+            for instr in bb.instrs:
+                defs = fn.defs[id(instr)]
+
+                if instr.op in FOLDABLE and len(defs) == 1 and isinstance(instr.a, Reg):
+                    value = self.value(fn, defs[0])
+                    if isinstance(value, Const) and value.value is not UNBOUND:
+                        instr.op, instr.b, instr.c = "LOAD_CONST", Imm(value.value), None
+                        fn.uses[id(instr)] = []
+                        self.folded += 1
+
+                elif instr is bb.instrs[-1] and instr.op in BRANCH_OPS:
+                    live = [s for s in bb.succs if (bb.id, s.id) in executable_edges]
+                    if len({s.id for s in live}) == 1 and len({s.id for s in bb.succs}) == 2:
+                        self.branches += 1
+                        if live[0].start != branch_target(instr):
+                            del fn.defs[id(instr)], fn.uses[id(instr)]
+                            continue # never taken, just fall through
+
+                        instr.op, instr.a, instr.b, instr.c = "JUMP", branch_target(instr), None, None
+                        fn.uses[id(instr)] = []
+
+                new_instrs.append(instr)
+
+            bb.instrs = new_instrs
+
+        # drop the edges that can never run, and the blocks only they reached
+        dead = {bb.id for bb in fn.blocks if bb.id not in visited}
+        for bb in fn.blocks:
+            if bb.id in visited:
+                bb.succs = [s for s in bb.succs if (bb.id, s.id) in executable_edges]
+                bb.preds = [p for p in bb.preds if (p.id, bb.id) in executable_edges]
+
+        if dead:
+            self.removed_blocks += len(dead)
+            self.cfg.blocks = [bb for bb in self.cfg.blocks if bb.id not in dead]
+
+def propagate_constants(cfg: CFG, ssa: SSAForm) -> SCCP:
+    return SCCP(cfg, ssa).run()
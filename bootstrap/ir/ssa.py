@@ -0,0 +1,257 @@
+from bootstrap.ir.cfg import CFG
+from bootstrap.ir.operands import Reg
+from bootstrap.runtime.regalloc import get_defs_uses
+
+# ssa form over the cfg from build_cfg, one function (LABEL block and everything up to the next one)
+# at a time. variables are the virtual registers and the function's frame slots (LOAD_LOCAL / STORE_LOCAL
+# / INC_LOCAL), a name is (var, version) with version 0 being whatever the var holds on entry.
+# the instructions themselves are left alone: every def and use gets its name in SSAForm, and the phis
+# live in SSAForm too. as long as a pass only replaces defs in place (constants, dropped branches,
+# dropped blocks) and never moves one past another version of its var, the phi webs stay
+# conventional, and destructing is just forgetting the versions again
+
+class Phi:
+    __slots__ = ("var", "dest", "args")
+
+    def __init__(self, var, dest):
+        self.var = var
+        self.dest = dest
+        self.args = {} # pred block id -> name
+
+    def __repr__(self):
+        args = ", ".join(f"BB{pred}: {_fmt(name)}" for pred, name in self.args.items())
+        return f"{_fmt(self.dest)} = phi({args})"
+
+def _fmt(name):
+    var, version = name
+    return f"{'r' + str(var.id) if isinstance(var, Reg) else 'slot' + str(var[1])}.{version}"
+
+def slot_var(slot):
+    return ("slot", slot)
+
+# every var an instruction reads and writes, frame slots included
+def instr_vars(instr):
+    defs, uses = get_defs_uses(instr)
+    defs = [d for d in defs if isinstance(d, Reg)]
+    uses = [u for u in uses if isinstance(u, Reg)]
+
+    if instr.op == "LOAD_LOCAL":
+        uses.append(slot_var(instr.b))
+    elif instr.op == "STORE_LOCAL":
+        defs.append(slot_var(instr.a))
+    elif instr.op == "INC_LOCAL":
+        uses.append(slot_var(instr.a))
+        defs.append(slot_var(instr.a))
+
+    return defs, uses
+
+class SSAFunction:
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.entry = blocks[0]
+        self.label = blocks[0].instrs[0]
+        self.idom = {}     # block id -> immediate dominator's block id
+        self.frontier = {} # block id -> dominance frontier (block ids)
+        self.phis = {}     # block id -> [Phi]
+        self.defs = {}     # id(instr) -> names it defines, in instr_vars order
+        self.uses = {}     # id(instr) -> names it reads
+        self.order = []    # reverse postorder
+
+class SSAForm:
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        self.functions = []
+        self.skipped = [] # functions sharing blocks with another, left alone
+
+    def dump(self):
+        for fn in self.functions:
+            print(f"\n{fn.label.a}")
+            for bb in fn.blocks:
+                print(f"BB{bb.id} idom BB{fn.idom.get(bb.id)} df {sorted(fn.frontier.get(bb.id, ()))}")
+                for phi in fn.phis.get(bb.id, ()):
+                    print(f"  {phi}")
+                for instr in bb.instrs:
+                    defs = ", ".join(_fmt(n) for n in fn.defs.get(id(instr), ()))
+                    uses = ", ".join(_fmt(n) for n in fn.uses.get(id(instr), ()))
+                    print(f"  {instr.op} {instr.a} {instr.b} {instr.c}    [{defs} <- {uses}]")
+
+# a function is every block its LABEL block reaches, main jumps over the bodies that sit in its way
+def split_functions(cfg: CFG):
+    functions = []
+    for entry in cfg.blocks:
+        if not (entry.instrs and entry.instrs[0].op == "LABEL"):
+            continue
+        seen = {entry.id}
+        stack = [entry]
+        while stack:
+            for succ in stack.pop().succs:
+                if succ.id not in seen:
+                    seen.add(succ.id)
+                    stack.append(succ)
+        functions.append([bb for bb in cfg.blocks if bb.id in seen])
+    return functions
+
+def reverse_postorder(entry, members):
+    order = []
+    seen = set()
+    stack = [(entry, iter(entry.succs))]
+    seen.add(entry.id)
+    while stack:
+        bb, succs = stack[-1]
+        for succ in succs:
+            if succ.id in members and succ.id not in seen:
+                seen.add(succ.id)
+                stack.append((succ, iter(succ.succs)))
+                break
+        else:
+            stack.pop()
+            order.append(bb)
+    return order[::-1]
+
+# cooper, harvey & kennedy, "a simple, fast dominance algorithm"
+def compute_dominators(fn: SSAFunction):
+    order = fn.order
+    index = {bb.id: i for i, bb in enumerate(order)}
+    idom = {fn.entry.id: fn.entry.id}
+
+    def intersect(a, b):
+        while a != b:
+            while index[a] > index[b]:
+                a = idom[a]
+            while index[b] > index[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for bb in order[1:]:
+            preds = [p.id for p in bb.preds if p.id in idom]
+            if not preds:
+                continue
+            new = preds[0]
+            for p in preds[1:]:
+                new = intersect(p, new)
+            if idom.get(bb.id) != new:
+                idom[bb.id] = new
+                changed = True
+
+    fn.idom = idom
+
+    fn.frontier = {bb.id: set() for bb in order}
+    for bb in order:
+        preds = [p.id for p in bb.preds if p.id in idom]
+        if len(preds) < 2:
+            continue
+        for p in preds:
+            runner = p
+            while runner != idom[bb.id]:
+                fn.frontier[runner].add(bb.id)
+                runner = idom[runner]
+
+def place_phis(fn: SSAFunction):
+    def_blocks = {}
+    for bb in fn.order:
+        for instr in bb.instrs:
+            for var in instr_vars(instr)[0]:
+                def_blocks.setdefault(var, set()).add(bb.id)
+
+    fn.phis = {bb.id: [] for bb in fn.order}
+    for var, blocks in def_blocks.items():
+        has_phi = set()
+        work = list(blocks)
+        while work:
+            b = work.pop()
+            for f in fn.frontier[b]:
+                if f not in has_phi:
+                    has_phi.add(f)
+                    fn.phis[f].append(Phi(var, None))
+                    if f not in blocks:
+                        work.append(f)
+
+def rename(fn: SSAFunction):
+    by_id = {bb.id: bb for bb in fn.order}
+    children = {bb.id: [] for bb in fn.order}
+    for bb in fn.order[1:]:
+        children[fn.idom[bb.id]].append(bb.id)
+
+    counter = {}
+    stacks = {}
+
+    def current(var):
+        stack = stacks.get(var)
+        return stack[-1] if stack else (var, 0)
+
+    def fresh(var):
+        counter[var] = counter.get(var, 0) + 1
+        name = (var, counter[var])
+        stacks.setdefault(var, []).append(name)
+        return name
+
+    # iterative walk of the dominator tree, ("exit", ...) pops what the block pushed
+    work = [("enter", fn.entry.id)]
+    while work:
+        kind, b = work.pop()
+        if kind == "exit":
+            for var in b:
+                stacks[var].pop()
+            continue
+
+        bb = by_id[b]
+        pushed = []
+
+        for phi in fn.phis[b]:
+            phi.dest = fresh(phi.var)
+            pushed.append(phi.var)
+
+        for instr in bb.instrs:
+            defs, uses = instr_vars(instr)
+            fn.uses[id(instr)] = [current(var) for var in uses]
+            names = []
+            for var in defs:
+                names.append(fresh(var))
+                pushed.append(var)
+            fn.defs[id(instr)] = names
+
+        for succ in bb.succs:
+            if succ.id in by_id:
+                for phi in fn.phis[succ.id]:
+                    phi.args[b] = current(phi.var)
+
+        work.append(("exit", pushed))
+        for child in reversed(children[b]):
+            work.append(("enter", child))
+
+def build_ssa(cfg: CFG) -> SSAForm:
+    ssa = SSAForm(cfg)
+
+    functions = split_functions(cfg)
+    owners = {}
+    for blocks in functions:
+        for bb in blocks:
+            owners[bb.id] = owners.get(bb.id, 0) + 1
+
+    for blocks in functions:
+        fn = SSAFunction(blocks)
+        members = {bb.id for bb in blocks}
+
+        # a block two functions can reach (or one the cfg got wrong) is left as it is
+        if any(owners[bb.id] > 1 for bb in blocks):
+            ssa.skipped.append(fn)
+            continue
+
+        fn.order = reverse_postorder(fn.entry, members)
+        compute_dominators(fn)
+        place_phis(fn)
+        rename(fn)
+        ssa.functions.append(fn)
+
+    return ssa
+
+# the instructions never left their original names, so all that is left to drop is the ssa bookkeeping
+def destruct_ssa(ssa: SSAForm):
+    for fn in ssa.functions:
+        fn.phis.clear()
+        fn.defs.clear()
+        fn.uses.clear()
+    ssa.functions = []
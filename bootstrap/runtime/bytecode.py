@@ -0,0 +1,155 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import marshal
+import os
+
+from bootstrap.ir.ir import Instr
+from bootstrap.ir.operands import Reg, Imm
+from bootstrap.runtime.modules import MODULES
+
+# bump whenever lowering, regalloc or an opcode changes meaning, old .fgc files get recompiled
+BYTECODE_VERSION = 11
+FGC_MAGIC = b"FGC\x00"
+
+# the executable form of an Instr, registers are plain ints and there is no per-instruction dict
+#   a, b, c  - operands (reg ids, jump targets, names, constants), LABEL b = spill slots the frame needs
+#   args     - arg reg ids for calls / builds, param names for LABEL, fields for STRUCT_DEF
+#   extra    - live reg ids for calls (see annotate_call_saves), method names for STRUCT_DEF,
+#              frame slot names for LABEL (params first)
+#   cache    - the vm's InlineCache for GET_ATTR / CALL_METHOD, never serialised
+class Op:
+    __slots__ = ("op", "a", "b", "c", "args", "extra", "cache")
+
+    def __init__(self, op, a=None, b=None, c=None, args=(), extra=()):
+        self.op = op
+        self.a = a
+        self.b = b
+        self.c = c
+        self.args = args
+        self.extra = extra
+        self.cache = None
+
+    def __repr__(self):
+        return f"Op({self.op} {self.a} {self.b} {self.c} args={self.args} extra={self.extra})"
+
+def _operand(x: Any) -> Any:
+    if isinstance(x, Reg):
+        return x.id
+    if isinstance(x, Imm):
+        return x.value
+    if isinstance(x, list):
+        return tuple(_operand(r) for r in x)
+    return x
+
+def _reg_ids(regs) -> tuple:
+    return tuple(r.id for r in regs)
+
+# final lowering pass, runs after linking so CALL targets are already ips
+def lower(code: List[Instr]) -> List[Op]:
+    ops = []
+
+    for instr in code:
+        if instr.op == "LABEL":
+            op = Op("LABEL", instr.a, getattr(instr, "spill_slots", 0),
+                    c=getattr(instr, "struct_names", None),
+                    args=tuple(getattr(instr, "param_names", ())),
+                    extra=tuple(getattr(instr, "local_names", ())))
+
+        elif instr.op == "STRUCT_DEF":
+            op = Op("STRUCT_DEF", instr.a,
+                    args=tuple(getattr(instr, "fields", ())),
+                    extra=tuple(getattr(instr, "methods", ())))
+
+        elif instr.op == "CALL_BUILTIN":
+            op = Op("CALL_BUILTIN", instr.a, c=_operand(instr.c), args=_operand(instr.b))
+
+        else:
+            op = Op(instr.op, _operand(instr.a), _operand(instr.b), _operand(instr.c))
+
+            if hasattr(instr, "arg_regs"):
+                op.args = _reg_ids(instr.arg_regs)
+            if instr.op in ("CALL", "CALL_METHOD"):
+                # None tells the vm the call was never annotated and it has to save every reg
+                op.extra = tuple(instr.live_regs) if hasattr(instr, "live_regs") else None
+
+        ops.append(op)
+
+    return ops
+
+# .fgc layout: magic | u16 version | sha256 key | marshal((labels, constants, ops, modules))
+# LOAD_CONST b is stored as an index into the constant pool, STRUCT_DEFs carry the struct definitions.
+# modules is the source hash of everything the program imports, their functions may have been inlined
+# into it, so the file is stale as soon as one of them changes even if the program itself didn't
+def cache_key(source: str, num_regs: int, superinstructions: bool = True, inline_budget: int = None, allocator: str = "linear") -> bytes:
+    return hashlib.sha256(f"{BYTECODE_VERSION}:{num_regs}:{superinstructions:d}:{inline_budget}:{allocator}:{source}".encode("utf-8")).digest()
+
+def cache_path(filename: str) -> str:
+    return os.path.splitext(filename)[0] + ".fgc"
+
+# module name -> source hash for every module program imports, None for one that isn't there
+def module_hashes(program: List[Op], source_dir: str = ".") -> Dict[str, Optional[str]]:
+    hashes = {}
+    for op in program:
+        if op.op == "IMPORT_MODULE" and op.b not in hashes:
+            module = MODULES.load(op.b, source_dir)
+            hashes[op.b] = module.source_hash if module is not None else None
+    return hashes
+
+def write_fgc(path: str, key: bytes, program: List[Op], labels: Dict[str, int], source_dir: str = "."):
+    constants = []
+    const_index = {}
+    ops = []
+
+    for op in program:
+        b = op.b
+        if op.op == "LOAD_CONST":
+            # keyed on type and repr, otherwise True / 1 / 1.0 and -0.0 / 0.0 would share a slot
+            pool_key = (type(b), repr(b))
+            if pool_key not in const_index:
+                const_index[pool_key] = len(constants)
+                constants.append(b)
+            b = const_index[pool_key]
+
+        ops.append((op.op, op.a, b, op.c, op.args, op.extra))
+
+    payload = marshal.dumps((labels, constants, ops, module_hashes(program, source_dir)))
+
+    try:
+        with open(path, "wb") as f:
+            f.write(FGC_MAGIC + BYTECODE_VERSION.to_bytes(2, "little") + key + payload)
+
+    except OSError:
+        pass # a read-only dir just means no cache
+
+def read_fgc(path: str, key: bytes, source_dir: str = ".") -> Optional[Tuple[List[Op], Dict[str, int]]]:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+
+    except OSError:
+        return None
+
+    header_len = len(FGC_MAGIC) + 2
+    if (data[:len(FGC_MAGIC)] != FGC_MAGIC
+        or int.from_bytes(data[len(FGC_MAGIC):header_len], "little") != BYTECODE_VERSION
+        or data[header_len:header_len + len(key)] != key):
+        return None # stale or foreign file
+
+    try:
+        labels, constants, ops, modules = marshal.loads(data[header_len + len(key):])
+
+    except (EOFError, ValueError, TypeError):
+        return None
+
+    for name, source_hash in modules.items():
+        module = MODULES.load(name, source_dir)
+        if (module.source_hash if module is not None else None) != source_hash:
+            return None # an imported module changed, what was inlined from it is out of date
+
+    program = []
+    for name, a, b, c, args, extra in ops:
+        if name == "LOAD_CONST":
+            b = constants[b]
+        program.append(Op(name, a, b, c, args, extra))
+
+    return program, labels
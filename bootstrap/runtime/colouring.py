@@ -0,0 +1,307 @@
+from bootstrap.ir.cfg import CFG
+from bootstrap.ir.cfg_builder import build_cfg
+from bootstrap.ir.liveness import compute_liveness
+from bootstrap.ir.operands import Reg
+from bootstrap.ir.ssa import SSAFunction, split_functions, reverse_postorder, compute_dominators
+from bootstrap.runtime.regalloc import get_defs_uses, insert_spill_code, assign_registers, next_free_reg, pack_spill_slots
+
+# chaitin-briggs graph colouring, the slower alternative to linear_scan_allocate (run_source(allocator="colour")).
+#   build     an interference graph from the cfg's liveness, a def interferes with everything live after it
+#   coalesce  MOVEs whose two regs don't interfere (the ones gen_logic / gen_For emit), hottest first,
+#             as long as the merged node passes briggs' test, so coalescing never makes colouring fail
+#   simplify  take out nodes with fewer than num_regs neighbours, when there are none left pick the
+#             cheapest to spill (uses and defs weighted 10 per loop they're in, over its degree)
+#   select    put them back in reverse, each gets the lowest register its neighbours don't have. a node
+#             that finds none is spilled for real, the spill code goes in and it all starts over
+# coalesced MOVEs end up as `MOVE r r` and are dropped
+
+LOOP_WEIGHT = 10 # a use / def inside a loop costs this many outside it
+MAX_DEPTH = 6
+
+# block id -> how many natural loops the block is in
+def loop_depths(cfg: CFG):
+    depths = {bb.id: 0 for bb in cfg.blocks}
+
+    for blocks in split_functions(cfg):
+        fn = SSAFunction(blocks)
+        fn.order = reverse_postorder(fn.entry, {bb.id for bb in blocks})
+        compute_dominators(fn)
+
+        def dominates(a, b):
+            while b != a:
+                if b == fn.idom[b]:
+                    return False
+                b = fn.idom[b]
+            return True
+
+        bodies = {} # header -> every block of its loops
+        for bb in fn.order:
+            for header in bb.succs:
+                if header.id not in fn.idom or not dominates(header.id, bb.id):
+                    continue
+                body = bodies.setdefault(header.id, {header.id})
+                stack = [bb]
+                while stack:
+                    node = stack.pop()
+                    if node.id not in body:
+                        body.add(node.id)
+                        stack.extend(p for p in node.preds if p.id in fn.idom)
+
+        # a block two functions reach keeps the deeper of the two
+        counts = {}
+        for body in bodies.values():
+            for b in body:
+                counts[b] = counts.get(b, 0) + 1
+        for b, depth in counts.items():
+            depths[b] = max(depths[b], depth)
+
+    return depths
+
+class InterferenceGraph:
+    def __init__(self):
+        self.adj = {}   # reg -> regs it can't share a register with
+        self.cost = {}  # reg -> loop weighted uses and defs
+        self.span = {}  # reg -> instructions it's live across
+        self.moves = [] # (weight, dest, src)
+
+    def add_node(self, reg):
+        if reg not in self.adj:
+            self.adj[reg] = set()
+            self.cost[reg] = 0
+            self.span[reg] = 0
+
+    def add_edge(self, a, b):
+        if a != b:
+            self.adj[a].add(b)
+            self.adj[b].add(a)
+
+def build_graph(code):
+    cfg = build_cfg(code)
+    compute_liveness(cfg)
+    depths = loop_depths(cfg)
+    graph = InterferenceGraph()
+
+    for bb in cfg.blocks:
+        weight = LOOP_WEIGHT ** min(depths[bb.id], MAX_DEPTH)
+        live = set(bb.live_out)
+        for r in live:
+            graph.add_node(r)
+
+        for instr in reversed(bb.instrs):
+            defs, uses = get_defs_uses(instr)
+            defs = [d for d in defs if isinstance(d, Reg)]
+            uses = [u for u in uses if isinstance(u, Reg)]
+            for r in defs + uses:
+                graph.add_node(r)
+                graph.cost[r] += weight
+            for r in live:
+                graph.span[r] += 1
+
+            if instr.op == "MOVE" and uses:
+                # dest and src hold the same value, they only interfere if something else writes one of them
+                live.discard(uses[0])
+                graph.moves.append((weight, defs[0], uses[0]))
+
+            # a reg read for the last time here can be the dest, every handler reads before it writes
+            for d in defs:
+                for r in live:
+                    graph.add_edge(d, r)
+
+            live -= set(defs)
+            live |= set(uses)
+
+    return graph
+
+class Colouring:
+    def __init__(self, graph: InterferenceGraph, num_regs, unspillable):
+        self.graph = graph
+        self.num_regs = num_regs
+        self.unspillable = unspillable
+        self.alias = {}    # reg coalesced away -> the reg it was merged into
+        self.colour = {}   # reg -> physical register
+        self.spilled = []  # regs (coalesced nodes) that got no register
+        self.coalesced = 0 # MOVEs whose regs were merged
+
+    def find(self, reg):
+        while reg in self.alias:
+            reg = self.alias[reg]
+        return reg
+
+    def coalesce(self):
+        adj = self.graph.adj
+        k = self.num_regs
+
+        for _, dest, src in sorted(self.graph.moves, key=lambda m: -m[0]):
+            a, b = self.find(dest), self.find(src)
+            if a == b:
+                self.coalesced += 1
+                continue
+            if b in adj[a]:
+                continue
+            # a spill temp merged into a longer range would make that whole range unspillable
+            if a in self.unspillable or b in self.unspillable:
+                continue
+
+            # briggs: fewer than k neighbours of significant degree, the merged node will simplify
+            neighbours = adj[a] | adj[b]
+            significant = sum(1 for n in neighbours if len(adj[n]) - (n in adj[a] and n in adj[b]) >= k)
+            if significant >= k:
+                continue
+
+            for n in adj.pop(b):
+                adj[n].discard(b)
+                adj[n].add(a)
+            adj[a] = neighbours
+            self.graph.cost[a] += self.graph.cost.pop(b)
+            self.graph.span[a] += self.graph.span.pop(b)
+            self.alias[b] = a
+            self.coalesced += 1
+
+    def simplify(self):
+        adj = self.graph.adj
+        cost = self.graph.cost
+        k = self.num_regs
+        degree = {n: len(adj[n]) for n in adj}
+
+        # a reg read right after it's written would just be swapped for a spill temp live at the same point
+        def spill_cost(n):
+            if n in self.unspillable or self.graph.span[n] <= 1:
+                return (1, 0)
+            return (0, cost[n] / (degree[n] * self.graph.span[n]))
+
+        stack = []
+        low = [n for n in adj if degree[n] < k]
+        high = {n for n in adj if degree[n] >= k}
+        removed = set()
+
+        while low or high:
+            if low:
+                node = low.pop()
+            else:
+                # nothing is sure to get a register, push the cheapest one and hope (briggs' optimism)
+                node = min(high, key=lambda n: (spill_cost(n), n.id))
+                high.discard(node)
+
+            removed.add(node)
+            stack.append(node)
+            for n in adj[node]:
+                if n in removed:
+                    continue
+                degree[n] -= 1
+                if degree[n] == k - 1:
+                    high.discard(n)
+                    low.append(n)
+
+        return stack
+
+    def select(self, stack):
+        adj = self.graph.adj
+
+        for node in reversed(stack):
+            taken = {self.colour[n] for n in adj[node] if n in self.colour}
+            colour = next((c for c in range(self.num_regs) if c not in taken), None)
+            if colour is not None:
+                self.colour[node] = colour
+            elif node in self.unspillable:
+                raise IndexError(f"{self.num_regs} registers can't hold the regs spill code needs around {node}")
+            else:
+                self.spilled.append(node)
+
+    def run(self):
+        self.coalesce()
+        self.select(self.simplify())
+        return self
+
+def colour_allocate(code, num_regs):
+    next_reg = next_free_reg(code)
+    next_slot = 0
+    temps = set()
+
+    # spill, rewrite, build the graph again, until everything that's left gets a register
+    while True:
+        colouring = Colouring(build_graph(code), num_regs, set(temps)).run()
+        if not colouring.spilled:
+            break
+
+        # everything coalesced into a spilled node goes to its slot
+        slots = {}
+        for node in colouring.spilled:
+            slots[node] = next_slot
+            next_slot += 1
+        for reg in colouring.alias:
+            root = colouring.find(reg)
+            if root in slots:
+                slots[reg] = slots[root]
+
+        code, new_temps, next_reg = insert_spill_code(code, slots, next_reg)
+        temps |= new_temps
+
+    phys = {reg: colouring.colour[colouring.find(reg)] for reg in list(colouring.alias) + list(colouring.colour)}
+    code = assign_registers(code, phys)
+
+    # the coalesced moves are copies onto themselves now
+    cfg = build_cfg(code)
+    for bb in cfg.blocks:
+        bb.instrs = [instr for instr in bb.instrs if not (instr.op == "MOVE" and instr.a == instr.b)]
+    return pack_spill_slots(cfg.flatten())
+
+# executed instructions per opcode for a program allocated with `allocator`, the jit stays off so
+# every instruction goes through the counters
+def profile(path, allocator, num_regs):
+    import os
+    from collections import Counter
+    from bootstrap.compiler import compile_source
+    from bootstrap.runtime.superinstructions import profile_program
+
+    with open(path, "r", encoding="utf-8") as f:
+        source = f.read()
+    source_dir = os.path.dirname(os.path.abspath(path))
+
+    program, labels = compile_source(source, source_dir=source_dir, num_regs=num_regs, allocator=allocator)
+
+    static = Counter(op.op for op in program)
+    executed = Counter()
+    for ip, count in profile_program(program, labels, num_regs, source_dir).items():
+        executed[program[ip].op] += count
+    return static, executed
+
+# `python -m bootstrap.runtime.colouring [--regs n] files...`, spill code, MOVEs and executed
+# instructions with both allocators
+def main(argv):
+    num_regs = None
+    paths = []
+
+    args = iter(argv)
+    for arg in args:
+        if arg == "--regs":
+            num_regs = int(next(args))
+        else:
+            paths.append(arg)
+
+    if num_regs is None:
+        from bootstrap.runtime.regalloc import NUM_REGS
+        num_regs = NUM_REGS
+
+    spill_ops = ("SPILL_LOAD", "SPILL_STORE")
+    print(f"{'':<16} {'allocator':<9} {'spill ops':>9} {'moves':>6} {'executed':>12} {'':>7} {'spills run':>11} {'moves run':>10}")
+    for path in paths:
+        name = path.rsplit("/", 1)[-1]
+        baseline = None
+        for allocator in ("linear", "colour"):
+            try:
+                static, executed = profile(path, allocator, num_regs)
+            except IndexError:
+                print(f"{name:<16} {allocator:<9} doesn't fit in {num_regs} registers")
+                name = ""
+                continue
+
+            total = sum(executed.values())
+            delta = f"{(total - baseline) / baseline:+.1%}" if baseline else ""
+            baseline = baseline or total
+            print(f"{name:<16} {allocator:<9} {sum(static[op] for op in spill_ops):>9} {static['MOVE']:>6} {total:>12} "
+                  f"{delta:>7} {sum(executed[op] for op in spill_ops):>11} {executed['MOVE']:>10}")
+            name = ""
+
+if __name__ == "__main__":
+    import sys
+    main(sys.argv[1:])
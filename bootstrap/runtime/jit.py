@@ -0,0 +1,449 @@
+from collections import Counter
+import math
+
+from bootstrap.ir.ir import FUSED_BRANCH_OPS, FUSED_BRANCH_IMM_OPS
+from bootstrap.runtime.modules import ModuleNamespace
+
+# tracing jit for hot loops. every backward JUMP counts its target (the loop header) per segment, once a
+# header has been jumped to HOT_LOOP times the vm records one iteration: the ops it executes, which way
+# every branch went and the receiver type of every GET_ATTR / CALL_METHOD. that trace is compiled into a
+# python closure whose regs and slots are plain locals, each recorded branch direction and receiver type
+# becomes a guard, and the closure loops until a guard fails, then hands the vm the ip to resume at.
+# headers whose recording keeps aborting, or whose trace keeps exiting after an iteration or two,
+# are blacklisted and left to the interpreter
+
+HOT_LOOP = 50          # back edges before a header is recorded
+MAX_TRACE_LEN = 200    # ops, longer loop bodies are not worth it
+MAX_ABORTS = 3         # failed recordings before a header is blacklisted
+MIN_ENTRIES = 20       # trace entries before its exit rate is judged
+MIN_ITERATIONS = 1.0   # average iterations per entry, below that the entry / exit costs more than it saves
+
+BINARY = {
+    "ADD": "+", "SUB": "-", "MUL": "*", "DIV": "/", "POW": "**",
+    "ADD_NUM": "+", "SUB_NUM": "-", "MUL_NUM": "*", "DIV_NUM": "/", "POW_NUM": "**", "CONCAT_STR": "+",
+    "EQ": "==", "NE": "!=", "LT": "<", "GT": ">", "LE": "<=", "GE": ">=",
+    "EQ_NUM": "==", "NE_NUM": "!=", "LT_NUM": "<", "GT_NUM": ">", "LE_NUM": "<=", "GE_NUM": ">=",
+    "AND": "and",
+}
+
+IMM_BINARY = {"ADD_IMM": "+", "SUB_IMM": "-", "MUL_IMM": "*"}
+
+BRANCH_CMP = {
+    "JUMP_IF_NOT_EQ": "==", "JUMP_IF_NOT_NE": "!=", "JUMP_IF_NOT_LT": "<",
+    "JUMP_IF_NOT_GT": ">", "JUMP_IF_NOT_LE": "<=", "JUMP_IF_NOT_GE": ">=",
+}
+
+# everything else (calls, returns, imports, struct defs) ends the recording
+TRACEABLE = {
+    "LABEL", "LOAD_CONST", "LOAD_LOCAL", "STORE_LOCAL", "INC_LOCAL", "LOAD_VAR", "STORE_VAR",
+    "MOVE", "NEG", "NOT", "JUMP", "JUMP_IF_TRUE", "JUMP_IF_FALSE",
+    "GET_FIELD", "GET_ATTR", "CALL_METHOD", "CALL_BUILTIN", "BUILD_LIST", "BUILD_STRUCT",
+    "SPILL_STORE", "SPILL_LOAD",
+    *BINARY, *IMM_BINARY, *FUSED_BRANCH_OPS, *FUSED_BRANCH_IMM_OPS,
+}
+
+# one recorded op: its ip, the Op, whether it jumped, and what a cached site resolved to
+class TraceStep:
+    __slots__ = ("ip", "instr", "taken", "receiver", "entry", "types")
+
+    def __init__(self, ip, instr, types):
+        self.ip = ip
+        self.instr = instr
+        self.taken = False
+        self.receiver = None # type(obj) for GET_ATTR / CALL_METHOD
+        self.entry = None    # (kind, value) it resolved to
+        self.types = types   # operand type names, for diagnostics
+
+class Recording:
+    def __init__(self, key, anchor, code, decoded):
+        self.key = key
+        self.anchor = anchor
+        self.code = code
+        self.decoded = decoded # the segment's real decoded list, put back when recording stops
+        self.steps = []
+
+class Trace:
+    def __init__(self, key, anchor, steps, func, source):
+        self.key = key
+        self.anchor = anchor
+        self.steps = steps
+        self.func = func
+        self.source = source
+        self.entries = 0
+        self.iterations = 0
+        self.exits = Counter() # ip -> times a guard sent the vm back there
+        self.state = "compiled"
+
+    def enter(self, vm):
+        exit_ip, iterations = self.func(vm)
+        self.entries += 1
+        self.iterations += iterations
+        self.exits[exit_ip] += 1
+        return exit_ip
+
+    def exits_too_often(self):
+        return self.entries >= MIN_ENTRIES and self.iterations / self.entries < MIN_ITERATIONS
+
+class TraceJIT:
+    def __init__(self):
+        self.counters = Counter() # (id(code), header ip) -> back edges taken
+        self.traces = {}          # key -> Trace
+        self.aborts = Counter()   # key -> failed recordings
+        self.blacklist = {}       # key -> why
+        self.recording = None
+        self.retired = []         # dropped traces, kept for the stats
+
+    # called by op_JUMP for every jump to an earlier ip, returns what the handler returns
+    def back_edge(self, vm, target):
+        key = (id(vm.code), target)
+        rec = self.recording
+
+        if rec is not None:
+            if key == rec.key:
+                self.finish(vm)
+            else:
+                self.abort(vm, "left the loop") # an inner loop, or an outer one after this one exited
+
+        trace = self.traces.get(key)
+        if trace is not None:
+            vm.ip = trace.enter(vm)
+            if trace.exits_too_often():
+                # the path it recorded went cold, record whatever the loop does now
+                del self.traces[key]
+                self.retired.append(trace)
+                self.aborts[key] += 1
+                trace.state = "retraced"
+                if self.aborts[key] >= MAX_ABORTS:
+                    self.blacklist[key] = "exits too often"
+                    trace.state = "blacklisted"
+            return True
+
+        vm.ip = target
+        if key not in self.blacklist:
+            self.counters[key] += 1
+            if self.counters[key] >= HOT_LOOP and self.recording is None:
+                self.start(vm, key, target)
+
+        return True
+
+    def start(self, vm, key, anchor):
+        rec = Recording(key, anchor, vm.code, vm.decoded)
+        self.recording = rec
+
+        # the run loop picks the recording handlers up as soon as op_JUMP returns
+        vm.decoded = [
+            (self._recorder(vm, rec, ip, handler), instr)
+            for ip, (handler, instr) in enumerate(rec.decoded)
+        ]
+
+    def _recorder(self, vm, rec, ip, handler):
+        def record(instr):
+            if self.recording is not rec:
+                return self._resume(vm, handler(instr)) # stopped by an earlier op, get back on the real list
+
+            if instr.op not in TRACEABLE or len(rec.steps) >= MAX_TRACE_LEN:
+                self.abort(vm, f"{instr.op} in the loop" if instr.op not in TRACEABLE else "too long")
+                return self._resume(vm, handler(instr))
+
+            step = self._observe(vm, ip, instr)
+            if step is None:
+                self.abort(vm, f"unsupported {instr.op} receiver")
+                return self._resume(vm, handler(instr))
+
+            rec.steps.append(step)
+            result = handler(instr)
+            step.taken = result is not None
+            return result
+
+        return record
+
+    def _resume(self, vm, result):
+        # the run loop only rereads vm.decoded after a handler returns something
+        if result is None:
+            vm.ip += 1
+        return True
+
+    def _observe(self, vm, ip, instr):
+        from bootstrap.runtime.vm import _IC_FIELD, _IC_MEMBER, _IC_EXPORT
+
+        regs = vm.regs
+        step = TraceStep(ip, instr, [type(regs[r]).__name__ for r in reads(instr)])
+
+        if instr.op == "GET_ATTR":
+            obj = regs[instr.b]
+            try:
+                step.entry = vm._resolve_attr(obj, instr.c)
+            except Exception:
+                return None # let the interpreter raise it
+            step.receiver = type(obj)
+            if step.entry[0] not in (_IC_FIELD, _IC_MEMBER, _IC_EXPORT):
+                return None
+
+        elif instr.op == "CALL_METHOD":
+            obj = regs[instr.b]
+            try:
+                step.entry = vm._resolve_method(obj, instr.c)
+            except Exception:
+                return None
+            step.receiver = type(obj)
+            if step.entry[0] != _IC_MEMBER:
+                return None # struct methods and module functions push frames
+
+        elif instr.op == "BUILD_STRUCT":
+            if instr.b not in vm.structs:
+                return None
+            step.entry = vm.structs[instr.b]
+
+        return step
+
+    def abort(self, vm, reason):
+        rec = self.recording
+        self.recording = None
+        vm.decoded = rec.decoded
+        # the counter stays hot, so the next back edge records again, a loop whose recording
+        # started on its last iteration just left it and will make it through next time
+        self.aborts[rec.key] += 1
+        if self.aborts[rec.key] >= MAX_ABORTS:
+            self.blacklist[rec.key] = reason
+
+    def finish(self, vm):
+        rec = self.recording
+        self.recording = None
+        vm.decoded = rec.decoded
+        self.traces[rec.key] = compile_trace(rec)
+
+    # drop every trace, the loops get counted and recorded again
+    def invalidate(self):
+        for trace in self.traces.values():
+            trace.state = "invalidated"
+        self.retired.extend(self.traces.values())
+        self.traces.clear()
+        self.counters.clear()
+
+    def stats(self):
+        sites = []
+        for trace in list(self.traces.values()) + self.retired:
+            sites.append({
+                "ip": trace.anchor,
+                "state": trace.state,
+                "length": len(trace.steps),
+                "entries": trace.entries,
+                "iterations": trace.iterations,
+                "exits": dict(trace.exits),
+                "types": sorted({t for step in trace.steps for t in step.types}),
+            })
+
+        traced = {trace.key for trace in self.traces.values()} | {trace.key for trace in self.retired}
+        for key, reason in self.blacklist.items():
+            if key not in traced:
+                sites.append({"ip": key[1], "state": f"blacklisted ({reason})", "length": 0,
+                              "entries": 0, "iterations": 0, "exits": {}, "types": []})
+
+        return sorted(sites, key=lambda site: site["iterations"], reverse=True)
+
+# registers an op reads, in the lowered Op layout
+def reads(instr):
+    op = instr.op
+    if op in BINARY:
+        return [instr.b, instr.c]
+    if op in IMM_BINARY or op in ("NEG", "NOT", "MOVE", "GET_FIELD", "GET_ATTR", "STORE_LOCAL", "STORE_VAR", "SPILL_STORE"):
+        return [instr.b]
+    if op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE") or op in FUSED_BRANCH_IMM_OPS:
+        return [instr.a]
+    if op in FUSED_BRANCH_OPS:
+        return [instr.a, instr.b]
+    if op == "CALL_METHOD":
+        return [instr.b, *instr.args]
+    if op in ("CALL_BUILTIN", "BUILD_LIST", "BUILD_STRUCT"):
+        return list(instr.args)
+    return []
+
+def _literal(value):
+    if type(value) in (int, str, bool) or value is None or (type(value) is float and math.isfinite(value)):
+        return repr(value)
+    return None
+
+# trace -> python source for `def trace(vm)`, every reg / slot the trace touches is a local,
+# loaded on entry and written back on exit
+def compile_trace(rec):
+    from bootstrap.runtime.vm import _UNBOUND, _IC_FIELD, _IC_EXPORT
+
+    consts = {}
+    def const(value):
+        literal = _literal(value)
+        if literal is not None:
+            return literal
+        name = f"k{len(consts)}"
+        consts[name] = value
+        return name
+
+    body = []
+    regs_read, regs_written = set(), set()
+    slots_read, slots_written = set(), set()
+    uses_vars = uses_stack = False
+
+    def emit(line, depth=2):
+        body.append("    " * depth + line)
+
+    def guard(cond, exit_ip):
+        emit(f"if {cond}:")
+        emit(f"exit_ip = {exit_ip}", 3)
+        emit("break", 3)
+
+    def r(reg, write=False):
+        (regs_written if write else regs_read).add(reg)
+        return f"r{reg}"
+
+    def slot(index, write=False):
+        (slots_written if write else slots_read).add(index)
+        return f"l{index}"
+
+    for step in rec.steps:
+        instr, op, ip = step.instr, step.instr.op, step.ip
+        a, b, c = instr.a, instr.b, instr.c
+
+        if op == "LABEL":
+            continue
+
+        elif op == "LOAD_CONST":
+            emit(f"{r(a, True)} = {const(b)}")
+
+        elif op == "LOAD_LOCAL":
+            emit(f"{r(a, True)} = {slot(b)}")
+
+        elif op == "STORE_LOCAL":
+            emit(f"{slot(a, True)} = {r(b)}")
+
+        elif op == "INC_LOCAL":
+            slot(a)
+            emit(f"{slot(a, True)} = l{a} + {const(b)}")
+
+        elif op == "LOAD_VAR":
+            uses_vars = True
+            guard(f"{b!r} not in vars_", ip)
+            emit(f"{r(a, True)} = vars_[{b!r}]")
+
+        elif op == "STORE_VAR":
+            uses_vars = True
+            emit(f"vars_[{a!r}] = {r(b)}")
+
+        elif op == "MOVE":
+            emit(f"{r(a, True)} = {r(b)}")
+
+        elif op == "NEG":
+            emit(f"{r(a, True)} = -{r(b)}")
+
+        elif op == "NOT":
+            emit(f"{r(a, True)} = not {r(b)}")
+
+        elif op in BINARY:
+            left, right = r(b), r(c)
+            emit(f"{r(a, True)} = {left} {BINARY[op]} {right}")
+
+        elif op in IMM_BINARY:
+            left = r(b)
+            emit(f"{r(a, True)} = {left} {IMM_BINARY[op]} {const(c)}")
+
+        elif op == "JUMP":
+            continue # the trace is straight line, the closing jump is the loop itself
+
+        elif op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE"):
+            test = r(a) if op == "JUMP_IF_TRUE" else f"not {r(a)}"
+            # the guard fails when the branch goes the other way than it did while recording
+            if step.taken:
+                guard(f"not ({test})", ip + 1)
+            else:
+                guard(test, b)
+
+        elif op in FUSED_BRANCH_OPS or op in FUSED_BRANCH_IMM_OPS:
+            cmp = BRANCH_CMP[op[:-len("_IMM")] if op in FUSED_BRANCH_IMM_OPS else op]
+            right = const(b) if op in FUSED_BRANCH_IMM_OPS else r(b)
+            test = f"{r(a)} {cmp} {right}"
+            if step.taken:
+                guard(test, ip + 1)      # recorded jumping, i.e. the compare was false
+            else:
+                guard(f"not ({test})", c)
+
+        elif op == "GET_FIELD":
+            obj = r(b)
+            emit(f"{r(a, True)} = {obj}[{c}]")
+
+        elif op == "GET_ATTR":
+            obj = r(b)
+            guard(f"type({obj}) is not {const(step.receiver)}", ip)
+            kind, value = step.entry
+            if kind == _IC_FIELD:
+                emit(f"{r(a, True)} = {obj}[{value}]")
+            elif kind == _IC_EXPORT:
+                guard(f"{c!r} not in {obj}.exports", ip)
+                emit(f"{r(a, True)} = {obj}.exports[{c!r}]")
+            else:
+                emit("try:")
+                emit(f"{r(a, True)} = {const(value)}({obj}, [])", 3)
+                emit("except AttributeError:")
+                emit(f"exit_ip = {ip}", 3) # the interpreter redoes it and reports the error
+                emit("break", 3)
+
+        elif op == "CALL_METHOD":
+            obj = r(b)
+            args = ", ".join(r(x) for x in instr.args)
+            guard(f"type({obj}) is not {const(step.receiver)}", ip)
+            emit("try:")
+            emit(f"{r(a, True)} = {const(step.entry[1])}({obj}, [{args}])", 3)
+            emit("except (AttributeError, TypeError, NotImplementedError):")
+            emit(f"exit_ip = {ip}", 3)
+            emit("break", 3)
+
+        elif op == "CALL_BUILTIN":
+            args = ", ".join(r(x) for x in instr.args)
+            call = f"{const(vm_builtin(a))}.call(vm, [{args}])"
+            emit(f"vm.ip = {ip}") # for the error, if it raises
+            emit(f"{r(c, True)} = {call}" if c is not None else call)
+
+        elif op == "BUILD_LIST":
+            emit(f"{r(a, True)} = [{', '.join(r(x) for x in instr.args)}]")
+
+        elif op == "BUILD_STRUCT":
+            fields = ", ".join(r(x) for x in instr.args)
+            emit(f"{r(a, True)} = {const(step.entry)}([{fields}])")
+
+        elif op == "SPILL_STORE":
+            uses_stack = True
+            emit(f"stack[{a}] = {r(b)}")
+
+        elif op == "SPILL_LOAD":
+            uses_stack = True
+            emit(f"{r(a, True)} = stack[{b}]")
+
+    emit("n += 1")
+
+    regs = sorted(regs_read | regs_written)
+    slots = sorted(slots_read | slots_written)
+
+    lines = ["def trace(vm):", "    regs = vm.regs", "    slots = vm.locals"]
+    if uses_vars:
+        lines.append("    vars_ = vm.vars")
+    if uses_stack:
+        lines.append("    stack = vm.stack")
+    lines += [f"    r{x} = regs[{x}]" for x in regs]
+    lines += [f"    l{x} = slots[{x}]" for x in slots]
+
+    # a slot nobody stored to yet is the interpreter's error to report
+    unbound = " or ".join(f"l{x} is UNBOUND" for x in sorted(slots_read))
+    if unbound:
+        lines.append(f"    if {unbound}:")
+        lines.append(f"        return {rec.anchor}, 0")
+
+    lines += ["    n = 0", "    exit_ip = None", "    while True:", *body]
+    lines += [f"    regs[{x}] = r{x}" for x in sorted(regs_written)]
+    lines += [f"    slots[{x}] = l{x}" for x in sorted(slots_written)]
+    lines.append("    return exit_ip, n")
+    source = "\n".join(lines) + "\n"
+
+    namespace = {"UNBOUND": _UNBOUND, "ModuleNamespace": ModuleNamespace, **consts}
+    exec(compile(source, f"<trace@{rec.anchor}>", "exec"), namespace)
+    return Trace(rec.key, rec.anchor, rec.steps, namespace["trace"], source)
+
+def vm_builtin(name):
+    from bootstrap.runtime.builtins_registry import BUILTINS
+    return BUILTINS[name]
@@ -0,0 +1,41 @@
+from typing import Dict, List
+from bootstrap.ir.ir import Instr
+
+# runs once after linear_scan_allocate, so the vm never has to scan the code for a label
+def build_label_table(code: List[Instr]) -> Dict[str, int]:
+    labels = {}
+    for i, instr in enumerate(code):
+        if instr.op == "LABEL":
+            labels[instr.a] = i
+    return labels
+
+def link(code: List[Instr]) -> Dict[str, int]:
+    labels = build_label_table(code)
+
+    # CALL a=func_name b=None c=dest -> b becomes the resolved target ip, TAIL_CALL likewise
+    for instr in code:
+        if instr.op in ("CALL", "TAIL_CALL") and instr.a in labels:
+            instr.b = labels[instr.a]
+
+    return labels
+
+# every IMPORT_MODULE names its module statically, so all of them (and their own imports) are compiled
+# before the vm starts. each module keeps its own code segment, nothing is ever relocated or appended,
+# so an import at runtime only has to bind names and costs the same however big the importer is
+def link_modules(code, num_regs: int, source_dir: str = ".", seen=None):
+    from bootstrap.runtime.modules import MODULES
+
+    if seen is None:
+        seen = set()
+
+    for instr in code:
+        if instr.op != "IMPORT_MODULE":
+            continue
+
+        module = MODULES.load(instr.b, source_dir)
+        if module is None or module.path in seen:
+            continue # a missing module is reported by IMPORT_MODULE itself
+
+        seen.add(module.path)
+        MODULES.compile(module, num_regs, source_dir=source_dir)
+        link_modules(module.program, num_regs, source_dir, seen)
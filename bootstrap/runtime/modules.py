@@ -0,0 +1,120 @@
+from typing import Dict, Optional
+import hashlib
+import os
+
+# one entry per module file, shared by the Analyser (import checking) and the VM (IMPORT_MODULE),
+# so each module is lexed, parsed, analysed, compiled and run once per process per source hash
+class CompiledModule:
+    def __init__(self, name, path, source, source_hash):
+        self.name = name
+        self.path = path
+        self.source = source
+        self.source_hash = source_hash
+
+        self.tree = None     # analysed AST
+        self.symbols = None  # its SymbolTable
+
+        self.num_regs = None # what program was allocated for
+        self.program = None  # lowered Ops
+        self.labels = None
+
+        self.exports = None  # module vars after running its __main__
+        self.namespace = None # ModuleNamespace bound by every importer
+        self.structs = None   # record classes its STRUCT_DEFs made, name -> class
+
+# what `import { name }` binds, attribute access and calls on it are a single dict hit
+class ModuleNamespace:
+    __slots__ = ("name", "exports")
+    
+    def __init__(self, name, exports):
+        self.name = name
+        self.exports = exports # export name -> value, functions as ("__func__", ip, program)
+    
+    def __repr__(self):
+        return f"<module:{self.name}>"
+
+class ModuleRegistry:
+    def __init__(self):
+        self.modules: Dict[str, CompiledModule] = {} # abs path -> entry
+
+    def load(self, module_name, source_dir=".") -> Optional[CompiledModule]:
+        path = os.path.join(source_dir, f"{module_name}.fg")
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r", encoding="utf-8") as f:
+            source = f.read()
+
+        source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        key = os.path.abspath(path)
+        module = self.modules.get(key)
+
+        if module is None or module.source_hash != source_hash:
+            module = CompiledModule(module_name, path, source, source_hash)
+            self.modules[key] = module
+
+        return module
+
+    def analyse(self, module, source_dir="."):
+        if module.tree is not None:
+            return module
+
+        # imported here, the analyser itself imports this module
+        from bootstrap.frontend.lexer import Lexer
+        from bootstrap.frontend.parser import Parser
+        from bootstrap.semantic.analyser import Analyser
+        from bootstrap.semantic.symbol_table import SymbolTable
+
+        tokens = Lexer(module.source).get_tokens()
+        tree = Parser(tokens).parse()
+        symbols = SymbolTable()
+        Analyser(symbols, source_dir=source_dir).analyse(tree)
+
+        module.tree = tree
+        module.symbols = symbols
+        return module
+
+    def compile(self, module, num_regs, source_dir="."):
+        if module.program is not None and module.num_regs == num_regs:
+            return module
+
+        from bootstrap.optimiser.optimiser import Optimiser
+        from bootstrap.ir.generator import IRGenerator
+        from bootstrap.ir.cfg_builder import build_cfg
+        from bootstrap.ir.liveness import remove_unreachable, annotate_call_saves
+        from bootstrap.ir.ssa import build_ssa, destruct_ssa
+        from bootstrap.ir.sccp import propagate_constants
+        from bootstrap.ir.gvn import number_values
+        from bootstrap.runtime.regalloc import linear_scan_allocate
+        from bootstrap.runtime.superinstructions import fuse_superinstructions
+        from bootstrap.runtime.linker import link
+        from bootstrap.runtime.bytecode import lower
+
+        self.analyse(module, source_dir)
+
+        # the optimiser rewrites the tree in place, so this only ever runs once per entry
+        if module.program is None:
+            module.tree = Optimiser().optimise(module.tree)
+
+        ir_gen = IRGenerator(source_dir=source_dir)
+        ir_gen.generate(module.tree)
+        cfg = build_cfg(ir_gen.ir.code)
+        remove_unreachable(cfg)
+        ssa = build_ssa(cfg)
+        propagate_constants(cfg, ssa) # neither of these drops a store that can run, so exports stay
+        number_values(cfg, ssa)
+        destruct_ssa(ssa)
+        # no eliminate_dead_stores here, a store nobody in the module reads is still an export
+
+        allocated = linear_scan_allocate(cfg.flatten(), num_regs=num_regs)
+        allocated = fuse_superinstructions(allocated)
+        annotate_call_saves(allocated)
+        module.labels = link(allocated)
+        module.program = lower(allocated)
+        module.num_regs = num_regs
+        module.exports = None
+        module.namespace = None
+        module.structs = None
+        return module
+
+MODULES = ModuleRegistry()
@@ -1,25 +1,60 @@
-from bootstrap.ir.ir import Instr
+from bisect import bisect_left, insort
+from heapq import heappush, heappop
+from itertools import count
+
+from bootstrap.ir.ir import Instr, FUSED_BRANCH_OPS, FUSED_BRANCH_IMM_OPS
 from bootstrap.ir.operands import Reg
-#from collections import namedtuple
+
+# physical registers per vm, every live range gets one of these or a spill slot
+NUM_REGS = 64
 
 # Live range structure
 class LiveRange:
-    def __init__(self, reg, start, end):
-        self.reg = reg       # virtual register
-        self.start = start   # first instruction index
-        self.end = end       # last instruction index
-        self.phys = None     # physical register assigned
+    def __init__(self, reg, ranges, edges=None):
+        self.reg = reg           # virtual register
+        self.ranges = ranges     # [(first, last)] instruction indices it's live at, ascending, holes between
+        self.edges = edges or [(False, False)] * len(ranges) # per piece, starts / ends at a block boundary
+        self.start = ranges[0][0]
+        self.end = ranges[-1][1]
+        self.phys = None         # physical register assigned
         self.slot = None
+        self.spillable = True    # the short regs spill code loads into / stores from are not
+        self.piece = 0           # index into ranges linear_scan has got to, the ones before it are over
+    
+    # moves piece up to pos: True if that piece covers pos, False in a hole, None once the range is over
+    def advance(self, pos):
+        ranges = self.ranges
+        i = self.piece
+        while i < len(ranges) and ranges[i][1] < pos:
+            i += 1
+        self.piece = i
+        if i == len(ranges):
+            return None
+        return ranges[i][0] <= pos
+    
+    def intersects(self, other):
+        i, j = self.piece, other.piece
+        a, b = self.ranges, other.ranges
+        while i < len(a) and j < len(b):
+            if a[i][1] < b[j][0]:
+                i += 1
+            elif b[j][1] < a[i][0]:
+                j += 1
+            else:
+                return True
+        return False
 
 # Compute defs and uses per opcode
 def get_defs_uses(instr):
-    if instr.op in ("LOAD_CONST", "LOAD_VAR"):
+    if instr.op in ("LOAD_CONST", "LOAD_VAR", "LOAD_LOCAL"):
         return [instr.a], []
 
     # Arithmetic / comparisons that write to dest (a) and read b,c
     elif instr.op in (
         "ADD", "SUB", "MUL", "DIV", "POW",
         "EQ", "NE", "LT", "GT", "LE", "GE", "AND",
+        "ADD_NUM", "SUB_NUM", "MUL_NUM", "DIV_NUM", "POW_NUM", "CONCAT_STR",
+        "EQ_NUM", "NE_NUM", "LT_NUM", "GT_NUM", "LE_NUM", "GE_NUM",
     ):
         uses = []
         if instr.b: uses.append(instr.b)
@@ -28,12 +63,26 @@ def get_defs_uses(instr):
     
     elif instr.op in ("NEG", "NOT", "MOVE"):
         return [instr.a], [instr.b]
+    
+    # superinstructions, c / b is the folded constant (see fuse_superinstructions)
+    elif instr.op in ("ADD_IMM", "SUB_IMM", "MUL_IMM"):
+        return [instr.a], [instr.b]
+    
+    elif instr.op == "INC_LOCAL":
+        return [], []
 
-    elif instr.op == "STORE_VAR":
+    elif instr.op in ("STORE_VAR", "STORE_LOCAL"):
         return [], [instr.b]
 
     elif instr.op in ("JUMP", "JUMP_IF_TRUE", "JUMP_IF_FALSE"):
         return [], [instr.a] if instr.op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE") else []
+    
+    elif instr.op in FUSED_BRANCH_OPS:
+        # a, b = compared regs, c = target ip
+        return [], [instr.a, instr.b]
+    
+    elif instr.op in FUSED_BRANCH_IMM_OPS:
+        return [], [instr.a]
 
     elif instr.op == "SPILL_STORE":
         return [], [instr.b]
@@ -47,13 +96,17 @@ def get_defs_uses(instr):
         uses = instr.arg_regs if hasattr(instr, 'arg_regs') else []
         return defs, uses
     
+    elif instr.op == "TAIL_CALL":
+        # no dest, the callee returns straight to our caller
+        return [], instr.arg_regs if hasattr(instr, "arg_regs") else []
+    
     elif instr.op == "CALL_BUILTIN":
         defs = [instr.c] if instr.c else []
         uses = instr.b if isinstance(instr.b, list) else ([instr.b] if instr.b else [])
         return defs, uses
 
-    elif instr.op == "GET_ATTR":
-        # a = dest, b = obj_reg, c = attr_name (str)
+    elif instr.op in ("GET_ATTR", "GET_FIELD"):
+        # a = dest, b = obj_reg, c = attr_name (str) / field offset
         return [instr.a], [instr.b]
     
     elif instr.op == "CALL_METHOD":
@@ -79,89 +132,432 @@ def get_defs_uses(instr):
         print(f"Warning: unknown op in regalloc: {instr.op}")
         return [], []
 
-# Compute live ranges based on defs/uses
-def compute_live_ranges(code):
-    first = {}
-    last = {}
+# the fields a register is read from / written to, so spill code can swap one reg for another
+def replace_use(instr, old, new):
+    op = instr.op
+    if op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE", "RETURN") or op in FUSED_BRANCH_IMM_OPS:
+        fields = ("a",)
+    elif op in FUSED_BRANCH_OPS:
+        fields = ("a", "b")
+    elif op in ("NEG", "NOT", "MOVE", "GET_FIELD", "GET_ATTR", "CALL_METHOD", "STORE_VAR", "STORE_LOCAL",
+                "SPILL_STORE", "ADD_IMM", "SUB_IMM", "MUL_IMM"):
+        fields = ("b",)
+    elif op in ("CALL_BUILTIN", "CALL", "TAIL_CALL", "BUILD_LIST", "BUILD_STRUCT", "LOAD_CONST", "LOAD_VAR",
+                "LOAD_LOCAL", "SPILL_LOAD", "INC_LOCAL", "LABEL", "STRUCT_DEF", "IMPORT_MODULE", "JUMP"):
+        fields = ()
+    else:
+        fields = ("b", "c") # arithmetic / comparisons
+    
+    for field in fields:
+        if getattr(instr, field) == old:
+            setattr(instr, field, new)
+    if hasattr(instr, "arg_regs"):
+        instr.arg_regs = [new if r == old else r for r in instr.arg_regs]
+    if op == "CALL_BUILTIN" and isinstance(instr.b, list):
+        instr.b = [new if r == old else r for r in instr.b]
 
-    for i, instr in enumerate(code):
-        defs, uses = get_defs_uses(instr)
-        for r in defs + uses:
-            if isinstance(r, Reg):
-                first.setdefault(r, i)
-                last[r] = i
+def replace_def(instr, old, new):
+    field = "c" if instr.op in ("CALL", "CALL_BUILTIN") else "a"
+    if getattr(instr, field) == old:
+        setattr(instr, field, new)
 
-    ranges = [LiveRange(r, first[r], last[r]) for r in first]
-    ranges.sort(key=lambda x: x.start)
+# live ranges from the cfg's live_in / live_out, so a value that is live around a loop's back edge
+# covers the whole loop, not just up to its last index in the flat code, and a register that is dead
+# for a stretch (a hole) can hold something else there. a piece's edges say whether it starts at a
+# block's start because the reg is live into it (not at a def) and ends at a block's end because the
+# reg is live out of it (not at a use), move_ranges needs that to keep the pieces up with spill code
+def compute_live_ranges(code):
+    from bootstrap.ir.cfg_builder import build_cfg # liveness imports this module
+    from bootstrap.ir.liveness import compute_liveness
+    
+    cfg = build_cfg(code)
+    compute_liveness(cfg)
+    
+    pieces = {} # reg -> [(first, last, live in, live out)], descending, blocks are walked back to front
+    
+    def add(reg, first, last, live_in, live_out):
+        ranges = pieces.get(reg)
+        if ranges is None:
+            pieces[reg] = [(first, last, live_in, live_out)]
+        elif ranges[-1][0] <= last + 1: # nothing added later starts after the last piece
+            _, end, _, end_out = ranges[-1]
+            if last > end:
+                end, end_out = last, live_out
+            elif last == end:
+                end_out = end_out or live_out
+            ranges[-1] = (first, end, live_in, end_out)
+        else:
+            ranges.append((first, last, live_in, live_out))
+    
+    for bb in reversed(cfg.blocks):
+        if not bb.instrs:
+            continue
+        
+        first = bb.start
+        last = bb.start + len(bb.instrs) - 1
+        live = set(bb.live_out)
+        for r in live:
+            add(r, first, last, True, True)
+        
+        for pos in range(last, first - 1, -1):
+            defs, uses = get_defs_uses(code[pos])
+            
+            for d in defs:
+                if not isinstance(d, Reg):
+                    continue
+                if d in live:
+                    ranges = pieces[d]
+                    _, end, _, live_out = ranges[-1]
+                    ranges[-1] = (pos, end, False, live_out) # live from here on, not from the block start
+                    live.discard(d)
+                else:
+                    add(d, pos, pos, False, False) # never read, but the write still needs a register
+            
+            for u in uses:
+                if isinstance(u, Reg) and u not in live: # a live reg's piece already starts at the block
+                    add(u, first, pos, True, False)
+                    live.add(u)
+    
+    ranges = []
+    for r, descending in pieces.items():
+        ascending = descending[::-1]
+        ranges.append(LiveRange(r, [(first, last) for first, last, _, _ in ascending],
+                                [(live_in, live_out) for _, _, live_in, live_out in ascending]))
+    ranges.sort(key=lambda x: (x.start, x.reg.id))
     return ranges
 
-def pick_spill(active, current):
-    candidates = active + [current]
-    return max(candidates, key=lambda r: r.end)
+# linear scan with lifetime holes: `active` ranges hold their register at the current position,
+# `inactive` ones are in a hole and only block their register for ranges that overlap them.
+# nothing is split, a range either keeps one register for its whole life or goes to memory.
+# both sets are heaps keyed on the next position the range changes state at, so a step only touches
+# the ranges that expire / go into a hole / come back there. ranges sharing a register never overlap,
+# so each register keeps its ranges' pieces sorted, and whether current overlaps any of them is a
+# bisect per piece of current, only done for the registers the scan is about to pick. ties between
+# spill candidates go to the one that became active first, `order` numbers them
+def linear_scan(ranges, num_regs):
+    active = []                  # (end of the piece it's in, order, range)
+    inactive = []                # (start of its next piece, order, range)
+    parked = {}                  # register -> how many inactive ranges are on it, only ones with some
+    occupied = [[] for _ in range(num_regs)] # register -> pieces after the first of the ranges given it, sorted
+    taken = set()                # registers of the active ranges
+    holders = [0] * num_regs     # active + inactive ranges on each register
+    free = list(range(num_regs)) # heap of the registers no range holds, lowest first
+    order = count()
+    spilled = []
+    
+    def release(phys):
+        holders[phys] -= 1
+        if not holders[phys]:
+            heappush(free, phys)
+    
+    def park(r):
+        parked[r.phys] = parked.get(r.phys, 0) + 1
+    
+    def unpark(r):
+        parked[r.phys] -= 1
+        if not parked[r.phys]:
+            del parked[r.phys]
+    
+    # only an inactive range can block its register, while a range is active its register isn't looked
+    # at, or only as its own when it's the spill victim. so its first piece, the one it's active in when
+    # it gets the register, never has to be found in occupied, and a range without holes stays out
+    def assign(r, phys):
+        r.phys = phys
+        if len(r.ranges) == 1:
+            return
+        pieces = occupied[phys]
+        for piece in r.ranges[1:]:
+            if not pieces or pieces[-1] < piece:
+                pieces.append(piece) # the usual case, nothing on phys is live past current's start
+            else:
+                insort(pieces, piece)
+    
+    # a range on phys (other than `own`) overlaps current, so current can't have it. the ones that
+    # are over end before current starts, so only the inactive ones can be found
+    def blocked(phys, own=None):
+        pieces = occupied[phys]
+        if not pieces:
+            return False
+        mine = set(own.ranges[1:]) if own is not None else ()
+        for first, last in current.ranges:
+            i = max(bisect_left(pieces, (first + 1,)) - 1, 0) # the last piece starting at or before first
+            while i < len(pieces) and pieces[i][0] <= last:
+                if pieces[i][1] >= first and pieces[i] not in mine:
+                    return True
+                i += 1
+        return False
+    
+    for current in ranges:
+        pos = current.start
+        
+        left = []
+        while active and active[0][0] < pos:
+            _, n, r = heappop(active)
+            if r.phys is None:
+                continue # spilled while it was active
+            state = r.advance(pos)
+            if state:
+                heappush(active, (r.ranges[r.piece][1], n, r)) # keeps its place
+                continue
+            taken.discard(r.phys)
+            if state is None:
+                release(r.phys)
+            else:
+                left.append((n, r))
+        if left:
+            for n, r in sorted(left):
+                heappush(inactive, (r.ranges[r.piece][0], next(order), r))
+                park(r)
+        
+        back = []
+        while inactive and inactive[0][0] <= pos:
+            _, n, r = heappop(inactive)
+            state = r.advance(pos)
+            if state is None:
+                unpark(r)
+                release(r.phys)
+            elif state:
+                unpark(r)
+                back.append((n, r))
+            else:
+                heappush(inactive, (r.ranges[r.piece][0], n, r))
+        if back:
+            for n, r in sorted(back):
+                taken.add(r.phys)
+                heappush(active, (r.ranges[r.piece][1], next(order), r))
+        
+        # a register only ranges in a hole hold is as good as a free one, unless one of them overlaps.
+        # the lowest one wins, so only the parked registers below the lowest free one are looked at
+        phys = free[0] if free else None
+        if parked:
+            for p in sorted(parked):
+                if phys is not None and p > phys:
+                    break
+                if p not in taken and not blocked(p):
+                    phys = p
+                    break
+        
+        if phys is not None:
+            if free and free[0] == phys:
+                heappop(free)
+            assign(current, phys)
+            holders[phys] += 1
+            taken.add(phys)
+            heappush(active, (current.ranges[0][1], next(order), current))
+            continue
+        
+        # whatever ends last goes to memory, on a tie the range active the longest, current only after
+        # them all. spilling an active range only helps if no inactive range on its register overlaps
+        # current, so the candidates are checked in that order and only until one isn't blocked
+        victim = current if current.spillable else None
+        candidates = sorted(((-r.end, n), r) for _, n, r in active if r.phys is not None and r.spillable)
+        for _, r in candidates:
+            if victim is not None and r.end < victim.end:
+                break
+            if not blocked(r.phys, r):
+                victim = r
+                break
+        if victim is None:
+            raise IndexError(f"{num_regs} registers can't hold everything live at ip {pos}")
+        
+        if victim is current:
+            spilled.append(current)
+            continue
+        
+        if len(victim.ranges) > 1:
+            pieces = occupied[victim.phys]
+            for piece in victim.ranges[1:]:
+                del pieces[bisect_left(pieces, piece)]
+        assign(current, victim.phys)
+        victim.phys = None
+        heappush(active, (current.ranges[0][1], next(order), current))
+        spilled.append(victim)
+    
+    return spilled
 
-def linear_scan_allocate(code, num_regs):
-    ranges = compute_live_ranges(code)
-    active = []
-    free_regs = list(range(num_regs))
+# every read of a spilled reg becomes a SPILL_LOAD into a fresh reg right before it, every write goes
+# to a fresh reg with a SPILL_STORE right after. the loads before an instruction open its block just as
+# the instruction did, so a jump to it lands on the first of them, where flatten would put the block
+def insert_spill_code(code, slots, next_reg):
+    code, temps, _, next_reg = rewrite_spills(code, slots, next_reg)
+    return code, set(temps), next_reg
+
+# insert_spill_code straight on the flat code, no cfg. also hands back each temp's piece and where
+# every old index went: moved[i] = (its first SPILL_LOAD, itself, its last SPILL_STORE)
+def rewrite_spills(code, slots, next_reg):
     new_code = []
+    temps = {} # temp reg -> (first, last)
+    moved = []
     
-    next_slot = 0
-
-    def expire_old(current_start):
-        nonlocal active, free_regs
-        still_active = []
-        for r in active:
-            if r.end >= current_start:
-                still_active.append(r)
-            else:
-                free_regs.append(r.phys)
-        active[:] = still_active
+    for instr in code:
+        defs, uses = get_defs_uses(instr)
+        first = len(new_code)
+        loads = []
+        stores = []
+        
+        for u in dict.fromkeys([u for u in uses if u in slots]):
+            temp = Reg(next_reg)
+            next_reg += 1
+            loads.append((temp, len(new_code)))
+            new_code.append(Instr("SPILL_LOAD", temp, slots[u]))
+            replace_use(instr, u, temp)
+        
+        for d in defs:
+            if d in slots:
+                temp = Reg(next_reg)
+                next_reg += 1
+                replace_def(instr, d, temp)
+                stores.append(Instr("SPILL_STORE", slots[d], temp))
+        
+        at = len(new_code)
+        new_code.append(instr)
+        for temp, pos in loads:
+            temps[temp] = (pos, at)
+        for store in stores:
+            temps[store.b] = (at, len(new_code))
+            new_code.append(store)
+        moved.append((first, at, len(new_code) - 1))
+    
+    def remap(target):
+        if not isinstance(target, int):
+            return target
+        return moved[target][0] if target < len(moved) else len(new_code)
+    
+    for i, instr in enumerate(new_code):
+        if instr.op == "JUMP":
+            new_code[i] = Instr(instr.op, remap(instr.a), instr.b, instr.c)
+        elif instr.op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE"):
+            new_code[i] = Instr(instr.op, instr.a, remap(instr.b), instr.c)
+        elif instr.op in FUSED_BRANCH_OPS or instr.op in FUSED_BRANCH_IMM_OPS:
+            new_code[i] = Instr(instr.op, instr.a, instr.b, remap(instr.c))
+    
+    return new_code, temps, moved, next_reg
 
+# the ranges of the next round after rewrite_spills, what compute_live_ranges would find in the new code
+# without redoing liveness: the spilled ones are gone, the temps live from their load to their use / def
+# to store, and everything else keeps its pieces at the new indices. a piece that starts at a block's
+# start now starts at the loads opening it, one that ends at a block's end takes in the stores closing it
+def move_ranges(ranges, temps, moved):
+    new_ranges = []
     for r in ranges:
-        expire_old(r.start)
-        if not free_regs:
-            victim = pick_spill(active, r)
-
-            if victim is r:
-                r.slot = next_slot
-                next_slot += 1
-                r.phys = None
-                continue
-            else:
-                # spill an active range
-                victim.slot = next_slot
-                next_slot += 1
+        if r.slot is not None:
+            continue
+        pieces = [(moved[first][0] if live_in else moved[first][1], moved[last][2] if live_out else moved[last][1])
+                  for (first, last), (live_in, live_out) in zip(r.ranges, r.edges)]
+        new = LiveRange(r.reg, pieces, r.edges)
+        new.spillable = r.spillable
+        new_ranges.append(new)
+    
+    for reg, piece in temps.items():
+        temp = LiveRange(reg, [piece])
+        temp.spillable = False
+        new_ranges.append(temp)
+    
+    new_ranges.sort(key=lambda x: (x.start, x.reg.id))
+    return new_ranges
+
+# first virtual register id nothing in code uses
+def next_free_reg(code):
+    return 1 + max(
+        (r.id for instr in code for rs in get_defs_uses(instr) for r in rs if isinstance(r, Reg)),
+        default=-1
+    )
 
-                free_regs.append(victim.phys)
-                active.remove(victim)
+# the allocators hand every spilled reg a slot of its own, this folds them back down: two slots share
+# an index unless one is stored to while the other is still live (liveness over the cfg, like regs),
+# lowest free index first. every LABEL gets how many indices its function ended up with as
+# spill_slots, the vm sizes each frame's spill list with it
+def pack_spill_slots(code):
+    from bootstrap.ir.cfg_builder import build_cfg
+    from bootstrap.ir.ssa import split_functions
+    
+    cfg = build_cfg(code)
+    for bb in cfg.blocks:
+        bb.slots_in, bb.slots_out = set(), set()
+        bb.slot_uses, bb.slot_defs = set(), set()
+        for instr in bb.instrs:
+            if instr.op == "SPILL_LOAD" and instr.b not in bb.slot_defs:
+                bb.slot_uses.add(instr.b)
+            elif instr.op == "SPILL_STORE":
+                bb.slot_defs.add(instr.a)
+    
+    changed = True
+    while changed:
+        changed = False
+        for bb in reversed(cfg.blocks):
+            new_out = set()
+            for succ in bb.succs:
+                new_out |= succ.slots_in
+            new_in = bb.slot_uses | (new_out - bb.slot_defs)
+            if new_in != bb.slots_in or new_out != bb.slots_out:
+                bb.slots_in, bb.slots_out = new_in, new_out
+                changed = True
+    
+    interferes = {}
+    for bb in cfg.blocks:
+        live = set(bb.slots_out)
+        for instr in reversed(bb.instrs):
+            if instr.op == "SPILL_STORE":
+                interferes.setdefault(instr.a, set()).update(live - {instr.a})
+                for s in live - {instr.a}:
+                    interferes.setdefault(s, set()).add(instr.a)
+                live.discard(instr.a)
+            elif instr.op == "SPILL_LOAD":
+                interferes.setdefault(instr.b, set())
+                live.add(instr.b)
+    
+    index = {}
+    for slot in sorted(interferes):
+        taken = {index[s] for s in interferes[slot] if s in index}
+        index[slot] = next(i for i in range(len(taken) + 1) if i not in taken)
+    
+    for bb in cfg.blocks:
+        for instr in bb.instrs:
+            if instr.op == "SPILL_STORE":
+                instr.a = index[instr.a]
+            elif instr.op == "SPILL_LOAD":
+                instr.b = index[instr.b]
+    
+    for blocks in split_functions(cfg):
+        used = [instr.a if instr.op == "SPILL_STORE" else instr.b
+                for bb in blocks for instr in bb.instrs if instr.op in ("SPILL_STORE", "SPILL_LOAD")]
+        blocks[0].instrs[0].spill_slots = max(used) + 1 if used else 0
+    
+    return cfg.flatten()
+
+# liveness is computed once, every spill round after that moves the ranges along with the spill code
+def linear_scan_allocate(code, num_regs):
+    next_reg = next_free_reg(code)
+    next_slot = 0
+    ranges = compute_live_ranges(code)
+    
+    # spill, rewrite, allocate again, until everything that's left fits. the spill code's own regs
+    # only live for one instruction and are never spilled, so every round gets rid of at least one reg
+    while True:
+        spilled = linear_scan(ranges, num_regs)
+        if not spilled:
+            break
         
-        r.phys = free_regs.pop(0)
-        active.append(r)
-        active.sort(key=lambda x: x.end)
+        for r in spilled:
+            r.slot = next_slot
+            next_slot += 1
+        code, temps, moved, next_reg = rewrite_spills(code, {r.reg: r.slot for r in spilled}, next_reg)
+        ranges = move_ranges(ranges, temps, moved)
     
+    return pack_spill_slots(assign_registers(code, {r.reg: r.phys for r in ranges}))
+
+# virtual Reg -> physical register number, into a new IR list
+def assign_registers(code, phys):
     def rewrite_operand(op):
         if isinstance(op, Reg):
-            lr = range_map.get(op) # lookup virtual Reg object
-            if lr is None:
-                return op
-            if lr.phys is not None:
-                return Reg(lr.phys)
+            p = phys.get(op) # lookup virtual Reg object
+            if p is not None:
+                return Reg(p)
         return op
     
     # Rewrite registers in a new IR list
-    range_map = {r.reg: r for r in ranges}
+    new_code = []
     for instr in code:
-
-        defs, uses = get_defs_uses(instr)
-
-        # reload uses
-        for u in uses:
-            if not isinstance(u, Reg):
-                continue
-            lr = range_map[u]
-            if lr.slot is not None:
-                new_code.append(Instr("SPILL_LOAD", lr.phys, lr.slot))
-        
         if instr.op == "CALL_BUILTIN":
             new_instr = Instr(
                 instr.op,
@@ -209,17 +605,106 @@ def linear_scan_allocate(code, num_regs):
             new_instr.fields = instr.fields
         if hasattr(instr, "struct_names"):
             new_instr.struct_names = instr.struct_names
+        if hasattr(instr, "local_names"):
+            new_instr.local_names = instr.local_names
         if hasattr(instr, "methods"):
             new_instr.methods = instr.methods
 
         new_code.append(new_instr)
 
-        # spill defs
-        for d in defs:
-            if not isinstance(d, Reg):
-                continue
-            lr = range_map[d]
-            if lr.slot is not None:
-                new_code.append(Instr("SPILL_STORE", lr.slot, lr.phys))
+    return new_code
+
+# straight-line code with loops and diamonds, for timing the allocator on programs far bigger than
+# anything the compiler makes yet. every loop reads values from before it (live around the back edge)
+# and keeps up to `pressure` temps alive, so 64 registers have to spill some of them
+def synthetic_program(size, seed=0, pressure=80):
+    import random
+    from bootstrap.ir.operands import Imm
+    
+    rng = random.Random(seed)
+    code = [Instr("LABEL", "__main__")]
+    regs = count()
+    
+    while len(code) < size:
+        outer = [Reg(next(regs)) for _ in range(rng.randint(pressure // 4, pressure))]
+        for r in outer:
+            code.append(Instr("LOAD_CONST", r, Imm(rng.randint(0, 9))))
+        limit = Reg(next(regs))
+        code.append(Instr("LOAD_CONST", limit, Imm(10)))
+        
+        head = len(code)
+        i = Reg(next(regs))
+        exit_branch = Instr("JUMP_IF_NOT_LT", i, limit, None)
+        code += [Instr("LOAD_LOCAL", i, 0), exit_branch]
+        
+        pool = list(outer)
+        for _ in range(rng.randint(10, 60)):
+            d = Reg(next(regs))
+            code.append(Instr(rng.choice(("ADD_NUM", "SUB_NUM", "MUL_NUM")), d, rng.choice(pool), rng.choice(pool)))
+            pool.append(d)
+            if len(pool) > pressure:
+                pool.pop(rng.randrange(len(outer), len(pool)))
+            
+            if rng.random() < 0.1: # an if, whatever it defines has a hole where it's skipped
+                skip = Instr("JUMP_IF_FALSE", rng.choice(pool), None)
+                code.append(skip)
+                for _ in range(rng.randint(1, 4)):
+                    d = Reg(next(regs))
+                    code.append(Instr("ADD_NUM", d, rng.choice(pool), rng.choice(outer)))
+                code.append(Instr("STORE_LOCAL", 1, d))
+                skip.b = len(code)
+        
+        code += [Instr("STORE_LOCAL", 0, pool[-1]), Instr("JUMP", head)]
+        exit_branch.c = len(code)
+        code += [Instr("STORE_LOCAL", 1, r) for r in outer]
+    
+    code.append(Instr("RETURN", None))
+    return code
+
+# k ranges taking turns on one register, each live once early and once late. they all sit in a hole on
+# it at the same time, the case where checking every inactive range would make the scan quadratic
+def interleaved_ranges(k):
+    return [LiveRange(Reg(i), [(2 * i, 2 * i), (10 * k + 2 * i, 10 * k + 2 * i)]) for i in range(k)]
+
+# allocate is the whole linear_scan_allocate: liveness once, then a scan, spill rewrite and move_ranges
+# per round, then assign_registers / pack_spill_slots. all of them are linear in the code or n log n
+def main(argv):
+    from time import perf_counter
+    
+    sizes = (10_000, 100_000, 1_000_000)
+    num_regs = NUM_REGS
+    
+    args = iter(argv)
+    for arg in args:
+        if arg == "-n":
+            sizes = tuple(int(n) for n in next(args).split(","))
+        elif arg == "--regs":
+            num_regs = int(next(args))
+    
+    print(f"{'instrs':>10} {'ranges':>10} {'liveness':>9} {'scan':>8} {'allocate':>9} {'spill ops':>10}")
+    for size in sizes:
+        code = synthetic_program(size)
+        
+        start = perf_counter()
+        ranges = compute_live_ranges(code)
+        computed = perf_counter()
+        linear_scan(ranges, num_regs)
+        scanned = perf_counter()
+        
+        allocated = linear_scan_allocate(code, num_regs)
+        done = perf_counter()
+        
+        spills = sum(instr.op in ("SPILL_LOAD", "SPILL_STORE") for instr in allocated)
+        print(f"{len(code):>10} {len(ranges):>10} {computed - start:>8.2f}s {scanned - computed:>7.2f}s "
+              f"{done - scanned:>8.2f}s {spills:>10}")
+    
+    print(f"\n{'ranges':>10} {'scan':>8}  all in a hole on one register at once")
+    for size in sizes:
+        ranges = interleaved_ranges(size // 10)
+        start = perf_counter()
+        linear_scan(ranges, 1)
+        print(f"{len(ranges):>10} {perf_counter() - start:>7.2f}s")
 
-    return new_code
\ No newline at end of file
+if __name__ == "__main__":
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+from typing import Dict, Tuple
+
+# a struct instance is a tuple of its field values in STRUCT_DEF order, so a field is a fixed offset
+# and the compiler can turn `x` inside a method into GET_FIELD idx instead of a name lookup.
+# every struct type gets its own subclass, which carries the name and the offset table
+class StructRecord(tuple):
+    __slots__ = ()
+
+    __type__ = None
+    __fields__ = ()
+    __offsets__ = {}
+
+    # two structs are only equal if they are the same struct type
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.__type__, tuple(self)))
+
+    # same text the old dict representation printed
+    def __repr__(self):
+        return repr({"__type__": self.__type__, **dict(zip(self.__fields__, self))})
+
+    __str__ = __repr__
+
+# (name, fields) -> record class, shared by every vm so module structs are the same type everywhere
+RECORD_TYPES: Dict[Tuple[str, tuple], type] = {}
+
+def record_type(name, fields):
+    fields = tuple(fields)
+    key = (name, fields)
+
+    cls = RECORD_TYPES.get(key)
+    if cls is None:
+        cls = type(name, (StructRecord,), {
+            "__slots__": (),
+            "__type__": name,
+            "__fields__": fields,
+            "__offsets__": {field: i for i, field in enumerate(fields)},
+        })
+        RECORD_TYPES[key] = cls
+
+    return cls
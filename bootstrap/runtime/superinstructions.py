@@ -0,0 +1,258 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import os
+import sys
+
+from bootstrap.ir.ir import Instr, FUSED_BRANCH_OPS, FUSED_BRANCH_IMM_OPS
+from bootstrap.ir.operands import Reg, Imm
+from bootstrap.ir.cfg_builder import build_cfg, branch_target
+from bootstrap.ir.liveness import compute_liveness
+from bootstrap.runtime.regalloc import get_defs_uses, NUM_REGS
+
+# superinstruction formation, runs on the allocated code (physical regs) before annotate_call_saves / link.
+# the fused ops are the top dynamic n-grams `python -m bootstrap.runtime.superinstructions --dynamic`
+# reported over examples/ and the test programs:
+#   LOAD_LOCAL r x / LOAD_CONST k n / ADD_NUM d r k / STORE_LOCAL x d  ->  INC_LOCAL x n
+#   LOAD_CONST k n / ADD_NUM d r k                                      ->  ADD_IMM d r n
+#   LOAD_CONST k n / JUMP_IF_NOT_LT r k target                          ->  JUMP_IF_NOT_LT_IMM r n target
+# a window only fuses inside one basic block, and only if the regs it no longer writes are dead after it
+
+IMM_ARITH = {"ADD_NUM": "ADD_IMM", "SUB_NUM": "SUB_IMM", "MUL_NUM": "MUL_IMM"}
+COMMUTATIVE = ("ADD_NUM", "MUL_NUM")
+
+# `n < r` is `r > n`, so a constant lhs can still be folded
+SWAPPED_BRANCH = {
+    "JUMP_IF_NOT_EQ": "JUMP_IF_NOT_EQ", "JUMP_IF_NOT_NE": "JUMP_IF_NOT_NE",
+    "JUMP_IF_NOT_LT": "JUMP_IF_NOT_GT", "JUMP_IF_NOT_GT": "JUMP_IF_NOT_LT",
+    "JUMP_IF_NOT_LE": "JUMP_IF_NOT_GE", "JUMP_IF_NOT_GE": "JUMP_IF_NOT_LE",
+}
+
+def _const(instr):
+    return instr.b.value if isinstance(instr.b, Imm) else instr.b
+
+def _match_inc_local(instrs, i, live_after):
+    if i + 4 > len(instrs):
+        return None
+    
+    load, const, op, store = instrs[i:i + 4]
+    if (load.op != "LOAD_LOCAL" or const.op != "LOAD_CONST" or store.op != "STORE_LOCAL"
+        or store.a != load.b or store.b != op.a or load.a == const.a):
+        return None
+    
+    if op.op == "ADD_NUM" and (op.b, op.c) in ((load.a, const.a), (const.a, load.a)):
+        step = _const(const)
+    elif op.op == "SUB_NUM" and (op.b, op.c) == (load.a, const.a):
+        step = -_const(const) # x - n is exactly x + -n for ints and floats
+    else:
+        return None
+    
+    if any(r in live_after[i + 3] for r in (load.a, const.a, op.a)):
+        return None
+    
+    return Instr("INC_LOCAL", load.b, Imm(step), load.c), 4
+
+def _match_imm_arith(instrs, i, live_after):
+    if i + 2 > len(instrs):
+        return None
+    
+    const, op = instrs[i:i + 2]
+    if const.op != "LOAD_CONST" or op.op not in IMM_ARITH:
+        return None
+    
+    k = const.a
+    if op.c == k and op.b != k:
+        other = op.b
+    elif op.op in COMMUTATIVE and op.b == k and op.c != k:
+        other = op.c
+    else:
+        return None
+    
+    # the dest may reuse k, that write still happens
+    if k in live_after[i + 1] and k != op.a:
+        return None
+    
+    return Instr(IMM_ARITH[op.op], op.a, other, Imm(_const(const))), 2
+
+def _match_imm_branch(instrs, i, live_after):
+    if i + 2 > len(instrs):
+        return None
+    
+    const, branch = instrs[i:i + 2]
+    if const.op != "LOAD_CONST" or branch.op not in FUSED_BRANCH_OPS:
+        return None
+    
+    k = const.a
+    if branch.b == k and branch.a != k:
+        op, other = branch.op, branch.a
+    elif branch.a == k and branch.b != k:
+        op, other = SWAPPED_BRANCH[branch.op], branch.b
+    else:
+        return None
+    
+    if k in live_after[i + 1]:
+        return None
+    
+    return Instr(f"{op}_IMM", other, Imm(_const(const)), branch.c), 2
+
+# longest first, so INC_LOCAL wins over the ADD_IMM inside it
+PATTERNS = (_match_inc_local, _match_imm_arith, _match_imm_branch)
+
+def _live_after(bb):
+    live = set(bb.live_out)
+    after = [None] * len(bb.instrs)
+    
+    for i in reversed(range(len(bb.instrs))):
+        after[i] = set(live)
+        defs, uses = get_defs_uses(bb.instrs[i])
+        live -= {d for d in defs if isinstance(d, Reg)}
+        live |= {u for u in uses if isinstance(u, Reg)}
+    
+    return after
+
+def fuse_superinstructions(code: List[Instr]) -> List[Instr]:
+    cfg = build_cfg(code)
+    compute_liveness(cfg)
+    
+    fused = []
+    new_ip = {} # old ip -> new ip, every block start gets one
+    
+    for bb in cfg.blocks:
+        live_after = _live_after(bb)
+        i = 0
+        
+        while i < len(bb.instrs):
+            new_ip[bb.start + i] = len(fused)
+            
+            for match in PATTERNS:
+                result = match(bb.instrs, i, live_after)
+                if result is not None:
+                    break
+            else:
+                result = (bb.instrs[i], 1)
+            
+            instr, width = result
+            fused.append(instr)
+            i += width
+    
+    # same remapping cfg.flatten does, jump targets are always block starts
+    def remap(target):
+        if not isinstance(target, int):
+            return target
+        return new_ip.get(target, len(fused))
+    
+    for i, instr in enumerate(fused):
+        if instr.op == "JUMP":
+            fused[i] = Instr(instr.op, remap(instr.a), instr.b, instr.c)
+        elif instr.op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE"):
+            fused[i] = Instr(instr.op, instr.a, remap(instr.b), instr.c)
+        elif instr.op in FUSED_BRANCH_OPS or instr.op in FUSED_BRANCH_IMM_OPS:
+            fused[i] = Instr(instr.op, instr.a, instr.b, remap(branch_target(instr)))
+    
+    return fused
+
+# opcode n-gram mining, picks which sequences are worth a fused instruction
+#   python -m bootstrap.runtime.superinstructions [--dynamic] [-n 2,3,4] [--top 25] prog.fg ...
+# static counts every n-gram in the compiled code once, --dynamic runs the programs and weights each
+# n-gram by how often its first instruction executed. n-grams never cross a basic block boundary,
+# since a jump landing in the middle of one could never be fused
+
+def block_ngrams(code, sizes: Iterable[int]) -> List[Tuple[int, Tuple[str, ...]]]:
+    # (start ip, opcode tuple) for every n-gram that stays inside one basic block
+    grams = []
+    for bb in build_cfg(code).blocks:
+        ops = [instr.op for instr in bb.instrs]
+        for n in sizes:
+            for i in range(len(ops) - n + 1):
+                grams.append((bb.start + i, tuple(ops[i:i + n])))
+    return grams
+
+def mine_static(programs: Dict[str, list], sizes: Iterable[int]) -> Counter:
+    counts = Counter()
+    for code in programs.values():
+        for _, gram in block_ngrams(code, sizes):
+            counts[gram] += 1
+    return counts
+
+def mine_dynamic(programs: Dict[str, Tuple[list, Dict[str, int], str]], sizes: Iterable[int]) -> Counter:
+    counts = Counter()
+
+    for program, labels, source_dir in programs.values():
+        executed = profile_program(program, labels, NUM_REGS, source_dir)
+        for start, gram in block_ngrams(program, sizes):
+            if start in executed:
+                counts[gram] += executed[start]
+
+    return counts
+
+# runs a compiled program with its output thrown away, executions per ip of the program itself. imported
+# modules are profiled when they are passed in on their own. the vm is only imported here so fusing
+# superinstructions during a compile doesn't load it, and the jit stays off since traced loops would
+# skip the counters
+def profile_program(program: list, labels: Dict[str, int], num_regs: int, source_dir: str) -> Counter:
+    import contextlib
+    import io
+    from bootstrap.runtime.vm import VM
+
+    class ProfilingVM(VM):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.executed = {} # id(program) -> ip -> count
+
+        def decode(self, code):
+            counts = self.executed.setdefault(id(code), Counter())
+
+            def counting(handler, ip):
+                def run(instr):
+                    counts[ip] += 1
+                    return handler(instr)
+                return run
+
+            return [(counting(handler, ip), instr) for ip, (handler, instr) in enumerate(super().decode(code))]
+
+    vm = ProfilingVM(num_regs=num_regs, source_dir=source_dir, jit=False)
+    vm.code = program
+    vm.labels = labels
+    vm.ip = vm.find_label("__main__")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        vm.run(program)
+
+    return vm.executed.get(id(program), Counter())
+
+def main(argv):
+    dynamic = "--dynamic" in argv
+    fused = "--fused" in argv
+    sizes = (2, 3, 4)
+    top = 25
+    paths = []
+
+    args = iter(argv)
+    for arg in args:
+        if arg == "-n":
+            sizes = tuple(int(n) for n in next(args).split(","))
+        elif arg == "--top":
+            top = int(next(args))
+        elif not arg.startswith("--"):
+            paths.append(arg)
+
+    from bootstrap.compiler import compile_source
+
+    programs = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            source = f.read()
+        source_dir = os.path.dirname(os.path.abspath(path))
+        program, labels = compile_source(source, source_dir=source_dir, superinstructions=fused)
+        programs[path] = (program, labels, source_dir)
+
+    if dynamic:
+        counts = mine_dynamic(programs, sizes)
+    else:
+        counts = mine_static({path: program for path, (program, _, _) in programs.items()}, sizes)
+
+    total = sum(counts.values()) or 1
+    for gram, count in counts.most_common(top):
+        print(f"{count:>12} {count / total:7.2%}  {' '.join(gram)}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
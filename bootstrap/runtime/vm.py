@@ -5,405 +5,762 @@ from bootstrap.exceptions import *
 from .builtins_registry import BUILTINS
 from .methods import resolve_member
 
-from bootstrap.frontend.lexer import Lexer
-from bootstrap.frontend.parser import Parser
-from bootstrap.semantic.analyser import Analyser
-from bootstrap.semantic.symbol_table import SymbolTable
-from bootstrap.optimiser.optimiser import Optimiser
-from bootstrap.ir.generator import IRGenerator
-from bootstrap.ir.cfg_builder import build_cfg
-from bootstrap.ir.liveness import remove_unreachable
-from bootstrap.runtime.regalloc import linear_scan_allocate
+from bootstrap.runtime.linker import link, link_modules
+from bootstrap.runtime.bytecode import Op
+from bootstrap.runtime.modules import MODULES, ModuleNamespace
+from bootstrap.runtime.structs import StructRecord, record_type
+from bootstrap.runtime.jit import TraceJIT
+
+_UNBOUND = object() # a frame slot nothing has been stored to yet
+_NO_SPILLS = () # spill slots of a frame that never spills
+
+# inline caches, see InlineCache at the bottom
+CACHED_OPS = ("GET_ATTR", "CALL_METHOD")
+IC_MAX_ENTRIES = 4 # receiver types a site remembers before it is megamorphic
+
+_IC_FIELD, _IC_EXPORT, _IC_MEMBER, _IC_METHOD = range(4) # entry kinds
 
 # past-josh: PLEASE FOR THE LOVE OF GOD REFACTOR TO REGISTER-BASED!!
 # future-josh: your wish is my command
 
 # other past-josh: ok... PLEASE GET RID OF THIS AND COMPILE TO BYTECODE!!!!!!
 class VM:
-    def __init__(self, num_regs, source_dir="."):
+    def __init__(self, num_regs, source_dir=".", jit=True):
         self.num_regs = num_regs
         self.regs = [None] * self.num_regs
         self.free_regs = list(range(self.num_regs))
-        self.vars = {}
-        self.stack = {}
-        self.call_stack = [] # (ip, locals)
-        self.code = None # to be set in main.py
+        self.vars = {} # names only the runtime knows, i.e. module aliases
+        self.locals = [] # current frame's slots, see LOAD_LOCAL / STORE_LOCAL
+        self.stack = [] # current frame's spill slots, as many as its LABEL says, see SPILL_STORE / SPILL_LOAD
+        self.call_stack = [] # Frame
+        self.code = None # lowered Ops, to be set in main.py
         self.ip = 0 # instruction pointer
         
         self.builtins = BUILTINS
         
-        self.structs = {}
-        self.struct_methods = {}
+        self.structs = {} # struct name -> record class
+        self.struct_methods = {} # struct name -> method name -> (segment, ip)
+        self.labels = {} # label -> ip, filled by the linker
         
         self.source_dir = source_dir
+        
+        # opcode -> bound handler, every `op_<OPCODE>` method below is an instruction
+        self.dispatch = {
+            name[len("op_"):]: getattr(self, name)
+            for name in dir(self) if name.startswith("op_")
+        }
+        self.decoded = []
+        self.segments = {} # id(program) -> (program, decoded), one per module this vm has entered
+        self.inline_caches = [] # every InlineCache this vm decoded
+        self.jit = TraceJIT() if jit else None # hot loop traces, see bootstrap/runtime/jit.py
     
     def _compile_and_run_module(self, module_name):
-        path = os.path.join(self.source_dir, f"{module_name}.fg")
-        if not os.path.exists(path):
+        module = MODULES.load(module_name, self.source_dir)
+        if module is None:
+            path = os.path.join(self.source_dir, f"{module_name}.fg")
             raise RuntimeError(
                 message=f"Module '{module_name}' not found at '{path}'",
                 ip=self.ip
             )
         
-        with open(path, "r", encoding="utf-8") as f:
-            source = f.read()
-        
-        tokens = Lexer(source).get_tokens()
-        tree = Parser(tokens).parse()
-        Analyser(SymbolTable(), source_dir=self.source_dir).analyse(tree)
-        tree = Optimiser().optimise(tree)
-        ir_gen = IRGenerator()
-        ir_gen.generate(tree)
-        cfg = build_cfg(ir_gen.ir.code)
-        remove_unreachable(cfg)
+        MODULES.compile(module, self.num_regs, source_dir=self.source_dir)
         
-        flat = cfg.flatten()
-        allocated = linear_scan_allocate(flat, num_regs=self.num_regs)
+        # a module's top level only ever runs once, every later import shares its namespace
+        if module.namespace is None:
+            child_vm = VM(num_regs=self.num_regs, source_dir=self.source_dir, jit=self.jit is not None)
+            child_vm.code = module.program
+            child_vm.labels = module.labels
+            child_vm.ip = child_vm.find_label("__main__")
+            child_vm.run(module.program)
+            module.structs = child_vm.structs
+            
+            # the module's globals are the slots of its __main__ frame
+            module.exports = dict(child_vm.vars)
+            main_slots = module.program[module.labels["__main__"]].extra
+            for name, value in zip(main_slots, child_vm.locals):
+                if value is not _UNBOUND:
+                    module.exports[name] = value
+            
+            exports = dict(module.exports)
+            for label, ip in module.labels.items():
+                if module.program[ip].c is None and label != "__main__":
+                    exports[label] = ("__func__", ip, module.program)
+            
+            module.namespace = ModuleNamespace(module_name, exports)
         
-        child_vm = VM(num_regs=self.num_regs, source_dir=self.source_dir)
-        child_vm.code = allocated
-        child_vm.ip = child_vm.find_label("__main__")
-        child_vm.run(allocated)
-        return child_vm.vars, allocated
+        return module
+    
+    def bind_struct_methods(self, program, labels):
+        bound = False
+        for label, ip in labels.items():
+            struct_name = program[ip].c # LABEL c = owning struct
+            if struct_name is not None:
+                method_name = label[len(struct_name) + 1:]
+                self.struct_methods.setdefault(struct_name, {})[method_name] = (program, ip)
+                bound = True
+        return bound
     
     def dump_regs(self): # simple dump debugger
         print(f"used regs: {len([reg for reg in self.regs if reg is not None])}")
-        print(f"used spills: {len(self.stack)}")
+        print(f"used spills: {len([value for value in self.stack if value is not None])}")
         
         for index, reg in enumerate(self.regs): # prints every used reg
             if reg is not None:
                 print(f"reg {index} {reg}")
         
-        for slot, value in self.stack.items(): # prints every spill var in stack
-            print(f"spill {slot} {value}")
+        for slot, value in enumerate(self.stack): # prints every spill var in stack
+            if value is not None:
+                print(f"spill {slot} {value}")
     
     def find_label(self, label_name): # for functions / gen calls
-        for i, instr in enumerate(self.code):
-            if instr.op == "LABEL" and instr.a == label_name:
-                return i
+        if label_name in self.labels:
+            return self.labels[label_name]
         
         raise LabelNotFoundError(
             message=f"Label not found: {label_name}",
             ip=self.ip
         )
     
+    def push_frame(self, call_instr, dest):
+        # the callee always starts with a fresh vars dict, so the caller's is kept by reference,
+        # and only the registers still live after the call (see annotate_call_saves) are saved
+        live_regs = call_instr.extra
+        if live_regs is None:
+            live_regs = range(self.num_regs) # unannotated code, save everything
+        
+        regs = self.regs
+        self.call_stack.append(Frame(
+            self.ip + 1,
+            self.vars,
+            self.locals,
+            self.stack,
+            live_regs,
+            [regs[r] for r in live_regs],
+            dest,
+            self.code,
+            self.decoded
+        ))
+    
+    def enter_frame(self, label, values):
+        # params are the first slots of the callee's frame, the rest start unbound
+        frame_locals = list(values[:len(label.args)])
+        frame_locals += [_UNBOUND] * (len(label.extra) - len(frame_locals))
+        self.locals = frame_locals
+        self.vars = {}
+        # spill slots are per frame, a recursive call would overwrite its caller's. LABEL b is how many
+        # the function needs (see pack_spill_slots), one that spills nothing shares the empty tuple
+        self.stack = [None] * label.b if label.b else _NO_SPILLS
+    
+    def decode(self, code):
+        # resolve every instruction to its handler once, so the run loop never compares opcode strings
+        decoded = []
+        for ip, instr in enumerate(code):
+            if instr.op in CACHED_OPS:
+                # module code is shared between vms, so each vm caches on its own copy of the site
+                instr = Op(instr.op, instr.a, instr.b, instr.c, instr.args, instr.extra)
+                instr.cache = InlineCache(ip, instr.op, instr.c)
+                self.inline_caches.append(instr.cache)
+            
+            decoded.append((self.dispatch.get(instr.op, self._unknown_opcode), instr))
+        
+        return decoded
+    
+    def inline_cache_stats(self):
+        # most misses first, megamorphic sites float to the top
+        return sorted(
+            (cache.stats() for cache in self.inline_caches if cache.hits or cache.misses),
+            key=lambda site: site["misses"],
+            reverse=True
+        )
+    
+    def dump_inline_caches(self): # like dump_regs, but for GET_ATTR / CALL_METHOD sites
+        for site in self.inline_cache_stats():
+            state = "megamorphic" if site["megamorphic"] else f"{len(site['types'])}-way"
+            print(f"{site['op']} .{site['name']} @ {site['ip']}: "
+                  f"{site['hits']} hits, {site['misses']} misses, {state} {site['types']}")
+    
+    def jit_stats(self):
+        return self.jit.stats() if self.jit is not None else []
+    
+    def dump_jit(self): # one line per traced loop header
+        for site in self.jit_stats():
+            exits = ", ".join(f"@{ip} x{count}" for ip, count in sorted(site["exits"].items()))
+            print(f"loop @ {site['ip']}: {site['state']}, {site['length']} ops, {site['entries']} entries, "
+                  f"{site['iterations']} iterations, exits [{exits}] {site['types']}")
+    
+    def enter_segment(self, program):
+        # the main program and every imported module are separate code segments, ips are per segment
+        if program is self.code:
+            return
+        
+        entry = self.segments.get(id(program))
+        if entry is None:
+            entry = (program, self.decode(program))
+            self.segments[id(program)] = entry
+        
+        self.code = program
+        self.decoded = entry[1]
+    
     def run(self, code):
-        self.code = code
+        link_modules(code, self.num_regs, source_dir=self.source_dir)
+        
+        self.code = None
+        self.enter_segment(code)
         self.structs = {}
-        self.struct_methods = {}
         
-        for i, instr in enumerate(code):
+        # struct defs are hoisted so BUILD_STRUCT never depends on where its STRUCT_DEF sits
+        for instr in code:
             if instr.op == "STRUCT_DEF":
-                self.struct_methods[instr.a] = {
-                    "fields": getattr(instr, "fields", []),
-                    "methods": getattr(instr, "methods", [])
-                }
-            
-            elif instr.op == "LABEL" and getattr(instr, "struct_names", None) is not None:
-                self.struct_methods[instr.a] = i
+                self.op_STRUCT_DEF(instr)
         
-        while self.ip < len(self.code):
-            instr = self.code[self.ip]
-            op, a, b, c = instr.op, instr.a, instr.b, instr.c
-            
-            if op == "LOAD_CONST":
-                self.regs[a.id] = b.value
+        if not self.labels:
+            self.labels = link(code)
+        
+        main_ip = self.labels.get("__main__")
+        self.locals = [_UNBOUND] * len(code[main_ip].extra) if main_ip is not None else []
+        self.stack = [None] * code[main_ip].b if main_ip is not None else []
+        
+        self.struct_methods = {}
+        self.bind_struct_methods(code, self.labels)
+        
+        # handlers return None to fall through to the next instruction,
+        # anything else means they already moved self.ip (and maybe switched segment)
+        while True:
+            decoded = self.decoded
+            while self.ip < len(decoded):
+                handler, instr = decoded[self.ip]
+                if handler(instr) is None:
+                    self.ip += 1
+                elif self.decoded is not decoded:
+                    break # a call or return crossed into another module's segment
+            else:
+                break # fell off the end of the segment
+    
+    def _unknown_opcode(self, instr):
+        raise UnknownOpcodeError(
+            message=f"Unknown opcode {instr.op}",
+            ip=self.ip,
+            instruction=f"{instr.op} {instr.a} {instr.b} {instr.c}"
+        )
+    
+    def op_LOAD_CONST(self, instr):
+        self.regs[instr.a] = instr.b
+    
+    def op_LOAD_VAR(self, instr):
+        b = instr.b
+        if b not in self.vars:
+            raise RuntimeError(
+                message=f"Undefined variable '{b}'",
+                ip=self.ip
+            )
+        
+        self.regs[instr.a] = self.vars[b]
+    
+    def op_STORE_VAR(self, instr):
+        self.vars[instr.a] = self.regs[instr.b]
+    
+    def op_LOAD_LOCAL(self, instr):
+        value = self.locals[instr.b]
+        if value is _UNBOUND:
+            raise RuntimeError(
+                message=f"Undefined variable '{instr.c}'",
+                ip=self.ip
+            )
+        
+        self.regs[instr.a] = value
+    
+    def op_STORE_LOCAL(self, instr):
+        self.locals[instr.a] = self.regs[instr.b]
+    
+    # superinstruction for LOAD_LOCAL / LOAD_CONST / ADD_NUM / STORE_LOCAL, `x = x + 1` is one dispatch
+    def op_INC_LOCAL(self, instr):
+        value = self.locals[instr.a]
+        if value is _UNBOUND:
+            raise RuntimeError(
+                message=f"Undefined variable '{instr.c}'",
+                ip=self.ip
+            )
+        
+        self.locals[instr.a] = value + instr.b
+    
+    def _resolve_attr(self, obj, attr_name):
+        if isinstance(obj, ModuleNamespace):
+            return (_IC_EXPORT, None) # exports differ per module, so only the kind is cached
+        
+        if isinstance(obj, StructRecord):
+            offset = obj.__offsets__.get(attr_name)
+            if offset is None:
+                raise RuntimeError(
+                    message=f"Struct has no field '{attr_name}'",
+                    ip=self.ip
+                )
             
-            elif op == "LOAD_VAR":
-                if b not in self.vars:
-                    if any(k.startswith(f"{b}.") for k in self.vars):
-                        self.regs[a.id] = _ModuleNamespace(b)
-                    
-                    else:
-                        raise RuntimeError(
-                            message=f"Undefined variable '{b}'",
-                            ip=self.ip
-                        )
-                
-                else:
-                    self.regs[a.id] = self.vars[b]
+            return (_IC_FIELD, offset)
+        
+        try:
+            return (_IC_MEMBER, resolve_member(obj, attr_name))
+        
+        except AttributeError as e:
+            raise RuntimeError(
+                message=str(e),
+                ip=self.ip
+            )
+    
+    def op_GET_ATTR(self, instr):
+        obj = self.regs[instr.b]
+        attr_name = instr.c
+        
+        cache = instr.cache
+        entry = cache.entries.get(type(obj))
+        if entry is None:
+            entry = self._resolve_attr(obj, attr_name)
+            cache.miss(type(obj), entry)
+        else:
+            cache.hits += 1
+        
+        kind, value = entry
+        if kind == _IC_FIELD:
+            self.regs[instr.a] = obj[value]
+        
+        elif kind == _IC_EXPORT:
+            if attr_name not in obj.exports:
+                raise RuntimeError(
+                    message=f"Module '{obj.name}' has no export '{attr_name}'",
+                    ip=self.ip
+                )
             
-            elif op == "STORE_VAR":
-                self.vars[a] = self.regs[b.id]
+            self.regs[instr.a] = obj.exports[attr_name]
+        
+        else:
+            try:
+                self.regs[instr.a] = value(obj, [])
             
-            elif op == "GET_ATTR":
-                obj = self.regs[b.id]
-                attr_name = c
-                
-                if isinstance(obj, _ModuleNamespace):
-                    ns_key = f"{obj.alias}.{attr_name}"
-                    if ns_key not in self.vars:
-                        raise RuntimeError(
-                            message=f"Module '{obj.alias}' has no export '{attr_name}'",
-                            ip=self.ip
-                        )
-                    
-                    self.regs[a.id] = self.vars[ns_key]
-                
-                elif isinstance(obj, dict):
-                    if attr_name not in obj:
-                        raise RuntimeError(
-                            message=f"Struct has no field '{attr_name}'",
-                            ip=self.ip
-                        )
-                    
-                    self.regs[a.id] = obj[attr_name]
-                
-                else:
-                    try:
-                        handler = resolve_member(obj, attr_name)
-                        self.regs[a.id] = handler(obj, [])
-                    
-                    except AttributeError as e:
-                        raise RuntimeError(
-                            message=str(e),
-                            ip=self.ip
-                        )
+            except AttributeError as e:
+                raise RuntimeError(
+                    message=str(e),
+                    ip=self.ip
+                )
+    
+    def _resolve_method(self, obj, method_name):
+        if isinstance(obj, ModuleNamespace):
+            return (_IC_EXPORT, None)
+        
+        if isinstance(obj, StructRecord):
+            method = self.struct_methods.get(obj.__type__, {}).get(method_name)
+            if method is not None:
+                return (_IC_METHOD, method)
+        
+        try:
+            return (_IC_MEMBER, resolve_member(obj, method_name))
+        
+        except AttributeError as e:
+            raise RuntimeError(
+                message=str(e),
+                ip=self.ip
+            )
+    
+    def op_CALL_METHOD(self, instr):
+        a = instr.a
+        obj = self.regs[instr.b]
+        method_name = instr.c
+        
+        # the first run of a site resolves the receiver's type, later runs with that type skip it
+        cache = instr.cache
+        entry = cache.entries.get(type(obj))
+        if entry is None:
+            entry = self._resolve_method(obj, method_name)
+            cache.miss(type(obj), entry)
+        else:
+            cache.hits += 1
+        
+        kind, value = entry
+        regs = self.regs
+        args = [regs[r] for r in instr.args]
+        
+        if kind == _IC_METHOD:
+            program, target_ip = value
+            self.push_frame(instr, a)
+            self.enter_segment(program)
+            self.ip = target_ip
+            self.enter_frame(program[target_ip], [obj] + args) # self is always the first param
+            return True
+        
+        if kind == _IC_EXPORT:
+            func_val = obj.exports.get(method_name)
             
-            elif op == "CALL_METHOD":
-                obj = self.regs[b.id]
-                method_name = c
-                arg_regs = getattr(instr, "arg_regs", [])
-                args = [self.regs[r.id] for r in arg_regs]
-                
-                if isinstance(obj, _ModuleNamespace):
-                    func_val = self.vars.get(f"{obj.alias}.{method_name}")
-                    
-                    if isinstance(func_val, tuple) and func_val[0] == "__func__":
-                        target_ip = func_val[1]
-                        self.call_stack.append((self.ip + 1, self.vars.copy(), self.regs[:], a))
-                        self.ip = target_ip
-                        label_instr = self.code[target_ip]
-                        param_names = getattr(label_instr, "param_names", [])
-                        self.vars = {}
-                        for name, val in zip(param_names, args):
-                            self.vars[name] = val
-                        continue
-                    
-                    raise RuntimeError(
-                        message=f"Module '{obj.alias}' has no function '{method_name}'",
-                        ip=self.ip
-                    )
-                
-                elif isinstance(obj, dict) and "__type__" in obj:
-                    struct_type = obj["__type__"]
-                    full_name = f"{struct_type}.{method_name}"
-                    
-                    if full_name in self.struct_methods:
-                        target_ip = self.struct_methods[full_name]
-                        self.call_stack.append((self.ip + 1, self.vars.copy(), self.regs[:], a))
-                        self.ip = target_ip
-                        label_instr = self.code[target_ip]
-                        param_names = getattr(label_instr, "param_names", [])
-                        
-                        self.vars = {}
-                        if param_names:
-                            self.vars[param_names[0]] = obj
-                            for name, val in zip(param_names[1:], args):
-                                self.vars[name] = val
-                        
-                        continue
-                
-                try:
-                    handler = resolve_member(obj, method_name)
-                    result = handler(obj, args)
-                    self.regs[a.id] = result
-                
-                except AttributeError as e:
-                    raise RuntimeError(
-                        message=str(e),
-                        ip=self.ip
-                    )
-                
-                except (TypeError, NotImplementedError) as e:
-                    raise RuntimeError(
-                        message=str(e),
-                        ip=self.ip
-                    )
+            if type(func_val) is tuple and func_val[0] == "__func__":
+                _, target_ip, program = func_val
+                self.push_frame(instr, a)
+                self.enter_segment(program)
+                self.ip = target_ip
+                self.enter_frame(program[target_ip], args)
+                return True
             
-            elif op == "CALL":
-                func_name = instr.a
-                
-                if func_name in self.builtins:
-                    builtin = self.builtins[func_name]
-                    arg_regs = getattr(instr, "arg_regs", [])
-                    ret = builtin(self, arg_regs)
-                    if hasattr(instr, "c") and instr.c:
-                        self.regs[instr.c.id] = ret
-                
-                else:
-                    func_val = self.vars.get(func_name)
-                    if isinstance(func_val, tuple) and func_val[0] == "__func__":
-                        target_ip = func_val[1]
-                    else:
-                        target_ip = self.find_label(func_name)
-                    
-                    # saves ip, vars, and dest reg
-                    self.call_stack.append((self.ip + 1, self.vars.copy(), self.regs[:], c))
-                    
-                    self.ip = target_ip
-                    self.vars = {}
+            raise RuntimeError(
+                message=f"Module '{obj.name}' has no function '{method_name}'",
+                ip=self.ip
+            )
+        
+        try:
+            regs[a] = value(obj, args)
+        
+        except (AttributeError, TypeError, NotImplementedError) as e:
+            raise RuntimeError(
+                message=str(e),
+                ip=self.ip
+            )
+    
+    def op_CALL(self, instr):
+        func_name = instr.a
+        
+        if func_name in self.builtins:
+            builtin = self.builtins[func_name]
+            ret = builtin(self, instr.args)
+            if instr.c is not None:
+                self.regs[instr.c] = ret
+            return
+        
+        target_ip = instr.b # resolved by the linker
+        program = self.code
+        if target_ip is None:
+            func_val = self.vars.get(func_name)
+            if type(func_val) is tuple and func_val[0] == "__func__":
+                _, target_ip, program = func_val
+            else:
+                target_ip = self.find_label(func_name)
+        
+        self.push_frame(instr, instr.c)
+        self.enter_segment(program)
+        
+        self.ip = target_ip
+        
+        # the LABEL instruction itself knows the frame layout
+        regs = self.regs
+        self.enter_frame(self.code[target_ip], [regs[r] for r in instr.args])
+        return True
+    
+    # `return f(...)`, the callee takes over this frame instead of pushing its own,
+    # so its RETURN goes straight back to our caller and deep tail recursion stays flat
+    def op_TAIL_CALL(self, instr):
+        func_name = instr.a
+        
+        target_ip = instr.b # resolved by the linker
+        program = self.code
+        if target_ip is None:
+            func_val = self.vars.get(func_name)
+            if type(func_val) is tuple and func_val[0] == "__func__":
+                _, target_ip, program = func_val
+            else:
+                target_ip = self.find_label(func_name)
+        
+        regs = self.regs
+        values = [regs[r] for r in instr.args]
+        
+        self.enter_segment(program)
+        self.ip = target_ip
+        self.enter_frame(self.code[target_ip], values)
+        return True
+    
+    def op_CALL_BUILTIN(self, instr):
+        builtin = self.builtins[instr.a]
+        ret = builtin(self, instr.args)
+        if instr.c is not None:
+            self.regs[instr.c] = ret
 
-                    # get param names from the LABEL instruction itself
-                    label_instr = self.code[target_ip]
-                    param_names = getattr(label_instr, "param_names", [])
-                    arg_regs = getattr(instr, "arg_regs", [])
+    def op_IMPORT_MODULE(self, instr):
+        alias, module_name = instr.a, instr.b
+        module = self._compile_and_run_module(module_name)
+        self.vars[alias] = module.namespace
+        
+        # functions stay in the module's own segment, so binding them is all an import costs
+        if self.bind_struct_methods(module.program, module.labels):
+            for cache in self.inline_caches:
+                cache.entries.clear() # a struct may have just gained methods
+            if self.jit is not None:
+                self.jit.invalidate() # traces bake in what their method calls resolved to
+        for name, cls in module.structs.items():
+            self.structs.setdefault(name, cls)
 
-                    for name, reg in zip(param_names, arg_regs):
-                        self.vars[name] = self.regs[reg.id]
+    def op_RETURN(self, instr):
+        ret_value = None
+        if instr.a is not None:
+            ret_value = self.regs[instr.a]
 
-                    continue
+        if self.call_stack:
+            frame = self.call_stack.pop()
+            self.ip = frame.return_ip
+            self.vars = frame.vars
+            self.locals = frame.locals
+            self.stack = frame.stack
+            self.code = frame.code
+            self.decoded = frame.decoded
             
-            elif op == "CALL_BUILTIN":
-                func_name = instr.a
-                arg_regs = instr.b
-                builtin = self.builtins[func_name]
-                ret = builtin(self, arg_regs)
-                if instr.c:
-                    self.regs[instr.c.id] = ret
-
-            elif op == "IMPORT_MODULE":
-                alias, module_name = a, b
-                module_vars, module_code = self._compile_and_run_module(module_name)
-                for var_name, value in module_vars.items():
-                    self.vars[f"{alias}.{var_name}"] = value
-                offset = len(self.code)
-                
-                # Patch all absolute jump targets in module_code to be offset-adjusted
-                from bootstrap.ir.ir import Instr as _Instr
-                patched_module_code = []
-                for minstr in module_code:
-                    new_instr = _Instr(minstr.op, minstr.a, minstr.b, minstr.c)
-                    
-                    for attr in ("arg_regs", "param_names", "fields", "struct_names", "methods"):
-                        if hasattr(minstr, attr):
-                            setattr(new_instr, attr, getattr(minstr, attr))
-                    
-                    if minstr.op == "JUMP" and isinstance(minstr.a, int):
-                        new_instr.a = minstr.a + offset
-                    
-                    elif minstr.op in ("JUMP_IF_TRUE", "JUMP_IF_FALSE") and isinstance(minstr.b, int):
-                        new_instr.b = minstr.b + offset
-                    
-                    patched_module_code.append(new_instr)
-                
-                self.code = self.code + patched_module_code
-                for i, minstr in enumerate(patched_module_code):
-                    if (minstr.op == "LABEL" and minstr.a != "__main__"
-                        and not getattr(minstr, "struct_names", None)):
-                        self.vars[f"{alias}.{minstr.a}"] = ("__func__", offset + i)
-
-            elif op == "RETURN":
-                ret_value = None
-                if a is not None:
-                    ret_value = self.regs[a.id]
-
-                if self.call_stack:
-                    self.ip, caller_vars, saved_regs, dest_reg = self.call_stack.pop()
-                    self.vars = caller_vars
-                    self.regs = saved_regs
+            regs = self.regs
+            for reg_id, value in zip(frame.live_regs, frame.saved):
+                regs[reg_id] = value
 
-                    if ret_value is not None and dest_reg is not None:
-                        self.regs[dest_reg.id] = ret_value
-
-                    continue
-                else:
-                    break
-            
-            elif op == "BUILD_LIST":
-                arg_regs = getattr(instr, "arg_regs", [])
-                self.regs[a.id] = [self.regs[r.id] for r in arg_regs]
-            
-            elif op == "BUILD_STRUCT":
-                # works alongside `STRUCT_DEF` below
-                arg_regs = getattr(instr, "arg_regs", [])
-                struct_name = b
-                fields = self.structs.get(struct_name, {}).get("fields", [])
-                obj = {"__type__": struct_name}
-                
-                for field, reg in zip(fields, arg_regs):
-                    obj[field] = self.regs[reg.id]
-                
-                self.regs[a.id] = obj
-            
-            elif op == "STRUCT_DEF":
-                self.structs[instr.a] = {
-                    "fields": getattr(instr, "fields", []),
-                    "methods": getattr(instr, "methods", [])
-                }
-            
-            elif op == "LABEL":
-                if getattr(instr, "struct_names", None) is not None:
-                    self.struct_methods[instr.a] = self.ip
-            
-            elif op == "JUMP":
-                self.ip = a
-                continue
-            
-            elif op == "JUMP_IF_TRUE":
-                if self.regs[a.id]:
-                    self.ip = b
-                    continue
-            
-            elif op == "JUMP_IF_FALSE":
-                if not self.regs[a.id]:
-                    self.ip = b
-                    continue
-            
-            elif op == "MOVE":
-                self.regs[a.id] = self.regs[b.id]
-            
-            # spilling
-            elif op == "SPILL_STORE":
-                self.stack[a] = self.regs[b.id]
+            # dest isn't among the saved regs, so a `return ()` still has to overwrite whatever the
+            # callee left in it
+            if frame.dest is not None:
+                regs[frame.dest] = ret_value
+        
+        else:
+            self.ip = len(self.decoded) # top-level return halts the vm
+        
+        return True
+    
+    def op_BUILD_LIST(self, instr):
+        self.regs[instr.a] = [self.regs[r] for r in instr.args]
+    
+    def op_BUILD_STRUCT(self, instr):
+        # works alongside `STRUCT_DEF` below
+        record = self.structs.get(instr.b)
+        if record is None:
+            raise RuntimeError(
+                message=f"Unknown struct '{instr.b}'",
+                ip=self.ip
+            )
+        
+        regs = self.regs
+        self.regs[instr.a] = record([regs[r] for r in instr.args])
+    
+    def op_STRUCT_DEF(self, instr):
+        self.structs[instr.a] = record_type(instr.a, instr.args)
+    
+    def op_GET_FIELD(self, instr):
+        # c = field offset, only emitted where the struct type is known statically
+        self.regs[instr.a] = self.regs[instr.b][instr.c]
+    
+    def op_LABEL(self, instr):
+        pass # resolved at link time
+    
+    def op_JUMP(self, instr):
+        target = instr.a
+        if target <= self.ip and self.jit is not None:
+            return self.jit.back_edge(self, target) # loops close with a backward JUMP
+        
+        self.ip = target
+        return True
+    
+    def op_JUMP_IF_TRUE(self, instr):
+        if self.regs[instr.a]:
+            self.ip = instr.b
+            return True
+    
+    def op_JUMP_IF_FALSE(self, instr):
+        if not self.regs[instr.a]:
+            self.ip = instr.b
+            return True
+    
+    # fused compare-and-branch, `not (x < y)` rather than `x >= y` so nan behaves like LT + JUMP_IF_FALSE
+    def op_JUMP_IF_NOT_EQ(self, instr):
+        if not (self.regs[instr.a] == self.regs[instr.b]):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_NE(self, instr):
+        if not (self.regs[instr.a] != self.regs[instr.b]):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_LT(self, instr):
+        if not (self.regs[instr.a] < self.regs[instr.b]):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_GT(self, instr):
+        if not (self.regs[instr.a] > self.regs[instr.b]):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_LE(self, instr):
+        if not (self.regs[instr.a] <= self.regs[instr.b]):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_GE(self, instr):
+        if not (self.regs[instr.a] >= self.regs[instr.b]):
+            self.ip = instr.c
+            return True
+    
+    # LOAD_CONST folded into the compare, b is the constant itself
+    def op_JUMP_IF_NOT_EQ_IMM(self, instr):
+        if not (self.regs[instr.a] == instr.b):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_NE_IMM(self, instr):
+        if not (self.regs[instr.a] != instr.b):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_LT_IMM(self, instr):
+        if not (self.regs[instr.a] < instr.b):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_GT_IMM(self, instr):
+        if not (self.regs[instr.a] > instr.b):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_LE_IMM(self, instr):
+        if not (self.regs[instr.a] <= instr.b):
+            self.ip = instr.c
+            return True
+    
+    def op_JUMP_IF_NOT_GE_IMM(self, instr):
+        if not (self.regs[instr.a] >= instr.b):
+            self.ip = instr.c
+            return True
+    
+    def op_MOVE(self, instr):
+        self.regs[instr.a] = self.regs[instr.b]
+    
+    # spilling
+    def op_SPILL_STORE(self, instr):
+        self.stack[instr.a] = self.regs[instr.b]
 
-            elif op == "SPILL_LOAD":
-                self.regs[a.id] = self.stack[b] # im conflicted... is it a then b, or b then a??
-            
-            # arithmetic
-            elif op == "ADD":
-                self.regs[a.id] = self.regs[b.id] + self.regs[c.id]
-            elif op == "SUB":
-                self.regs[a.id] = self.regs[b.id] - self.regs[c.id]
-            elif op == "MUL":
-                self.regs[a.id] = self.regs[b.id] * self.regs[c.id]
-            elif op == "DIV":
-                self.regs[a.id] = self.regs[b.id] / self.regs[c.id]
-            elif op == "POW":
-                self.regs[a.id] = self.regs[b.id] ** self.regs[c.id]
-            elif op == "NEG":
-                self.regs[a.id] = -self.regs[b.id]
-            elif op == "NOT":
-                self.regs[a.id] = not self.regs[b.id]
+    def op_SPILL_LOAD(self, instr):
+        self.regs[instr.a] = self.stack[instr.b] # im conflicted... is it a then b, or b then a??
+    
+    # arithmetic
+    def op_ADD(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] + self.regs[instr.c]
+    
+    def op_SUB(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] - self.regs[instr.c]
+    
+    def op_MUL(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] * self.regs[instr.c]
+    
+    def op_DIV(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] / self.regs[instr.c]
+    
+    def op_POW(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] ** self.regs[instr.c]
+    
+    # type-specialised arithmetic, same semantics as the generic ops above, but each handler
+    # only ever sees one kind of operand, so the host interpreter keeps its own fast path for it
+    def op_ADD_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] + self.regs[instr.c]
+    
+    def op_SUB_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] - self.regs[instr.c]
+    
+    def op_MUL_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] * self.regs[instr.c]
+    
+    def op_DIV_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] / self.regs[instr.c]
+    
+    def op_POW_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] ** self.regs[instr.c]
+    
+    def op_CONCAT_STR(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] + self.regs[instr.c]
+    
+    # LOAD_CONST folded into the op, c is the constant itself
+    def op_ADD_IMM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] + instr.c
+    
+    def op_SUB_IMM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] - instr.c
+    
+    def op_MUL_IMM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] * instr.c
+    
+    def op_NEG(self, instr):
+        self.regs[instr.a] = -self.regs[instr.b]
+    
+    def op_NOT(self, instr):
+        self.regs[instr.a] = not self.regs[instr.b]
 
-            # comparisons
-            elif op == "EQ":
-                self.regs[a.id] = self.regs[b.id] == self.regs[c.id]
-            elif op == "NE":
-                self.regs[a.id] = self.regs[b.id] != self.regs[c.id]
-            elif op == "LT":
-                self.regs[a.id] = self.regs[b.id] < self.regs[c.id]
-            elif op == "GT":
-                self.regs[a.id] = self.regs[b.id] > self.regs[c.id]
-            elif op == "LE":
-                self.regs[a.id] = self.regs[b.id] <= self.regs[c.id]
-            elif op == "GE":
-                self.regs[a.id] = self.regs[b.id] >= self.regs[c.id]
-            elif op == "AND":
-                self.regs[a.id] = self.regs[b.id] and self.regs[c.id]
+    # comparisons
+    def op_EQ(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] == self.regs[instr.c]
+    
+    def op_NE(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] != self.regs[instr.c]
+    
+    def op_LT(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] < self.regs[instr.c]
+    
+    def op_GT(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] > self.regs[instr.c]
+    
+    def op_LE(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] <= self.regs[instr.c]
+    
+    def op_GE(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] >= self.regs[instr.c]
+    
+    def op_EQ_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] == self.regs[instr.c]
+    
+    def op_NE_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] != self.regs[instr.c]
+    
+    def op_LT_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] < self.regs[instr.c]
+    
+    def op_GT_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] > self.regs[instr.c]
+    
+    def op_LE_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] <= self.regs[instr.c]
+    
+    def op_GE_NUM(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] >= self.regs[instr.c]
+    
+    def op_AND(self, instr):
+        self.regs[instr.a] = self.regs[instr.b] and self.regs[instr.c]
 
-            else:
-                raise UnknownOpcodeError(
-                    message=f"Unknown opcode {op}",
-                    ip=self.ip,
-                    instruction=f"{op} {instr.a} {instr.b} {instr.c}"
-                )
+class Frame:
+    __slots__ = ("return_ip", "vars", "locals", "stack", "live_regs", "saved", "dest", "code", "decoded")
     
-            self.ip += 1
+    def __init__(self, return_ip, vars, locals, stack, live_regs, saved, dest, code, decoded):
+        self.return_ip = return_ip
+        self.vars = vars           # caller's dynamic names
+        self.locals = locals       # caller's frame slots
+        self.stack = stack         # caller's spill slots
+        self.live_regs = live_regs # caller registers live across the call
+        self.saved = saved         # their values at call time
+        self.dest = dest           # reg receiving the return value
+        self.code = code           # caller's segment, return_ip is relative to it
+        self.decoded = decoded
 
-class _ModuleNamespace:
-    def __init__(self, alias):
-        self.alias = alias
+# per-site cache for GET_ATTR / CALL_METHOD, receiver type -> (kind, resolved value)
+#   _IC_FIELD   - struct field offset
+#   _IC_METHOD  - struct method (segment, ip)
+#   _IC_MEMBER  - str / list / number member handler from methods.py
+#   _IC_EXPORT  - module namespace, the export dict still has to be read
+class InlineCache:
+    __slots__ = ("ip", "op", "name", "entries", "hits", "misses", "megamorphic")
+    
+    def __init__(self, ip, op, name):
+        self.ip = ip
+        self.op = op
+        self.name = name
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.megamorphic = False
+    
+    def miss(self, receiver_type, entry):
+        self.misses += 1
+        if receiver_type in self.entries or len(self.entries) < IC_MAX_ENTRIES:
+            self.entries[receiver_type] = entry
+        else:
+            self.megamorphic = True # full, every new type from here on resolves the slow way
     
-    def __repr__(self):
-        return f"<module:{self.alias}>"
\ No newline at end of file
+    def stats(self):
+        return {
+            "ip": self.ip,
+            "op": self.op,
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "types": [t.__name__ for t in self.entries],
+            "megamorphic": self.megamorphic,
+        }
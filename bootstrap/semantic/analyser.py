@@ -4,9 +4,8 @@ from bootstrap.semantic.types import *
 from bootstrap.frontend.ast_nodes import *
 from bootstrap.exceptions import *
 from bootstrap.runtime.builtins_registry import BUILTINS
+from bootstrap.runtime.modules import MODULES
 
-from bootstrap.frontend.lexer import Lexer
-from bootstrap.frontend.parser import Parser
 from bootstrap.semantic.symbol_table import SymbolTable
 
 # message for future-josh
@@ -27,8 +26,9 @@ class Analyser:
         self.imported_modules = set()
     
     def _analyse_import(self, node):
-        path = os.path.join(self.source_dir, f"{node.module_name}.fg")
-        if not os.path.exists(path):
+        module = MODULES.load(node.module_name, self.source_dir)
+        if module is None:
+            path = os.path.join(self.source_dir, f"{node.module_name}.fg")
             raise ImportError(
                 message=f"Cannot find module '{node.module_name}' at '{path}'",
                 line=node.line,
@@ -39,14 +39,8 @@ class Analyser:
             return # already imported
         self.imported_modules.add(node.module_name)
         
-        with open(path, "r", encoding="utf-8") as f:
-            source = f.read()
-
-        tokens = Lexer(source).get_tokens()
-        module_tree = Parser(tokens).parse()
-        module_symbols = SymbolTable()
-        child_analyser = Analyser(module_symbols, source_dir=self.source_dir)
-        child_analyser.analyse(module_tree)
+        # parsed + analysed once per process, the vm reuses the same tree when it compiles the import
+        MODULES.analyse(module, source_dir=self.source_dir)
         
         self.symbols.define(
             node.alias,
@@ -191,6 +185,7 @@ class Analyser:
         elif isinstance(node, BinOp):
             left = self.analyse(node.left)
             right = self.analyse(node.right)
+            node.operand_types = (left, right) # before any adopting, the ir generator specialises on these
 
             # if left is unknown, adopt right's type
             if isinstance(left, UnknownType):
@@ -228,6 +223,7 @@ class Analyser:
         elif isinstance(node, Compare):
             left = self.analyse(node.left)
             right = self.analyse(node.comparators[0])
+            node.operand_types = (left, right) # first pair only
 
             if not left.is_compatible(right):
                 raise TypeError(
@@ -256,6 +252,8 @@ class Analyser:
             for stmt in node.body.statements:
                 self.analyse(stmt)
 
+            # params first, then every local, the ir generator numbers frame slots in this order
+            node.local_names = list(self.symbols.scopes[-1])
             self.current_function = old_fn
             self.symbols.exit_scope()
         
@@ -346,6 +344,7 @@ class Analyser:
                 stmts = method.body.statements if hasattr(method.body, "statements") else method.body
                 for stmt in stmts:
                     self.analyse(stmt)
+                method.local_names = list(self.symbols.scopes[-1])
                 self.current_function = old_fn
                 self.current_struct_fields = old_fields
                 self.symbols.exit_scope()
@@ -1,17 +1,15 @@
 from time import time
 from pathlib import Path
 import os
+import sys
 
-from bootstrap.frontend.lexer import Lexer
-from bootstrap.frontend.parser import Parser
-from bootstrap.semantic.analyser import Analyser
-from bootstrap.semantic.symbol_table import SymbolTable
-from bootstrap.optimiser.optimiser import Optimiser
-from bootstrap.ir.generator import IRGenerator
-from bootstrap.ir.cfg_builder import build_cfg
-from bootstrap.ir.liveness import compute_liveness, eliminate_dead_stores, remove_unreachable
-from bootstrap.runtime.regalloc import linear_scan_allocate
+from bootstrap.compiler import compile_cfg, compile_allocated, compile_source
+from bootstrap.ir.inliner import INLINE_BUDGET
+from bootstrap.runtime.regalloc import NUM_REGS
+from bootstrap.runtime.bytecode import lower, cache_key, cache_path, read_fgc, write_fgc
 from bootstrap.runtime.vm import VM
+from bootstrap.backend.pygen import PyRuntime, SkipOutput, compile_cfg as compile_python
+from bootstrap.backend.cgen import run_native
 
 from bootstrap.ir.operands import Reg, Imm
 from bootstrap.exceptions import *
@@ -33,57 +31,82 @@ def run_file(filepath):
         code = f.read()
     run_source(code, source_dir=source_dir, filename=filepath)
 
-def run_source(code, source_dir=".", filename="<string>", num_regs=1024):
+# use_cache: real files get a .fgc next to them, keyed on the source hash + bytecode version, and
+#            thrown away once a module they import changes
+# ic_stats: print hit / miss counts of every GET_ATTR / CALL_METHOD inline cache after the run
+# superinstructions: fuse the common op sequences (see bootstrap/runtime/superinstructions.py)
+# backend: "vm", or "python" to compile every function to python and let CPython run it (recursion
+#          too deep for the python stack reruns on the vm),
+#          or "c" to build it with cc, anything the c backend can't do still runs on the vm
+# inline_budget: ast nodes of small functions that may be copied into their callers, 0 turns it off
+# jit: trace hot loops into python closures (see bootstrap/runtime/jit.py)
+# jit_stats: print every traced loop's entries, iterations and guard exits after the run
+# allocator: "linear" scan, or "colour" for graph colouring, slower to compile but coalesces MOVEs and
+#            spills what's used least in loops (see bootstrap/runtime/colouring.py)
+def run_source(code, source_dir=".", filename="<string>", num_regs=NUM_REGS, use_cache=True, ic_stats=False, superinstructions=True, backend="vm", inline_budget=INLINE_BUDGET, jit=True, jit_stats=False, allocator="linear"):
     start = time()
     
     try:
-        lexer = Lexer(code)
-        tokens = lexer.get_tokens()
-        #print(tokens)
-
-        parser = Parser(tokens)
-        tree = parser.parse()
-        #parser.dump(tree)
-
-        symbol_table = SymbolTable()
-        semantic_analysis = Analyser(symbol_table, source_dir=source_dir)
-        semantic_analysis.analyse(tree)
-
-        optimiser = Optimiser()
-        tree = optimiser.optimise(tree)
-        #parser.dump(tree)
-
-        ir_generator = IRGenerator()
-        ir_generator.generate(tree)
-        #ir_generator.ir.dump()
+        skip = 0 # output a python run printed before it fell back to the vm
+        if backend == "python":
+            unit = compile_python(compile_cfg(code, source_dir=source_dir, inline_budget=inline_budget))
+            runtime = PyRuntime(num_regs=num_regs, source_dir=source_dir)
+            
+            start_run = time()
+            if runtime.run(unit):
+                print(f"compile: {start_run - start:.4f}s")
+                print(f"run: {time() - start_run:.4f}s")
+                print(f"total: {time() - start:.4f}s")
+                return
+            
+            skip = runtime.written
+            print("python backend: falling back to the vm (recursion too deep for the python stack)", file=sys.stderr)
         
-        cfg = build_cfg(ir_generator.ir.code)
-        #cfg.dump()
-        remove_unreachable(cfg) # first
-        compute_liveness(cfg) # second
-        eliminate_dead_stores(cfg) # third
-        #cfg.dump()
-
-        flat_code = cfg.flatten()
-        allocated = linear_scan_allocate(flat_code, num_regs=num_regs)
-
-        #for i, instr in enumerate(allocated):
-        #    print(f"realloc{i} {instr.op} {fmt(instr.a)} {fmt(instr.b)} {fmt(instr.c)}") #:04 to pad to 4 0's
-
-        start_vm = time()
-
-        vm = VM(num_regs=num_regs, source_dir=source_dir)
-        vm.code = allocated
+        fgc_path = cache_path(filename) if use_cache and filename != "<string>" else None
+        key = cache_key(code, num_regs, superinstructions, inline_budget, allocator)
+        cached = read_fgc(fgc_path, key, source_dir) if fgc_path and backend == "vm" else None
+        
+        if cached is not None:
+            program, labels = cached
+        
+        elif backend == "c":
+            allocated, labels = compile_allocated(code, source_dir=source_dir, num_regs=num_regs, superinstructions=superinstructions, inline_budget=inline_budget, allocator=allocator)
+            
+            start_run = time()
+            output = run_native(allocated)
+            if output is not None:
+                sys.stdout.write(output)
+                print(f"compile: {start_run - start:.4f}s")
+                print(f"run: {time() - start_run:.4f}s")
+                print(f"total: {time() - start:.4f}s")
+                return
+            
+            program = lower(allocated)
+        
+        else:
+            program, labels = compile_source(code, source_dir=source_dir, num_regs=num_regs, superinstructions=superinstructions, inline_budget=inline_budget, allocator=allocator)
+            if fgc_path:
+                write_fgc(fgc_path, key, program, labels, source_dir)
+
+        vm = VM(num_regs=num_regs, source_dir=source_dir, jit=jit)
+        vm.code = program
+        vm.labels = labels
         start_ip = vm.find_label("__main__")
         vm.ip = start_ip
         
         start_vm = time()
-        vm.run(allocated)
+        with SkipOutput(skip):
+            vm.run(program)
         #vm.dump_regs()
         
         print(f"compile: {start_vm - start:.4f}s")
         print(f"run: {time() - start_vm:.4f}s")
         print(f"total: {time() - start:.4f}s")
+        
+        if ic_stats:
+            vm.dump_inline_caches()
+        if jit_stats:
+            vm.dump_jit()
 
     except CompileError as e:
         print(format_diagnostic(
@@ -127,7 +150,7 @@ if __name__ == "__main__":
 #DONE module system
 #     decent optimiser
 #     better backend (x86-64)
-#     bytecode + vm backend (its never too late to back down btw)
+#DONE bytecode + vm backend (its never too late to back down btw)
 #     self-hosting
 
 # further additions to my pain
@@ -135,7 +158,7 @@ if __name__ == "__main__":
 #DONE list / arrays
 #     multiple return values
 #     error messages through vm
-#     proper call frame model instead of copying vars every call
+#DONE proper call frame model instead of copying vars every call
 #     string interpolations (hopefully josh knows what this means)
 #     default function arugments
 #DONE break / continue in loops
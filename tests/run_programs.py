@@ -0,0 +1,104 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# every program in tests/programs with a .out next to it is run in each mode below and has to print
+# exactly that .out, the .fg files without one are modules the programs import.
+# `python -m tests.run_programs [--update] [names...]`, --update writes the .out files from the vm, a new
+# program gets its first one by being named
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRAMS = os.path.join(ROOT, "tests", "programs")
+
+# mode -> run_source kwargs, "fgc" runs twice and checks the second run, the one loaded from the .fgc
+MODES = {
+    "vm": {"use_cache": False},
+    "vm, no jit": {"use_cache": False, "jit": False},
+    "vm, no inlining": {"use_cache": False, "inline_budget": 0},
+    "vm, no superinstructions": {"use_cache": False, "superinstructions": False},
+    "colour": {"use_cache": False, "allocator": "colour"},
+    "fgc": {"use_cache": True},
+    "python": {"use_cache": False, "backend": "python"},
+    "c": {"use_cache": False, "backend": "c"},
+}
+
+TIMING = re.compile(r"^(compile|run|total): \d+\.\d+s$")
+
+# each run gets its own interpreter, a crash (or the python backend overflowing the C stack) only
+# fails that one run
+RUNNER = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import main
+path, kwargs = sys.argv[2], eval(sys.argv[3])
+with open(path, "r", encoding="utf-8") as f:
+    source = f.read()
+main.run_source(source, source_dir=sys.argv[4], filename=path, **kwargs)
+"""
+
+# stdout without the timings, and the exit code when it isn't 0. stderr only says which backend fell
+# back to the vm, so it's kept for the report but not compared
+def run(path, kwargs):
+    result = subprocess.run(
+        [sys.executable, "-c", RUNNER, ROOT, path, repr(kwargs), os.path.dirname(path)],
+        capture_output=True, text=True
+    )
+    output = "".join(line for line in result.stdout.splitlines(keepends=True) if not TIMING.match(line.rstrip("\n")))
+    if result.returncode != 0:
+        output += f"<exit {result.returncode}>\n"
+    return output, result.stderr
+
+def main(argv):
+    update = "--update" in argv
+    names = [arg for arg in argv if not arg.startswith("--")]
+
+    programs = names or sorted(
+        name[:-3] for name in os.listdir(PROGRAMS)
+        if name.endswith(".fg") and os.path.exists(os.path.join(PROGRAMS, name[:-3] + ".out"))
+    )
+
+    failed = []
+    with tempfile.TemporaryDirectory() as scratch:
+        # a copy, so the .fgc files land in the scratch dir and every run starts without one
+        for name in os.listdir(PROGRAMS):
+            if name.endswith(".fg"):
+                shutil.copy(os.path.join(PROGRAMS, name), scratch)
+
+        for name in programs:
+            path = os.path.join(scratch, name + ".fg")
+            expected_path = os.path.join(PROGRAMS, name + ".out")
+
+            if update:
+                with open(expected_path, "w", encoding="utf-8") as f:
+                    f.write(run(path, MODES["vm"])[0])
+                print(f"wrote {name}.out")
+                continue
+
+            with open(expected_path, "r", encoding="utf-8") as f:
+                expected = f.read()
+
+            wrong = []
+            for mode, kwargs in MODES.items():
+                if mode == "fgc":
+                    run(path, kwargs)
+                got, stderr = run(path, kwargs)
+                if got != expected:
+                    wrong.append(mode)
+                    failed.append((name, mode, expected, got + stderr))
+            print(f"{'FAIL' if wrong else 'ok':>4} {name}" + (f" ({', '.join(wrong)})" if wrong else ""))
+
+    if update:
+        return
+
+    for name, mode, expected, got in failed:
+        print(f"\n{name} ({mode}), expected:\n{expected}got:\n{got}")
+
+    print(f"\n{len(programs) * len(MODES) - len(failed)} passed, {len(failed)} failed")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])